@@ -1,37 +1,47 @@
-import ujson
+import argparse
+import os
 from pathlib import Path
-from tqdm import tqdm
-import shutil
+
+from src.common import fused, ids, metrics
 
 DATA_DIR = Path("data/processed")
 
-def add_ids_to_file(path):
-    print(f"Processing {path.name}...")
-    temp_path = path.with_suffix(".tmp")
-    
-    # Use the filename (without extension) as the ID prefix
-    # e.g., code_silver.jsonl -> "code_silver_0", "code_silver_1"...
-    prefix = path.stem 
-    
-    count = 0
-    with path.open("r") as fin, temp_path.open("w") as fout:
-        for i, line in enumerate(fin):
-            try:
-                row = ujson.loads(line)
-            except ValueError:
-                continue # Skip broken lines
-
-            # Add ID if missing
-            if "id" not in row:
-                row["id"] = f"{prefix}_{i}"
-            
-            fout.write(ujson.dumps(row) + "\n")
-            count += 1
-            
-    # Safely replace the old file
-    shutil.move(temp_path, path)
-    print(f"-> Updated {count} rows in {path.name}")
+# Worker processes (tasks = byte ranges of JSONL files + Parquet shard files)
+NUM_WORKERS = os.cpu_count() or 1
+
+# Target size of each JSONL byte range handed to a worker
+CHUNK_BYTES = 32 * 1024 * 1024
+
+# IDs are "{stem}_{content hash}" (src/common/ids.py), e.g.
+# code_silver.jsonl -> "code_silver_9f3c0e5a17b2d481". Existing IDs
+# (positional "{stem}_{i}", nvidia_om2_{n}) are replaced.
+
+def add_ids(paths, num_workers=NUM_WORKERS):
+    """
+    Assigns content IDs to every row of the given JSONL files / shard
+    directories in a worker pool. Uniqueness is checked across all of them
+    on a uint64 array of content hashes: rows repeating earlier content
+    (same normalized problem + response) get "-1", "-2", ... so IDs stay
+    unique. Returns the number of such repeats.
+    """
+    paths = [Path(p) for p in paths]
+    with metrics.stage("add_ids", (paths[0].parent if paths else DATA_DIR) / "add_ids.metrics.json"):
+        print(f"🆔 Assigning content IDs: {len(paths)} files, {num_workers} workers")
+        stage = ids.IdStage()
+        results = fused.run(paths, [stage], num_workers, CHUNK_BYTES, desc="Hashing")
+        for path, (written, _) in results.items():
+            print(f"-> Updated {written} rows in {path.name}")
+
+        if stage.repeats:
+            print(f"⚠️ {stage.repeats} rows repeat earlier content (same problem + response); their IDs got a -k suffix")
+        print(f"✅ {stage.rows} unique IDs")
+    return stage.repeats
 
 if __name__ == "__main__":
-    for file in DATA_DIR.glob("*.jsonl"):
-        add_ids_to_file(file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Assign content-addressed IDs to the processed sources.")
+    parser.add_argument("paths", nargs="*", type=Path, help="Files / shard directories (default: all of DATA_DIR)")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(DATA_DIR.glob("*.jsonl")) + sorted(p for p in DATA_DIR.glob("*.parquet") if p.is_dir())
+    add_ids(paths, args.workers)
@@ -0,0 +1,240 @@
+import argparse
+import contextlib
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import ujson
+from pathlib import Path
+
+from src.bench import synth
+
+# --- CONFIGURATION ---
+BENCH_DIR = Path("data/bench")
+# One JSON record per run, appended; compared against the previous run of the same scale
+RESULTS = BENCH_DIR / "results.jsonl"
+
+STAGES = ["scrub", "add_ids", "build_mix", "build_pilot"]
+# Opt-in (--stages postprocess): scrub + add_ids + build_mix fused into one run
+OPTIONAL_STAGES = ["postprocess"]
+NUM_WORKERS = os.cpu_count() or 1
+
+# A stage counts as regressed when its rows/s drops by more than this
+REGRESSION = 0.10
+
+def corpus_dir(rows, seed):
+    return BENCH_DIR / f"corpus-{rows}-{seed}"
+
+def jsonl_files(data_dir):
+    return sorted((data_dir / "processed").glob("*.jsonl"))
+
+def count_lines(paths):
+    total = 0
+    for p in paths:
+        with open(p, "rb") as f:
+            total += sum(1 for _ in f)
+    return total
+
+# --- STAGES (run inside a fresh child process, see run_stage) ---
+# Each points the stage's module-level paths at the work tree, runs it and
+# returns (rows, bytes) processed.
+
+def stage_scrub(work, workers):
+    from src.common import schema
+    from src.safety import keywords, ngrams, scrub
+    scrub.BLOCKLIST_PATH = work / "blocklist" / "aimo_ref.txt"
+    scrub.CACHE_DIR = work / "blocklist" / ".cache"
+    keywords.PATTERNS_PATH = work / "blocklist" / "keywords.txt"
+    ngrams.EVAL_SOURCES = [scrub.BLOCKLIST_PATH, work / "blocklist" / "evals"]
+    ngrams.CACHE_DIR = scrub.CACHE_DIR
+    schema.QUARANTINE_DIR = work / "quarantine"
+    scrub.DATA_DIR = work / "processed"
+    files = jsonl_files(work)
+    rows, size = count_lines(files), sum(p.stat().st_size for p in files)
+    scrub.scrub_files(num_workers=workers)
+    return rows, size
+
+def stage_add_ids(work, workers):
+    from scripts import add_ids
+    files = jsonl_files(work)
+    rows, size = count_lines(files), sum(p.stat().st_size for p in files)
+    add_ids.add_ids(files, workers)
+    return rows, size
+
+def stage_build_mix(work, workers):
+    from src.mixing import build_mix
+    build_mix.FILES = {
+        name: (str(work / "processed" / f"{name}.jsonl"), weight)
+        for name, (_, weight) in build_mix.FILES.items()
+    }
+    build_mix.OUT = work / "gold" / "aimo_system2_final.jsonl"
+    build_mix.BUCKET_DIR = build_mix.OUT.parent / ".mix_buckets"
+    build_mix.build_mix()
+    return count_lines([build_mix.OUT]), build_mix.OUT.stat().st_size
+
+def stage_build_pilot(work, workers):
+    from src.mixing import build_pilot
+    build_pilot.INPUT_DIR = work / "processed"
+    build_pilot.OUTPUT_FILE = work / "gold" / "pilot_micro.jsonl"
+    # Indexes every input file, decodes only the sample: measured on the inputs
+    files = jsonl_files(work)
+    build_pilot.build_micro()
+    return count_lines(files), sum(p.stat().st_size for p in files)
+
+def stage_postprocess(work, workers):
+    from src.mixing import build_mix
+    from src.pipeline import postprocess
+    from src.common import schema
+    from src.safety import keywords, ngrams, scrub
+    scrub.BLOCKLIST_PATH = work / "blocklist" / "aimo_ref.txt"
+    scrub.CACHE_DIR = work / "blocklist" / ".cache"
+    keywords.PATTERNS_PATH = work / "blocklist" / "keywords.txt"
+    ngrams.EVAL_SOURCES = [scrub.BLOCKLIST_PATH, work / "blocklist" / "evals"]
+    ngrams.CACHE_DIR = scrub.CACHE_DIR
+    schema.QUARANTINE_DIR = work / "quarantine"
+    postprocess.DATA_DIR = work / "processed"
+    build_mix.FILES = {
+        name: (str(work / "processed" / f"{name}.jsonl"), weight)
+        for name, (_, weight) in build_mix.FILES.items()
+    }
+    build_mix.OUT = work / "gold" / "aimo_system2_final.jsonl"
+    build_mix.BUCKET_DIR = build_mix.OUT.parent / ".mix_buckets"
+    files = jsonl_files(work)
+    rows, size = count_lines(files), sum(p.stat().st_size for p in files)
+    postprocess.postprocess(workers)
+    return rows, size
+
+def run_stage(name, work, workers, result_path):
+    """Child entry point: runs one stage, writes its measurements to result_path."""
+    work = Path(work)
+    fn = globals()[f"stage_{name}"]
+    log_path = work / "logs" / f"{name}.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open("w") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        start = time.perf_counter()
+        rows, size = fn(work, workers)
+        seconds = time.perf_counter() - start
+    # ru_maxrss is KB on Linux; children = largest child process (pool workers) that exited
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    result = {
+        "seconds": round(seconds, 3),
+        "rows": rows,
+        "mb": round(size / 1e6, 2),
+        "rows_per_s": round(rows / seconds, 1),
+        "mb_per_s": round(size / 1e6 / seconds, 2),
+        "peak_rss_mb": round(own, 1),
+        "peak_children_rss_mb": round(children, 1),
+    }
+    Path(result_path).write_text(ujson.dumps(result))
+
+# --- DRIVER ---
+def git_commit():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def previous_run(rows, workers):
+    if not RESULTS.exists():
+        return None
+    last = None
+    with RESULTS.open() as f:
+        for line in f:
+            record = ujson.loads(line)
+            if record["rows"] == rows and record["workers"] == workers:
+                last = record
+    return last
+
+def compare(record, prev):
+    print(f"\n📊 Foundry benchmark: {record['rows']} rows, {record['workers']} workers @ {record['commit']}")
+    if prev:
+        print(f"   (vs {prev['commit']} from {prev['timestamp']})")
+    regressed = []
+    for name, r in record["stages"].items():
+        line = (f"  - {name:<12} {r['seconds']:8.2f}s  {r['rows_per_s']:>11,.0f} rows/s  "
+                f"{r['mb_per_s']:8.1f} MB/s  peak {r['peak_rss_mb']:.0f}MB (children {r['peak_children_rss_mb']:.0f}MB)")
+        old = prev["stages"].get(name) if prev else None
+        if old:
+            change = r["rows_per_s"] / old["rows_per_s"] - 1
+            line += f"  {change:+.1%}"
+            if change < -REGRESSION:
+                line += "  ⚠️"
+                regressed.append(name)
+        print(line)
+    return regressed
+
+def bench(rows, stages=STAGES, workers=NUM_WORKERS, seed=synth.SEED, keep=False):
+    corpus = corpus_dir(rows, seed)
+    if not (corpus / "processed").exists():
+        print(f"🧪 Generating {rows}-row corpus in {corpus}...")
+        synth.generate(corpus, rows, seed)
+
+    # Stages rewrite files in place: work on a copy of the corpus
+    work = BENCH_DIR / "work"
+    shutil.rmtree(work, ignore_errors=True)
+    shutil.copytree(corpus, work)
+
+    results = {}
+    for name in stages:
+        print(f"⏱️  {name}...")
+        result_path = work / f"{name}.result.json"
+        # One child per stage so peak RSS is per stage, not cumulative
+        subprocess.run(
+            [sys.executable, "-m", "src.bench.run", "--child", name, "--work", str(work),
+             "--workers", str(workers), "--result", str(result_path)],
+            check=True,
+        )
+        results[name] = ujson.loads(result_path.read_text())
+
+    sha, dirty = git_commit()
+    record = {
+        "commit": sha,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rows": rows,
+        "seed": seed,
+        "workers": workers,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "stages": results,
+    }
+    prev = previous_run(rows, workers)
+    regressed = compare(record, prev)
+
+    RESULTS.parent.mkdir(parents=True, exist_ok=True)
+    with RESULTS.open("a") as f:
+        f.write(ujson.dumps(record) + "\n")
+    print(f"💾 Appended to {RESULTS}")
+    if not keep:
+        shutil.rmtree(work)
+    return record, regressed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the foundry stages on a synthetic corpus.")
+    parser.add_argument("--rows", type=int, default=100_000, help="Corpus size (10k - 10M)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES + OPTIONAL_STAGES, default=STAGES)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--seed", type=int, default=synth.SEED)
+    parser.add_argument("--keep", action="store_true", help="Keep data/bench/work (outputs + per-stage logs)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help=f"Exit 1 if any stage is more than {REGRESSION:.0%} slower than the previous run")
+    # Internal: run a single stage in this process
+    parser.add_argument("--child", choices=STAGES + OPTIONAL_STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--work", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_stage(args.child, args.work, args.workers, args.result)
+        sys.exit(0)
+
+    _, regressed = bench(args.rows, args.stages, args.workers, args.seed, args.keep)
+    if regressed and args.fail_on_regression:
+        sys.exit(1)
@@ -0,0 +1,134 @@
+import argparse
+import ujson
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+
+# --- CONFIGURATION ---
+SEED = 1234
+
+# Share of rows per processed source, with its shape. Lengths are in
+# characters, drawn from a lognormal(log(median), sigma) and clipped.
+SOURCES = {
+    # NuminaMath CoT: medium problems, medium solutions
+    "logic_core": {"share": 0.30, "problem": (220, 0.6), "solution": (1400, 0.7)},
+    # NuminaMath TIR: solutions interleave code blocks
+    "code_plat": {"share": 0.15, "problem": (200, 0.6), "solution": (2200, 0.6), "code": True},
+    # OpenMathInstruct-2: short problems and solutions, has meta
+    "code_silver": {"share": 0.40, "problem": (160, 0.5), "solution": (700, 0.8), "meta": True},
+    # Recursive correction traces: two think blocks, long
+    "recursive": {"share": 0.15, "problem": (260, 0.6), "solution": (5000, 0.5), "recursive": True},
+}
+MAX_CHARS = 40_000
+
+# Fraction of rows that copy a blocklist problem (scrub must catch them)
+CONTAMINATION = 0.001
+# Fraction of rows that repeat an earlier problem (dedup fodder)
+DUPLICATES = 0.02
+BLOCKLIST_SIZE = 10
+
+WORDS = (
+    "let find the sum of all positive integers such that prime number triangle area "
+    "circle radius probability expected value modulo remainder sequence term polynomial "
+    "root real complex function maximum minimum integer solution equation inequality "
+    "we have therefore so thus since hence compute note that consider case if then "
+    "x y z n k m a b c 0 1 2 3 4 5 6 7 8 9 10 12 15 100 2024 + - = \\frac \\sqrt ^"
+).split()
+
+# Text is sliced out of one pre-generated blob: generating 10M rows stays I/O bound
+BLOB_WORDS = 400_000
+
+def make_blob(rng):
+    return " ".join(rng.choice(WORDS, size=BLOB_WORDS))
+
+def lengths(rng, shape, n):
+    median, sigma = shape
+    return np.clip(rng.lognormal(np.log(median), sigma, size=n), 16, MAX_CHARS).astype(np.int64)
+
+class TextSource:
+    """Random substrings of the blob (starting at a word boundary)."""
+
+    def __init__(self, rng):
+        self.blob = make_blob(rng)
+        self.starts = np.flatnonzero(np.frombuffer(self.blob.encode("ascii"), dtype=np.uint8) == ord(" ")) + 1
+        self.rng = rng
+
+    def take(self, sizes):
+        starts = self.starts[self.rng.integers(0, len(self.starts), size=len(sizes))]
+        # Wrap around so long texts near the end stay full length
+        blob = self.blob
+        return [blob[s : s + n] if s + n <= len(blob) else (blob[s:] + " " + blob)[:n] for s, n in zip(starts.tolist(), sizes.tolist())]
+
+def make_row(name, spec, idx, problem, solution):
+    if spec.get("code"):
+        cut = len(solution) // 2
+        solution = f"{solution[:cut]}\n```python\nprint({idx} % 7)\n```\n```output\n{idx % 7}\n```\n{solution[cut:]}"
+    answer = str(idx % 997)
+    if spec.get("recursive"):
+        cut = len(solution) // 2
+        content = (
+            f"<think>{solution[:cut]}</think>\n<wait>\n"
+            f"<critique>Wait, I made a mistake. Let me re-calculate.</critique>\n"
+            f"<think>{solution[cut:]}</think>\n<answer>{answer}</answer>"
+        )
+    else:
+        content = f"<think>{solution}</think>\n<answer>{answer}</answer>"
+
+    row = {
+        "source": name,
+        "problem": problem,
+        "messages": [
+            {"role": "user", "content": problem},
+            {"role": "assistant", "content": content},
+        ],
+    }
+    if spec.get("meta"):
+        row = {"id": f"{name}_{idx}", **row, "meta": {"source_type": "augmented_math", "is_code": True}}
+    return row
+
+def generate(out_dir, rows, seed=SEED, block=10_000):
+    """
+    Writes a synthetic processed/ tree: one JSONL per source (Universal
+    Schema, realistic lengths) plus blocklist/aimo_ref.txt.
+    Returns {source: rows}. Same (rows, seed) -> byte-identical files.
+    """
+    out_dir = Path(out_dir)
+    rng = np.random.default_rng(seed)
+    text = TextSource(rng)
+
+    blocklist = text.take(lengths(rng, (220, 0.3), BLOCKLIST_SIZE))
+    (out_dir / "blocklist").mkdir(parents=True, exist_ok=True)
+    (out_dir / "blocklist" / "aimo_ref.txt").write_text("\n".join(blocklist) + "\n")
+
+    processed = out_dir / "processed"
+    processed.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    for name, spec in SOURCES.items():
+        n = int(rows * spec["share"])
+        counts[name] = n
+        recent = []
+        with (processed / f"{name}.jsonl").open("w", encoding="utf-8") as f:
+            for lo in tqdm(range(0, n, block), desc=f"Generating {name}", unit="blocks"):
+                m = min(block, n - lo)
+                problems = text.take(lengths(rng, spec["problem"], m))
+                solutions = text.take(lengths(rng, spec["solution"], m))
+                roll = rng.random(m)
+                for i in range(m):
+                    if roll[i] < CONTAMINATION:
+                        problems[i] = blocklist[i % len(blocklist)]
+                    elif roll[i] < CONTAMINATION + DUPLICATES and recent:
+                        problems[i] = recent[i % len(recent)]
+                    f.write(ujson.dumps(make_row(name, spec, lo + i, problems[i], solutions[i])) + "\n")
+                recent = problems[:100]
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Universal Schema corpus.")
+    parser.add_argument("--rows", type=int, default=100_000, help="Total rows across all sources")
+    parser.add_argument("--out", type=Path, default=Path("data/bench/corpus"))
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    counts = generate(args.out, args.rows, args.seed)
+    size = sum(p.stat().st_size for p in (args.out / "processed").glob("*.jsonl"))
+    print(f"✅ Wrote {sum(counts.values())} rows ({size / 1e6:.1f}MB) to {args.out}: {counts}")
@@ -0,0 +1,208 @@
+import multiprocessing
+import os
+import re
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import lru_cache
+
+# Optional: symbolic equivalence for non-numeric answers (x+1 vs 1+x, \sqrt{8} vs 2\sqrt{2})
+try:
+    import sympy
+    from sympy.parsing.sympy_parser import (
+        implicit_multiplication_application,
+        parse_expr,
+        standard_transformations,
+    )
+except ImportError:
+    sympy = None
+
+# --- CONFIGURATION ---
+# Worker processes for verify_batch()
+NUM_WORKERS = os.cpu_count() or 1
+
+# Seconds allowed per item (symbolic simplification can blow up)
+ITEM_TIMEOUT = 2.0
+
+# Relative tolerance for non-exact numeric answers (e.g. 0.333333 vs 1/3)
+REL_TOL = 1e-6
+
+# --- EXTRACTION ---
+BOXED_RE = re.compile(r"\\(?:boxed|fbox)\s*\{")
+ANSWER_TAG_RE = re.compile(r"<answer>(.*?)</answer>", re.S)
+NUMBER_RE = re.compile(r"-?\d+(?:,\d{3})*(?:\.\d+)?(?:/\d+)?")
+
+def _balanced(text, start):
+    """Contents of the {...} group whose opening brace is at text[start - 1]."""
+    depth = 1
+    for i in range(start, len(text)):
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i]
+    return None
+
+def extract_answer(text):
+    """
+    Final answer of a generation: last \\boxed{...}, else last
+    <answer>...</answer>, else the last number. None if nothing found.
+    """
+    boxed = list(BOXED_RE.finditer(text))
+    for m in reversed(boxed):
+        inner = _balanced(text, m.end())
+        if inner is not None:
+            return inner.strip()
+
+    tags = ANSWER_TAG_RE.findall(text)
+    if tags:
+        return tags[-1].strip()
+
+    numbers = NUMBER_RE.findall(text)
+    return numbers[-1] if numbers else None
+
+# --- NORMALIZATION ---
+STRIP_PATTERNS = [
+    (re.compile(r"(\d)\s*\\text\s*\{[^{}]*\}"), r"\1"),   # units after a number
+    (re.compile(r"\\text\s*\{([^{}]*)\}"), r"\1"),
+    (re.compile(r"\\(?:mathrm|mathbf|textbf)\s*\{([^{}]*)\}"), r"\1"),
+    (re.compile(r"\\(?:left|right|displaystyle|!|,|;|:)"), ""),
+    (re.compile(r"\^\s*\{?\\circ\}?"), ""),          # degrees
+    (re.compile(r"\\?%"), ""),
+    (re.compile(r"\\?\$"), ""),
+    (re.compile(r"\\dfrac|\\tfrac"), r"\\frac"),
+    (re.compile(r"\\frac\s*(\d)"), r"\\frac{\1}"),            # \frac12 -> \frac{1}2
+    (re.compile(r"(\\frac\{[^{}]*\})\s*(\d)"), r"\1{\2}"),       # \frac{1}2 -> \frac{1}{2}
+]
+
+# "x = 5" -> "5": a single-variable left side, when one value follows
+VAR_EQ_RE = re.compile(r"^[a-zA-Z]\s*=")
+MULTI_VALUE_RE = re.compile(r"=|\b(?:or|and)\b")
+
+def normalize(ans):
+    """Canonical string form of an answer (formatting noise removed)."""
+    s = str(ans).strip()
+    for pattern, repl in STRIP_PATTERNS:
+        s = pattern.sub(repl, s)
+    # "x = 5" -> "5"; "x = 2 or x = 3" and "y = 2x + 1 = 7" stay as they are
+    m = VAR_EQ_RE.match(s)
+    if m and not MULTI_VALUE_RE.search(s, m.end()):
+        s = s[m.end():]
+    s = s.strip().rstrip(".").strip()
+    return re.sub(r"\s+", "", s)
+
+FRAC_RE = re.compile(r"^(-?)\\frac\{(-?\d+)\}\{(-?\d+)\}$")
+THOUSANDS_RE = re.compile(r"^-?\d{1,3}(,\d{3})+(\.\d+)?$")
+
+def parse_number(ans):
+    """
+    Exact value of a numeric answer as a Fraction: integers, decimals,
+    a/b, \\frac{a}{b}, 1,000-style separators. None if not numeric.
+    """
+    s = normalize(ans)
+    if THOUSANDS_RE.match(s):
+        s = s.replace(",", "")
+    m = FRAC_RE.match(s)
+    if m:
+        sign, num, den = m.groups()
+        s = f"{sign}{num}/{den}"
+    try:
+        value = Fraction(s)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return value
+
+# --- SYMBOLIC ---
+LATEX_TO_SYMPY = [
+    (re.compile(r"\\frac\{([^{}]*)\}\{([^{}]*)\}"), r"((\1)/(\2))"),
+    (re.compile(r"\\sqrt\[([^\]]*)\]\{([^{}]*)\}"), r"((\2)**(1/(\1)))"),
+    (re.compile(r"\\sqrt\{([^{}]*)\}"), r"sqrt(\1)"),
+    (re.compile(r"\\(?:cdot|times)"), "*"),
+    (re.compile(r"\\pi"), "pi"),
+    (re.compile(r"\^"), "**"),
+    (re.compile(r"[{}]"), lambda m: "(" if m.group() == "{" else ")"),
+]
+
+def to_sympy(s):
+    for _ in range(3): # nested \frac / \sqrt
+        for pattern, repl in LATEX_TO_SYMPY[:3]:
+            s = pattern.sub(repl, s)
+    for pattern, repl in LATEX_TO_SYMPY[3:]:
+        s = pattern.sub(repl, s)
+    if "\\" in s:
+        return None
+    transformations = standard_transformations + (implicit_multiplication_application,)
+    return parse_expr(s, transformations=transformations, evaluate=True)
+
+@lru_cache(maxsize=65_536)
+def parse_gold(gold):
+    """Memoized (normalized string, exact value) of a reference answer."""
+    return normalize(gold), parse_number(gold)
+
+def equivalent(pred, gold):
+    """True if the predicted answer string equals gold numerically or symbolically."""
+    if pred is None:
+        return False
+    gold_norm, gold_value = parse_gold(str(gold))
+    pred_norm = normalize(pred)
+    if pred_norm == gold_norm:
+        return True
+
+    pred_value = parse_number(pred)
+    if gold_value is not None and pred_value is not None:
+        if pred_value == gold_value:
+            return True
+        # Exact arithmetic: float() overflows on huge values ("1" * 400)
+        return abs(pred_value - gold_value) <= Fraction(REL_TOL) * max(1, abs(gold_value))
+
+    if sympy is None:
+        return False
+    try:
+        a, b = to_sympy(pred_norm), to_sympy(gold_norm)
+        return a is not None and b is not None and sympy.simplify(a - b) == 0
+    except Exception:
+        return False
+
+# --- BATCHED VERIFICATION ---
+class _Timeout(Exception):
+    pass
+
+def _on_alarm(signum, frame):
+    raise _Timeout()
+
+def verify(text, gold, timeout=ITEM_TIMEOUT):
+    """
+    True if the final answer extracted from `text` is equivalent to `gold`.
+    Items exceeding `timeout` seconds, or failing in any other way,
+    count as not equivalent: one degenerate generation never stops a batch.
+    """
+    use_alarm = timeout and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return equivalent(extract_answer(text), gold)
+    except Exception:
+        return False
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+def _verify_pair(pair):
+    return verify(*pair)
+
+def make_pool(num_workers=NUM_WORKERS):
+    # spawn: safe to start from a process that already holds a CUDA context (vLLM)
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"))
+
+def verify_batch(pairs, pool=None, chunksize=64):
+    """
+    verify() over a list of (text, gold) pairs, in order.
+    Runs in `pool` (see make_pool) when given, else in-process.
+    """
+    if pool is None:
+        return [_verify_pair(pair) for pair in pairs]
+    return list(pool.map(_verify_pair, pairs, chunksize=chunksize))
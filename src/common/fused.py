@@ -0,0 +1,272 @@
+import abc
+import io
+import os
+import shutil
+import ujson
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tqdm import tqdm
+
+from src.common import metrics, shards
+
+# --- CONFIGURATION ---
+NUM_WORKERS = os.cpu_count() or 1
+
+# Target size of each JSONL byte range handed to a worker
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# Rows decoded and passed through the stages together
+BLOCK_ROWS = 1024
+
+# Fused passes: every row of a file is decoded once, handed through a chain
+# of stages as a dict, and encoded at most once (rows no stage changed are
+# written back byte-for-byte). Outputs replace the inputs only after every
+# task and every stage's finish() succeeded.
+
+class Block:
+    """
+    Decoded rows moving through the stages. lines[i] is row i's original
+    JSONL text until a stage marks it changed (None = re-encode on write).
+    `bad` holds the block's unparseable lines (never written back).
+    """
+
+    def __init__(self, rows, lines=None, bad=None):
+        self.rows = rows
+        self.lines = lines if lines is not None else [None] * len(rows)
+        self.keep = [True] * len(rows)
+        self.bad = bad or []
+
+    def live(self):
+        """Indices of rows no stage has dropped yet."""
+        return [i for i, k in enumerate(self.keep) if k]
+
+    def drop(self, i):
+        self.keep[i] = False
+
+    def changed(self, i):
+        self.lines[i] = None
+
+class Stage(abc.ABC):
+    """
+    One step of a fused pass. process() runs in the workers on every Block,
+    dropping / editing rows in place. Per-task results go back through
+    summary(); finish() sees all of them in the parent, in file order.
+    Stages are pickled to each worker once (setup() runs there).
+    """
+    name = "stage"
+    # Parquet: columns the stage reads (None = all) and core columns it may change
+    columns = None
+    writes = ()
+
+    def setup(self):
+        pass
+
+    def begin(self, path):
+        """Start of a task on a chunk / shard of `path`: reset per-task state."""
+        pass
+
+    @abc.abstractmethod
+    def process(self, block):
+        """Worker: drop / edit the rows of `block` in place."""
+
+    def summary(self):
+        return None
+
+    def finish(self, results):
+        """Parent, after every task: [(path, part_path, rows_written, summary), ...]."""
+        pass
+
+# --- JSONL CHUNKS ---
+def iter_blocks(lines, size=BLOCK_ROWS):
+    """Groups an iterable of lines into lists of up to `size` lines."""
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) >= size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+def split_shards(file_path, shard_bytes=CHUNK_BYTES):
+    """
+    Splits a file into (start, end) byte ranges of ~shard_bytes,
+    each ending on a line boundary.
+    """
+    size = file_path.stat().st_size
+    ranges = []
+    start = 0
+    with file_path.open("rb") as f:
+        while start < size:
+            end = min(start + shard_bytes, size)
+            if end < size:
+                # Move the cut forward to the end of the current line
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def merge_parts(part_paths, temp_path):
+    """Concatenates shard part files (in shard order) into temp_path."""
+    with temp_path.open("wb") as fout:
+        for part_path in part_paths:
+            with part_path.open("rb") as fin:
+                shutil.copyfileobj(fin, fout)
+            part_path.unlink()
+
+# --- WORKERS ---
+_WORKER = {}
+
+def _init_worker(stages):
+    for stage in stages:
+        stage.setup()
+    _WORKER["stages"] = stages
+
+def _apply(stages, block):
+    for stage in stages:
+        before = sum(block.keep)
+        stage.process(block)
+        dropped = before - sum(block.keep)
+        if dropped:
+            metrics.count(f"dropped.{stage.name}", dropped)
+
+def run_chunk(path, idx, start, end):
+    """
+    Worker: bytes [start, end) of a JSONL file through the stages into a
+    part file. Unparseable lines are dropped (stages see them in Block.bad).
+    Returns (part_path, rows_written, [summary per stage]).
+    """
+    stages = _WORKER["stages"]
+    for stage in stages:
+        stage.begin(path)
+    part_path = path.with_suffix(f".part{idx}")
+    with path.open("rb") as fb:
+        fb.seek(start)
+        chunk = fb.read(end - start)
+
+    written = 0
+    fin = io.TextIOWrapper(io.BytesIO(chunk), encoding="utf-8")
+    with part_path.open("w", encoding="utf-8") as fout:
+        for lines in iter_blocks(fin):
+            rows = []
+            raw = []
+            bad = []
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(ujson.loads(line))
+                except ValueError:
+                    bad.append(line)
+                    continue
+                raw.append(line)
+            metrics.count("rows_unparseable", len(bad))
+            block = Block(rows, raw, bad)
+            _apply(stages, block)
+            for row, line, keep in zip(block.rows, block.lines, block.keep):
+                if keep:
+                    fout.write(line if line is not None else ujson.dumps(row) + "\n")
+                    written += 1
+    return part_path, written, [stage.summary() for stage in stages]
+
+def run_shard(path, shard_path, part_path):
+    """
+    Worker: one Parquet shard through the stages. Only the columns the
+    stages read are decoded; untouched columns are copied as Arrow data.
+    """
+    stages = _WORKER["stages"]
+    for stage in stages:
+        stage.begin(path)
+    table = pq.read_table(shard_path, memory_map=True)
+    wanted = [stage.columns for stage in stages]
+    columns = None if None in wanted else sorted({c for cols in wanted for c in cols})
+    writes = sorted({c for stage in stages for c in stage.writes})
+    decoded = table if columns is None else table.select(columns)
+
+    keep = np.ones(table.num_rows, dtype=bool)
+    new_columns = {name: [] for name in writes}
+    for lo in range(0, table.num_rows, BLOCK_ROWS):
+        block = Block(shards.to_rows(decoded.slice(lo, BLOCK_ROWS)))
+        _apply(stages, block)
+        keep[lo : lo + len(block.rows)] = block.keep
+        for name in writes:
+            new_columns[name].extend(row.get(name) for row in block.rows)
+    for name in writes:
+        field = table.schema.get_field_index(name)
+        table = table.set_column(field, name, pa.array(new_columns[name], table.schema.field(name).type))
+
+    table = table.filter(pa.array(keep))
+    shards.write_shard(table, part_path)
+    return part_path, table.num_rows, [stage.summary() for stage in stages]
+
+# --- DRIVER ---
+def jobs(path, chunk_bytes):
+    """Worker tasks of one file: JSONL byte ranges, or one per Parquet shard (parts go to <dir>.tmp/)."""
+    if shards.is_sharded(path):
+        temp_path = shards.temp_dir(path)
+        shutil.rmtree(temp_path, ignore_errors=True)
+        temp_path.mkdir()
+        return [(run_shard, path, f, temp_path / f.name) for f in shards.shard_files(path)]
+    return [(run_chunk, path, idx, start, end) for idx, (start, end) in enumerate(split_shards(path, chunk_bytes))]
+
+def discard(path, results):
+    if shards.is_sharded(path):
+        shutil.rmtree(shards.temp_dir(path), ignore_errors=True)
+        return
+    for part_path in path.parent.glob(f"{path.stem}.part*"):
+        part_path.unlink()
+
+def run(paths, stages, num_workers=NUM_WORKERS, chunk_bytes=CHUNK_BYTES, desc="Processing"):
+    """
+    Streams every file (JSONL or shard directory) through `stages` in one
+    pass, in a worker pool. Every input is replaced only after all tasks
+    and finish() calls succeeded; on failure the inputs are left untouched.
+    Returns {path: (rows_written, [[summary per stage] per task])}.
+    """
+    paths = [Path(p) for p in paths]
+    results = {}
+    try:
+        tasks = {path: jobs(path, chunk_bytes) for path in paths}
+        for path in paths:
+            metrics.count("bytes_read", metrics.disk_bytes(path))
+        if num_workers > 1:
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(stages,)) as pool:
+                # Every task of every file in flight at once so small files don't idle the pool
+                futures = {path: [metrics.submit(pool, *task) for task in t] for path, t in tasks.items()}
+                for path, fs in futures.items():
+                    results[path] = [metrics.result(f) for f in tqdm(fs, desc=f"{desc} {path.name}", unit="tasks")]
+        else:
+            _init_worker(stages)
+            for path, t in tasks.items():
+                results[path] = [task[0](*task[1:]) for task in tqdm(t, desc=f"{desc} {path.name}", unit="tasks")]
+
+        for i, stage in enumerate(stages):
+            stage.finish([
+                (path, part_path, written, summaries[i])
+                for path, rs in results.items()
+                for part_path, written, summaries in rs
+            ])
+    except BaseException:
+        for path in paths:
+            discard(path, results.get(path))
+        raise
+
+    # Commit: atomic swap per file
+    out = {}
+    for path in paths:
+        if shards.is_sharded(path):
+            shards.replace_dir(shards.temp_dir(path), path)
+        else:
+            temp_path = path.with_suffix(".tmp")
+            merge_parts([part_path for part_path, _, _ in results[path]], temp_path)
+            shutil.move(temp_path, path)
+        written = sum(w for _, w, _ in results[path])
+        metrics.count("bytes_written", metrics.disk_bytes(path))
+        metrics.count("rows_written", written)
+        out[path] = (written, [summaries for _, _, summaries in results[path]])
+    return out
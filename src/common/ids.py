@@ -0,0 +1,116 @@
+import hashlib
+import ujson
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.common import fused, metrics, shards
+
+# Content-addressed row IDs: "{prefix}_{16 hex digits}", where the digits are
+# a 64-bit blake2b of the whitespace-normalized problem + assistant response.
+# The same row gets the same ID however upstream filtering shifts it.
+
+def normalize(text):
+    """Collapses whitespace runs; case and symbols are kept (they matter in math)."""
+    return " ".join(text.split()) if text else ""
+
+def response_of(row):
+    msgs = row.get("messages") or []
+    return msgs[1]["content"] if len(msgs) > 1 else ""
+
+def content_hash(problem, response):
+    data = f"{normalize(problem)}\x00{normalize(response)}".encode("utf8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+def row_hash(row):
+    """64-bit content hash of a Universal Schema row."""
+    return content_hash(row.get("problem"), response_of(row))
+
+def make_id(prefix, h, copy=0):
+    """Row ID; the k-th repeat of already-seen content gets a "-k" suffix."""
+    base = f"{prefix}_{int(h):016x}"
+    return f"{base}-{copy}" if copy else base
+
+def occurrences(hashes):
+    """
+    For a uint64 hash array (rows in global order): how many earlier rows
+    share each row's hash. 0 = first occurrence. Sort-based, 8 bytes/row,
+    no Python objects per row.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+    ordered = hashes[order]
+    first = np.ones(len(hashes), dtype=bool)
+    first[1:] = ordered[1:] != ordered[:-1]
+    # Position (in sorted order) where each run of equal hashes starts
+    run_start = np.maximum.accumulate(np.where(first, np.arange(len(hashes)), 0))
+    copies = np.empty(len(hashes), dtype=np.int64)
+    copies[order] = np.arange(len(hashes)) - run_start
+    return copies
+
+# --- FUSED STAGE ---
+def set_ids(table, values):
+    return table.set_column(table.schema.get_field_index("id"), "id", pa.array(values, pa.string()))
+
+def mark_copies(part_path, prefix, hashes, copies):
+    """Re-IDs the repeated rows of one part ("-k" suffix). Parts without repeats are untouched."""
+    rows = np.flatnonzero(copies)
+    if shards.is_sharded(part_path):
+        table = pq.read_table(part_path)
+        values = table["id"].to_pylist()
+        for i in rows.tolist():
+            values[i] = make_id(prefix, hashes[i], copies[i])
+        shards.write_shard(set_ids(table, values), part_path)
+        return
+    with part_path.open("r", encoding="utf-8") as fin:
+        lines = fin.readlines()
+    for i in rows.tolist():
+        row = ujson.loads(lines[i])
+        row["id"] = make_id(prefix, hashes[i], copies[i])
+        lines[i] = ujson.dumps(row) + "\n"
+    with part_path.open("w", encoding="utf-8") as fout:
+        fout.writelines(lines)
+
+class IdStage(fused.Stage):
+    """
+    Sets "{file stem}_{content hash}" IDs ("id" first, like the ingestion
+    engine writes it). Must come after every stage that drops rows: its
+    hashes line up with the rows written. finish() checks uniqueness across
+    all files and suffixes rows repeating earlier content.
+    """
+    name = "ids"
+    columns = ("id", "problem", "messages")
+    writes = ("id",)
+
+    def begin(self, path):
+        self.prefix = path.stem
+        self.hashes = []
+
+    def process(self, block):
+        for i in block.live():
+            row = block.rows[i]
+            h = row_hash(row)
+            self.hashes.append(h)
+            new_id = make_id(self.prefix, h)
+            # Rows that already carry their ID keep their original line
+            if row.get("id") != new_id or next(iter(row)) != "id":
+                row.pop("id", None)
+                block.rows[i] = {"id": new_id, **row}
+                block.changed(i)
+
+    def summary(self):
+        return np.array(self.hashes, dtype=np.uint64)
+
+    def finish(self, results):
+        hashes = np.concatenate([h for *_, h in results]) if results else np.zeros(0, np.uint64)
+        copies = occurrences(hashes)
+        self.rows = len(hashes)
+        self.repeats = int(np.count_nonzero(copies))
+        start = 0
+        for path, part_path, written, h in results:
+            assert len(h) == written, f"{self.name} must be the last stage that drops rows"
+            part_copies = copies[start : start + len(h)]
+            if part_copies.any():
+                mark_copies(part_path, path.stem, h, part_copies)
+            start += len(h)
+        metrics.count("repeats", self.repeats)
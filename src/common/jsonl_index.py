@@ -0,0 +1,105 @@
+import mmap
+import os
+import random
+import ujson
+import numpy as np
+from pathlib import Path
+
+# Bytes scanned per step when locating newlines
+SCAN_BYTES = 64 * 1024 * 1024
+
+def index_path(path):
+    """Sidecar location: data/processed/x.jsonl -> data/processed/x.jsonl.idx"""
+    return path.with_name(path.name + ".idx")
+
+def build_offsets(path):
+    """
+    Returns a uint64 array of n+1 byte offsets: line i is bytes
+    [offsets[i], offsets[i+1]) of the file.
+    """
+    size = path.stat().st_size
+    if size == 0:
+        return np.zeros(1, dtype=np.uint64)
+
+    starts = [np.zeros(1, dtype=np.uint64)]
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for pos in range(0, size, SCAN_BYTES):
+            chunk = np.frombuffer(mm, dtype=np.uint8, count=min(SCAN_BYTES, size - pos), offset=pos)
+            starts.append(np.flatnonzero(chunk == ord("\n")).astype(np.uint64) + np.uint64(pos + 1))
+            del chunk # release the buffer export before mmap closes
+
+    offsets = np.concatenate(starts)
+    # A trailing newline does not start a new line; a missing one still ends the last
+    if offsets[-1] != size:
+        offsets = np.append(offsets, np.uint64(size))
+    return offsets
+
+def load_offsets(path):
+    """
+    Loads the cached offset index for path, rebuilding the sidecar when
+    the file's size or mtime no longer match its header.
+    """
+    path = Path(path)
+    st = path.stat()
+    header = np.array([st.st_size, st.st_mtime_ns], dtype=np.uint64)
+
+    idx = index_path(path)
+    if idx.exists():
+        cached = np.fromfile(idx, dtype=np.uint64)
+        if len(cached) >= 3 and np.array_equal(cached[:2], header):
+            return cached[2:]
+
+    offsets = build_offsets(path)
+    temp_path = idx.with_suffix(".tmp")
+    np.concatenate([header, offsets]).tofile(temp_path)
+    os.replace(temp_path, idx)
+    return offsets
+
+class JsonlReader:
+    """
+    Random-access reader over a JSONL file: the file is mmapped and
+    only the requested lines are decoded.
+
+        with JsonlReader(path) as reader:
+            rows = reader.sample(100)
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offsets = load_offsets(self.path)
+        self._file = self.path.open("rb")
+        # mmap rejects empty files
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if len(self) else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line(self, i):
+        """Raw bytes of line i (without the trailing newline)."""
+        return self._mm[int(self.offsets[i]) : int(self.offsets[i + 1])].rstrip(b"\r\n")
+
+    def __getitem__(self, i):
+        return ujson.loads(self.line(i))
+
+    def rows(self, indices):
+        """Decodes the rows at the given indices, in that order."""
+        return [self[i] for i in indices]
+
+    def sample(self, k, rng=None):
+        """
+        Decodes k distinct random rows. Draws the same indices as
+        rng.sample(rows, k) would on the fully loaded list.
+        """
+        rng = rng or random
+        return self.rows(rng.sample(range(len(self)), k))
+
+    def close(self):
+        if len(self):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import os
+import random
+import re
+import ujson
+import numpy as np
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tqdm import tqdm
+
+from src.common import shards
+from src.common.jsonl_index import JsonlReader, load_offsets
+from src.training.pretokenize import TOKENIZER, format_prompt
+
+# --- CONFIGURATION ---
+NUM_WORKERS = os.cpu_count() or 1
+
+# Rows per worker task (JSONL sources; Parquet shards are one task each)
+ROWS_PER_TASK = 20_000
+
+# Bytes read per step when hashing a source
+HASH_BYTES = 8 * 1024 * 1024
+
+# Sidecar layout version (bump when the measured columns change)
+INDEX_VERSION = 1
+
+THINK_RE = re.compile(r"<think>(.*?)</think>", re.S)
+
+# Per-row columns, aligned with the file's lines (JsonlReader rows) or
+# shard rows. Blank lines are -1; unparseable lines are 0.
+COLUMNS = ("tokens", "chars", "think_chars")
+
+def index_path(path):
+    """Sidecar location: x.jsonl -> x.jsonl.len.npz, x.parquet/ -> x.parquet.len.npz"""
+    path = Path(path)
+    return path.with_name(path.name + ".len.npz")
+
+def file_hash(path):
+    """sha256 over the source bytes (all shards, in order)."""
+    h = hashlib.sha256()
+    files = shards.shard_files(path) if shards.is_sharded(path) else [Path(path)]
+    for f in files:
+        with f.open("rb") as fin:
+            while chunk := fin.read(HASH_BYTES):
+                h.update(chunk)
+    return h.hexdigest()
+
+def file_stat(path):
+    files = shards.shard_files(path) if shards.is_sharded(path) else [Path(path)]
+    return [[f.name, f.stat().st_size, f.stat().st_mtime_ns] for f in files]
+
+# --- MEASURING ---
+def measure(row):
+    """(training text, chars, think_chars) of one Universal Schema row, None if it has no exchange."""
+    msgs = row.get("messages") or []
+    if len(msgs) < 2:
+        return None
+    text = format_prompt(row)["text"]
+    return text, len(text), sum(len(m) for m in THINK_RE.findall(msgs[1]["content"]))
+
+_WORKER = {}
+
+def load_tokenizer(name):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(name, trust_remote_code=True)
+
+def _init_worker(tokenizer_name):
+    _WORKER["tokenizer"] = load_tokenizer(tokenizer_name)
+
+def _measure_rows(rows):
+    """rows: dicts (None = unparseable line, measured as 0) -> (n, 3) int32."""
+    out = np.zeros((len(rows), len(COLUMNS)), dtype=np.int32)
+    texts = []
+    where = []
+    for i, row in enumerate(rows):
+        m = measure(row) if row is not None else None
+        if m is None:
+            continue
+        text, chars, think = m
+        out[i, 1:] = chars, think
+        texts.append(text)
+        where.append(i)
+    if texts:
+        ids = _WORKER["tokenizer"](texts)["input_ids"]
+        out[where, 0] = [len(x) for x in ids]
+    return out
+
+def _measure_lines(path, lo, hi):
+    """Worker: lines [lo, hi) of a JSONL file."""
+    rows = []
+    blank = []
+    with JsonlReader(path) as reader:
+        for i in range(lo, hi):
+            line = reader.line(i)
+            if not line.strip():
+                blank.append(i - lo)
+                rows.append(None)
+                continue
+            try:
+                rows.append(ujson.loads(line))
+            except ValueError:
+                rows.append(None)
+    out = _measure_rows(rows)
+    out[blank] = -1
+    return out
+
+def _measure_shard(shard_path):
+    """Worker: every row of one Parquet shard (only the messages column is read)."""
+    table = pq.read_table(shard_path, columns=["messages"], memory_map=True)
+    return _measure_rows(table.to_pylist())
+
+def build_lengths(path, tokenizer=TOKENIZER, num_workers=NUM_WORKERS):
+    """Measures every row of a source in a worker pool. Returns {column: array}."""
+    path = Path(path)
+    if shards.is_sharded(path):
+        tasks = [(_measure_shard, f) for f in shards.shard_files(path)]
+    else:
+        n = len(load_offsets(path)) - 1
+        tasks = [(_measure_lines, path, lo, min(lo + ROWS_PER_TASK, n)) for lo in range(0, n, ROWS_PER_TASK)]
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(tokenizer,)) as pool:
+        futures = [pool.submit(*task) for task in tasks]
+        parts = [f.result() for f in tqdm(futures, desc=f"Measuring {path.name}", unit="tasks")]
+    table = np.concatenate(parts) if parts else np.zeros((0, len(COLUMNS)), dtype=np.int32)
+    return {name: table[:, i] for i, name in enumerate(COLUMNS)}
+
+def load_lengths(path, tokenizer=TOKENIZER, num_workers=NUM_WORKERS):
+    """
+    Per-row length index of a source, from its sidecar when still valid.
+    Unchanged size/mtime -> trusted as is; otherwise the content hash
+    decides, so a touched-but-identical file is not re-tokenized.
+    """
+    path = Path(path)
+    idx = index_path(path)
+    stat = file_stat(path)
+    meta = None
+    if idx.exists():
+        with np.load(idx) as cached:
+            meta = ujson.loads(str(cached["meta"]))
+            arrays = {name: cached[name] for name in COLUMNS}
+        if meta["version"] != INDEX_VERSION or meta["tokenizer"] != tokenizer:
+            meta = None
+        elif meta["stat"] == stat:
+            return arrays
+
+    digest = file_hash(path)
+    if meta is not None and meta["sha256"] == digest:
+        meta["stat"] = stat
+        save_lengths(idx, meta, arrays)
+        return arrays
+
+    arrays = build_lengths(path, tokenizer, num_workers)
+    meta = {"version": INDEX_VERSION, "tokenizer": tokenizer, "sha256": digest, "stat": stat}
+    save_lengths(idx, meta, arrays)
+    return arrays
+
+def save_lengths(idx, meta, arrays):
+    temp_path = idx.with_name(idx.name + ".tmp.npz")
+    np.savez(temp_path, meta=np.array(ujson.dumps(meta)), **arrays)
+    os.replace(temp_path, idx)
+
+# --- BUDGETS ---
+def closest_prefix(cumsum, budget):
+    """Length k of the prefix whose token total is closest to budget (k >= 1)."""
+    k = int(np.searchsorted(cumsum, budget)) + 1 # first prefix reaching the budget
+    k = min(k, len(cumsum))
+    if k > 1 and budget - cumsum[k - 2] < cumsum[k - 1] - budget:
+        k -= 1
+    return k
+
+def draw_to_budget(rng, tokens, budget):
+    """
+    Row indices drawn with replacement (uniformly, like the weight mode)
+    until their token total is as close to budget as one row allows.
+    """
+    if budget <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if tokens.sum() <= 0:
+        raise ValueError("Cannot fill a token budget from rows with no tokens")
+    mean = tokens.mean()
+    draws = []
+    total = 0
+    while total < budget:
+        # Slight over-draw so one or two rounds usually suffice
+        chunk = rng.integers(0, len(tokens), size=int((budget - total) / mean * 1.05) + 16)
+        draws.append(chunk)
+        total += int(tokens[chunk].sum())
+    draws = np.concatenate(draws)
+    return draws[: closest_prefix(np.cumsum(tokens[draws]), budget)]
+
+def sample_to_budget(tokens, budget, rng=None):
+    """
+    Distinct random rows (no replacement) whose token total is closest to
+    budget; all rows if the source is smaller than the budget.
+    """
+    rng = rng or random
+    candidates = np.flatnonzero(tokens >= 0) # blank lines are not rows
+    picks = candidates[rng.sample(range(len(candidates)), len(candidates))]
+    if budget <= 0 or len(picks) == 0:
+        return picks[:0]
+    return picks[: closest_prefix(np.cumsum(tokens[picks]), budget)]
+
+def summarize(name, tokens):
+    valid = tokens[tokens >= 0]
+    total = int(valid.sum())
+    mean = total / max(len(valid), 1)
+    return f"{name}: {len(valid)} rows, {total} tokens (mean {mean:.0f})"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build / refresh per-row length sidecars (.len.npz).")
+    parser.add_argument("paths", nargs="+", type=Path)
+    parser.add_argument("--tokenizer", default=TOKENIZER)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args()
+
+    for path in args.paths:
+        lengths = load_lengths(path, args.tokenizer, args.workers)
+        print(f"📏 {summarize(path.name, lengths['tokens'])}, {int(lengths['think_chars'].clip(0).sum())} think chars")
@@ -0,0 +1,382 @@
+import argparse
+import contextlib
+import cProfile
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import ujson
+from collections import Counter
+from pathlib import Path
+
+# --- CONFIGURATION ---
+# Profiler for every instrumented stage and its pool tasks:
+#   ""         off
+#   "cprofile" deterministic (every call, noticeably slower)
+#   "sample"   stack sampling every SAMPLE_INTERVAL (near free, statistical)
+PROFILE = os.environ.get("FOUNDRY_PROFILE", "")
+SAMPLE_INTERVAL = 0.005
+
+# Seconds between RSS samples of a stage
+RSS_INTERVAL = 1.0
+
+# Durations kept per timer for percentiles (decimated 2:1 when full)
+MAX_SAMPLES = 4096
+
+# Functions listed in the profile section of a report
+TOP_FUNCTIONS = 30
+
+def metrics_path(out):
+    """Metrics file of a stage output: x.jsonl -> x.jsonl.metrics.json"""
+    out = Path(out)
+    return out.with_name(out.name + ".metrics.json")
+
+def disk_bytes(path):
+    """On-disk size of a file, or of every file under a directory (0 if missing)."""
+    path = Path(path)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+def rss_mb():
+    """Current RSS of this process (Linux /proc; elsewhere the peak so far)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+def _decimate(samples):
+    while len(samples) > MAX_SAMPLES:
+        samples[:] = samples[::2]
+
+def _func_key(filename, line, name):
+    # Last two path parts keep "safety/scrub.py" apart from "ingestion/engine.py"
+    return f"{name} ({'/'.join(Path(filename).parts[-2:])}:{line})"
+
+class Metrics:
+    """
+    Counters, timers and max-gauges of one stage (or one pool task).
+    Thread-safe; snapshot()/merge() move a worker's numbers to the parent.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        # name -> [count, total seconds, max seconds, sampled durations]
+        self.timers = {}
+        # name -> highest value reported
+        self.gauges = {}
+        # function -> stats summed across processes (columns depend on the profiler)
+        self.profile = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            t = self.timers.setdefault(name, [0, 0.0, 0.0, []])
+            t[0] += 1
+            t[1] += seconds
+            t[2] = max(t[2], seconds)
+            t[3].append(seconds)
+            _decimate(t[3])
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = max(self.gauges.get(name, value), value)
+
+    def total(self, name):
+        """Summed seconds of a timer (0 if it never ran)."""
+        with self.lock:
+            return self.timers[name][1] if name in self.timers else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {name: [c, tot, mx, list(s)] for name, (c, tot, mx, s) in self.timers.items()},
+                "gauges": dict(self.gauges),
+                "profile": {fn: list(stats) for fn, stats in self.profile.items()},
+            }
+
+    def merge(self, snap):
+        """Adds a snapshot (possibly partial) from another registry."""
+        with self.lock:
+            self.counters.update(snap.get("counters", {}))
+            for name, (c, tot, mx, s) in snap.get("timers", {}).items():
+                t = self.timers.setdefault(name, [0, 0.0, 0.0, []])
+                t[0] += c
+                t[1] += tot
+                t[2] = max(t[2], mx)
+                t[3].extend(s)
+                _decimate(t[3])
+            for name, value in snap.get("gauges", {}).items():
+                self.gauges[name] = max(self.gauges.get(name, value), value)
+            for fn, stats in snap.get("profile", {}).items():
+                mine = self.profile.setdefault(fn, [0] * len(stats))
+                for i, v in enumerate(stats):
+                    mine[i] += v
+
+# The registry count()/timer()/... report into: a stage's while one is
+# running, a pool task's inside run_task(), else a throwaway default.
+_CURRENT = Metrics()
+
+def current():
+    return _CURRENT
+
+def count(name, n=1):
+    _CURRENT.count(name, n)
+
+def observe(name, seconds):
+    _CURRENT.observe(name, seconds)
+
+def gauge(name, value):
+    _CURRENT.gauge(name, value)
+
+@contextlib.contextmanager
+def timer(name):
+    metrics = _CURRENT
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(name, time.perf_counter() - start)
+
+# --- SAMPLING ---
+class Sampler(threading.Thread):
+    """
+    Background thread recording RSS every RSS_INTERVAL and, in "sample"
+    mode, the stack of the thread that started it every SAMPLE_INTERVAL
+    (profile columns: self samples, total samples).
+    """
+
+    def __init__(self, metrics, rss=True, stacks=False):
+        super().__init__(name="metrics-sampler", daemon=True)
+        self.metrics = metrics
+        self.target = threading.get_ident()
+        self.stacks = stacks
+        self.track_rss = rss
+        self.rss = [] # [seconds since start, MB]
+        self.start_time = time.perf_counter()
+        self.done = threading.Event()
+
+    def sample_rss(self):
+        self.rss.append([round(time.perf_counter() - self.start_time, 2), round(rss_mb(), 1)])
+        if len(self.rss) > MAX_SAMPLES:
+            self.rss[:] = self.rss[::2]
+
+    def sample_stack(self):
+        frame = sys._current_frames().get(self.target)
+        seen = set()
+        with self.metrics.lock:
+            leaf = True
+            while frame is not None:
+                code = frame.f_code
+                key = _func_key(code.co_filename, code.co_firstlineno, code.co_name)
+                stats = self.metrics.profile.setdefault(key, [0, 0])
+                if leaf:
+                    stats[0] += 1
+                    leaf = False
+                if key not in seen: # recursion counts once per sample
+                    stats[1] += 1
+                    seen.add(key)
+                frame = frame.f_back
+
+    def run(self):
+        interval = SAMPLE_INTERVAL if self.stacks else RSS_INTERVAL
+        next_rss = 0.0
+        if self.track_rss:
+            self.sample_rss()
+            next_rss = RSS_INTERVAL
+        while not self.done.wait(interval):
+            if self.track_rss and time.perf_counter() - self.start_time >= next_rss:
+                self.sample_rss()
+                next_rss += RSS_INTERVAL
+            if self.stacks:
+                self.sample_stack()
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        if self.track_rss:
+            self.sample_rss()
+
+def cprofile_stats(profiler):
+    """cProfile results as function -> [calls, self seconds, cumulative seconds]."""
+    return {
+        _func_key(*func): [nc, tt, ct]
+        for func, (cc, nc, tt, ct, callers) in pstats.Stats(profiler).stats.items()
+    }
+
+class Probe:
+    """
+    Swaps in a fresh registry and runs the configured profiler until stop(),
+    which restores the previous registry and returns the filled one.
+    """
+
+    def __init__(self, profile=PROFILE, rss=True):
+        global _CURRENT
+        self.outer = _CURRENT
+        self.metrics = _CURRENT = Metrics()
+        self.profile = profile
+        self.sampler = None
+        if rss or profile == "sample":
+            self.sampler = Sampler(self.metrics, rss=rss, stacks=profile == "sample")
+            self.sampler.start()
+        self.profiler = None
+        if profile == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        global _CURRENT
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.metrics.merge({"profile": cprofile_stats(self.profiler)})
+        if self.sampler is not None:
+            self.sampler.stop()
+        _CURRENT = self.outer
+        return self.metrics
+
+# --- POOL TASKS ---
+# Worker processes have their own registry: tasks submitted through
+# submit() send theirs back with the result, and result() folds it into
+# the parent's current stage.
+
+def run_task(fn, *args):
+    """Pool-side wrapper: runs fn(*args) with a fresh registry -> (result, snapshot)."""
+    probe = Probe(rss=False)
+    try:
+        result = fn(*args)
+    finally:
+        metrics = probe.stop()
+    metrics.gauge("worker_peak_rss_mb", round(peak_rss_mb(), 1))
+    return result, metrics.snapshot()
+
+def submit(pool, fn, *args):
+    return pool.submit(run_task, fn, *args)
+
+def result(future):
+    """future.result() of a submit()ted task, merging its metrics into the current stage."""
+    value, snap = future.result()
+    _CURRENT.merge(snap)
+    return value
+
+# --- STAGES ---
+def summarize_timer(count, total, longest, samples):
+    ordered = sorted(samples)
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+    return {
+        "count": count,
+        "total_s": round(total, 4),
+        "mean_s": round(total / max(count, 1), 6),
+        "p50_s": round(pct(0.50), 6),
+        "p95_s": round(pct(0.95), 6),
+        "max_s": round(longest, 6),
+    }
+
+def summarize_profile(profile, mode):
+    if mode == "cprofile":
+        columns = ["calls", "self_s", "cumulative_s"]
+    else:
+        columns = ["self_samples", "total_samples"]
+    # Hot paths first: most time spent in the function itself
+    top = sorted(profile.items(), key=lambda kv: kv[1][1] if mode == "cprofile" else kv[1][0], reverse=True)
+    return {
+        "mode": mode,
+        "top": [{"function": fn, **dict(zip(columns, (round(v, 4) for v in stats)))} for fn, stats in top[:TOP_FUNCTIONS]],
+    }
+
+def write_report(path, report):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + ".tmp")
+    with temp_path.open("w") as f:
+        ujson.dump(report, f, indent=2)
+    os.replace(temp_path, path)
+
+@contextlib.contextmanager
+def stage(name, path, profile=PROFILE):
+    """
+    Instruments one pipeline stage. Everything counted/timed inside the
+    block (and in pool tasks run via submit/result) plus wall and CPU time,
+    RSS over time and the optional profile is written to `path` as JSON
+    when the block exits, also on failure ("status": "failed").
+    cProfile output is additionally dumped next to it as <path>.prof.
+    """
+    path = Path(path)
+    started = time.strftime("%Y-%m-%dT%H:%M:%S")
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall = time.perf_counter()
+    probe = Probe(profile)
+    status = "failed"
+    try:
+        yield probe.metrics
+        status = "ok"
+    finally:
+        metrics = probe.stop()
+        wall = time.perf_counter() - wall
+        end = resource.getrusage(resource.RUSAGE_SELF)
+        child_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+        snap = metrics.snapshot()
+        report = {
+            "stage": name,
+            "status": status,
+            "started": started,
+            "wall_s": round(wall, 3),
+            "cpu_s": {
+                "user": round(end.ru_utime - usage.ru_utime, 3),
+                "system": round(end.ru_stime - usage.ru_stime, 3),
+                # Pool workers count once they have exited
+                "children_user": round(child_end.ru_utime - child_usage.ru_utime, 3),
+                "children_system": round(child_end.ru_stime - child_usage.ru_stime, 3),
+            },
+            "rss_mb": {
+                "peak": round(peak_rss_mb(), 1),
+                "children_peak": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+                "samples": probe.sampler.rss,
+            },
+            "counters": snap["counters"],
+            "timers": {name: summarize_timer(*t) for name, t in snap["timers"].items()},
+            "gauges": snap["gauges"],
+        }
+        if profile:
+            report["profile"] = summarize_profile(snap["profile"], profile)
+            if probe.profiler is not None:
+                probe.profiler.dump_stats(str(path.with_name(path.name + ".prof")))
+        write_report(path, report)
+        print(f"📈 {name}: {wall:.1f}s wall, peak RSS {report['rss_mb']['peak']:.0f}MB -> {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print stage metrics files (*.metrics.json).")
+    parser.add_argument("paths", nargs="+", type=Path)
+    parser.add_argument("--top", type=int, default=10, help="Profile rows to show")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        with path.open() as f:
+            report = ujson.load(f)
+        cpu = report["cpu_s"]
+        print(f"📈 {report['stage']} [{report['status']}] {report['wall_s']:.1f}s wall, "
+              f"{cpu['user'] + cpu['system']:.1f}s CPU (+{cpu['children_user'] + cpu['children_system']:.1f}s workers), "
+              f"peak RSS {report['rss_mb']['peak']:.0f}MB")
+        for name, value in sorted(report["counters"].items()):
+            print(f"  - {name:<28} {value:>14,}")
+        for name, value in sorted(report["gauges"].items()):
+            print(f"  - {name:<28} {value:>14,} (max)")
+        for name, t in report["timers"].items():
+            print(f"  - {name:<28} {t['total_s']:>10.2f}s  n={t['count']}  p50 {t['p50_s'] * 1e3:.1f}ms  "
+                  f"p95 {t['p95_s'] * 1e3:.1f}ms  max {t['max_s'] * 1e3:.1f}ms")
+        for row in report.get("profile", {}).get("top", [])[: args.top]:
+            stats = "  ".join(f"{k}={v}" for k, v in row.items() if k != "function")
+            print(f"    {stats}  {row['function']}")
@@ -0,0 +1,137 @@
+import argparse
+import os
+import re
+import ujson
+from collections import Counter
+from pathlib import Path
+
+from src.common import fused, metrics
+
+# --- CONFIGURATION ---
+DATA_DIR = Path("data/processed")
+
+# Rejected rows are appended to <QUARANTINE_DIR>/<source stem>.jsonl as
+# {"reason": ..., "row": {...}} ({"reason": "unparseable", "line": "..."})
+QUARANTINE_DIR = Path("data/quarantine")
+
+NUM_WORKERS = os.cpu_count() or 1
+
+# The trainer learns <think>...</think><answer>...</answer>: rows whose
+# response has no answer block are rejected too (False: only checked if present)
+REQUIRE_ANSWER = True
+
+TAG_RE = re.compile(r"</?(?:think|answer)>")
+THINK_PAIR = ["<think>", "</think>"]
+ANSWER_PAIR = ["<answer>", "</answer>"]
+
+# Universal Schema validation. format_prompt() reads messages[0] / [1]
+# blindly, so every row that reaches the mix must have the user /
+# assistant pair, closed (non-nested) think blocks and one answer after them.
+
+def check_response(text):
+    """Rejection reason for an assistant response, None if its tags are well-formed."""
+    # One regex pass; the rest only looks at the (few) tags, in order
+    tags = TAG_RE.findall(text)
+    think = [tag for tag in tags if tag.endswith("think>")]
+    if not think:
+        return "no_think"
+    # Closed, non-nested blocks: <think> </think> <think> </think> ...
+    if think != THINK_PAIR * (len(think) // 2):
+        return "unbalanced_think"
+
+    if len(tags) == len(think):
+        return "no_answer" if REQUIRE_ANSWER else None
+    # Exactly one answer block, after the last think block
+    if tags != think + ANSWER_PAIR:
+        return "bad_answer"
+    if not text[text.rfind("<answer>") + 8 : text.rfind("</answer>")].strip():
+        return "empty_answer"
+    return None
+
+def check_row(row):
+    """Rejection reason for a Universal Schema row, None if it is valid."""
+    if not isinstance(row, dict):
+        return "not_an_object"
+    if not isinstance(row.get("problem"), str) or not row["problem"].strip():
+        return "no_problem"
+    msgs = row.get("messages")
+    if not isinstance(msgs, list) or len(msgs) < 2:
+        return "no_exchange"
+    for msg, role in zip(msgs, ("user", "assistant")):
+        if not isinstance(msg, dict) or msg.get("role") != role or not isinstance(msg.get("content"), str):
+            return "bad_messages"
+    return check_response(msgs[1]["content"])
+
+class SchemaStage(fused.Stage):
+    """
+    Drops rows that fail check_row() (and unparseable lines), counting
+    them as rejected.<reason>. With a quarantine dir (None = count only),
+    the parent appends them there once every task is done.
+    """
+    name = "schema"
+
+    def __init__(self, quarantine_dir):
+        self.quarantine_dir = quarantine_dir
+        self.rejected = Counter()
+
+    def begin(self, path):
+        self.counts = Counter()
+        self.records = []
+
+    def reject(self, reason, **record):
+        metrics.count(f"rejected.{reason}")
+        self.counts[reason] += 1
+        if self.quarantine_dir:
+            self.records.append({"reason": reason, **record})
+
+    def process(self, block):
+        for line in block.bad:
+            self.reject("unparseable", line=line.rstrip("\n"))
+        for i in block.live():
+            reason = check_row(block.rows[i])
+            if reason:
+                self.reject(reason, row=block.rows[i])
+                block.drop(i)
+
+    def summary(self):
+        return self.counts, self.records
+
+    def finish(self, results):
+        quarantine = {}
+        for path, _, _, (counts, records) in results:
+            self.rejected.update(counts)
+            if records:
+                quarantine.setdefault(path, []).extend(records)
+        if quarantine:
+            self.quarantine_dir.mkdir(parents=True, exist_ok=True)
+        for path, records in quarantine.items():
+            with (self.quarantine_dir / f"{path.stem}.jsonl").open("a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(ujson.dumps(record) + "\n")
+
+    def report(self):
+        total = sum(self.rejected.values())
+        if not total:
+            print("✅ Schema: every row valid")
+            return 0
+        reasons = ", ".join(f"{reason} {count}" for reason, count in self.rejected.most_common())
+        where = f" -> {self.quarantine_dir}/" if self.quarantine_dir else ""
+        print(f"🚧 Schema: rejected {total} rows ({reasons}){where}")
+        return total
+
+def validate(paths, num_workers=NUM_WORKERS, quarantine_dir=None):
+    """Validates the files in place (invalid rows removed, quarantined if a dir is given). Returns rows rejected."""
+    with metrics.stage("validate", DATA_DIR / "validate.metrics.json"):
+        stage = SchemaStage(quarantine_dir)
+        fused.run(paths, [stage], num_workers, desc="Validating")
+        return stage.report()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate Universal Schema files in place, quarantining bad rows.")
+    parser.add_argument("paths", nargs="*", type=Path, help=f"JSONL files / shard dirs (default: all of {DATA_DIR})")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--no-quarantine", action="store_true", help="Only count and drop rejected rows")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(DATA_DIR.glob("*.jsonl")) + sorted(p for p in DATA_DIR.glob("*.parquet") if p.is_dir())
+    validate(paths, args.workers, None if args.no_quarantine else QUARANTINE_DIR)
@@ -0,0 +1,369 @@
+import argparse
+import random
+import shutil
+import ujson
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as pads
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from pathlib import Path
+from tqdm import tqdm
+
+from src.common.jsonl_index import JsonlReader
+
+# --- CONFIGURATION ---
+# Rows per Parquet shard file (one scrub task per shard)
+ROWS_PER_SHARD = 100_000
+
+# Rows per row group: unit of decompression and of min/max statistics
+ROW_GROUP_ROWS = 10_000
+
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 3
+
+# Universal Schema as Arrow columns. Keys outside the core fields
+# (e.g. nvidia's "meta") ride along as one JSON string in "extra".
+SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("source", pa.string()),
+    ("problem", pa.string()),
+    ("messages", pa.list_(pa.struct([("role", pa.string()), ("content", pa.string())]))),
+    ("extra", pa.string()),
+])
+CORE_FIELDS = ("id", "source", "problem", "messages")
+
+# --- LAYOUT ---
+# data/processed/x.jsonl <-> data/processed/x.parquet/part-00000.parquet, ...
+
+def shard_dir(path):
+    """Sharded counterpart of a JSONL path: x.jsonl -> x.parquet/"""
+    path = Path(path)
+    return path.with_name(path.name.rsplit(".", 1)[0] + ".parquet")
+
+def is_sharded(path):
+    return Path(path).suffix == ".parquet"
+
+def find_source(path):
+    """Resolves a stage input: the shard directory wins if it exists, else the path as given."""
+    path = Path(path)
+    sharded = shard_dir(path)
+    return sharded if sharded.exists() else path
+
+def shard_files(path):
+    """Shard files of a dataset, in row order (a single .parquet file is its own shard)."""
+    path = Path(path)
+    if path.is_dir():
+        return sorted(path.glob("part-*.parquet"))
+    return [path]
+
+def temp_dir(path):
+    return Path(path).with_name(Path(path).name + ".tmp")
+
+def replace_dir(temp_path, path):
+    """Atomic-ish swap of a finished shard directory into place."""
+    path = Path(path)
+    old = path.with_name(path.name + ".old")
+    if path.exists():
+        path.rename(old)
+    Path(temp_path).rename(path)
+    shutil.rmtree(old, ignore_errors=True)
+
+# --- ROW <-> ARROW ---
+def to_table(rows):
+    """List of Universal Schema dicts -> Arrow table with SCHEMA."""
+    cols = {name: [] for name in SCHEMA.names}
+    for row in rows:
+        for name in CORE_FIELDS:
+            cols[name].append(row.get(name))
+        extra = {k: v for k, v in row.items() if k not in CORE_FIELDS}
+        cols["extra"].append(ujson.dumps(extra) if extra else None)
+    return pa.Table.from_pydict(cols, schema=SCHEMA)
+
+def to_rows(table):
+    """Arrow table with SCHEMA (or a column subset of it) -> list of dicts."""
+    rows = table.to_pylist()
+    for row in rows:
+        extra = row.pop("extra", None)
+        if extra:
+            row.update(ujson.loads(extra))
+        # Missing fields come back as nulls; drop them so "id" not in row still works
+        for name in CORE_FIELDS:
+            if name in row and row[name] is None:
+                del row[name]
+    return rows
+
+def write_shard(table, path):
+    """Writes one shard with the standard compression / row-group layout."""
+    pq.write_table(
+        table, path,
+        row_group_size=ROW_GROUP_ROWS,
+        compression=COMPRESSION,
+        compression_level=COMPRESSION_LEVEL,
+        write_statistics=True,
+    )
+
+class ShardWriter:
+    """
+    Streams rows into a directory of zstd Parquet shards. Everything is
+    written to <dir>.tmp and swapped in on close(), like the JSONL stages.
+
+        with ShardWriter(shard_dir(OUT)) as writer:
+            writer.write_rows(rows)
+    """
+
+    def __init__(self, path, rows_per_shard=ROWS_PER_SHARD):
+        self.path = Path(path)
+        self.temp_path = temp_dir(self.path)
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+        self.temp_path.mkdir(parents=True)
+        self.rows_per_shard = rows_per_shard
+        self.pending = []
+        self.pending_rows = 0
+        self.writer = None
+        self.in_shard = 0
+        self.shards = 0
+        self.count = 0
+
+    def write_rows(self, rows):
+        self.write_table(to_table(rows))
+
+    def write_table(self, table):
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        if self.pending_rows >= ROW_GROUP_ROWS:
+            self._flush()
+
+    def _flush(self, final=False):
+        table = pa.concat_tables(self.pending)
+        # Emit full row groups, cut at shard boundaries; keep the remainder
+        while table.num_rows >= ROW_GROUP_ROWS or (final and table.num_rows):
+            if self.writer is None:
+                self._open_shard()
+            n = min(ROW_GROUP_ROWS, self.rows_per_shard - self.in_shard, table.num_rows)
+            self.writer.write_table(table.slice(0, n))
+            self.in_shard += n
+            self.count += n
+            table = table.slice(n)
+            if self.in_shard >= self.rows_per_shard:
+                self._close_shard()
+        self.pending = [table] if table.num_rows else []
+        self.pending_rows = table.num_rows
+
+    def _open_shard(self):
+        self.writer = pq.ParquetWriter(
+            self.temp_path / f"part-{self.shards:05d}.parquet", SCHEMA,
+            compression=COMPRESSION,
+            compression_level=COMPRESSION_LEVEL,
+            write_statistics=True,
+        )
+        self.in_shard = 0
+        self.shards += 1
+
+    def _close_shard(self):
+        self.writer.close()
+        self.writer = None
+
+    def close(self):
+        if self.pending:
+            self._flush(final=True)
+        if self.shards == 0:
+            self._open_shard() # empty dataset: one schema-only shard
+        if self.writer is not None:
+            self._close_shard()
+        replace_dir(self.temp_path, self.path)
+        return self.count
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+# --- READING ---
+class ShardReader:
+    """
+    Random-access reader over a shard directory. Files are memory-mapped
+    and only the row groups holding requested rows are decompressed.
+    Same interface as JsonlReader (len, [i], sample) plus columnar access.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.files = shard_files(self.path)
+        self.dataset = pads.dataset(
+            [str(f) for f in self.files], schema=SCHEMA, format="parquet",
+            filesystem=pafs.LocalFileSystem(use_mmap=True),
+        )
+        # Row counts come from the footers, no data pages are read
+        self.counts = [pq.ParquetFile(f, memory_map=True).metadata.num_rows for f in self.files]
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def take(self, indices, columns=None):
+        """Arrow table of the rows at the given global indices, in that order."""
+        return self.dataset.take(pa.array(np.asarray(indices, dtype=np.int64)), columns=columns)
+
+    def __getitem__(self, i):
+        return to_rows(self.take([i]))[0]
+
+    def rows(self, indices):
+        """Decoded rows at the given indices, in that order."""
+        return to_rows(self.take(indices))
+
+    def sample(self, k, rng=None):
+        """Same indices as JsonlReader.sample() / rng.sample(rows, k)."""
+        rng = rng or random
+        return self.rows(rng.sample(range(len(self)), k))
+
+    def iter_batches(self, columns=None, batch_size=ROW_GROUP_ROWS):
+        """Yields Arrow record batches in row order."""
+        for f in self.files:
+            yield from pq.ParquetFile(f, memory_map=True).iter_batches(batch_size=batch_size, columns=columns)
+
+    def iter_rows(self):
+        for batch in self.iter_batches():
+            yield from to_rows(pa.Table.from_batches([batch]))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_reader(path):
+    """ShardReader for shard directories / .parquet files, JsonlReader otherwise."""
+    return ShardReader(path) if is_sharded(path) else JsonlReader(path)
+
+def count_rows(path):
+    """Row count of a stage file: Parquet footers, or non-blank JSONL lines."""
+    if is_sharded(path):
+        return len(ShardReader(path))
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+def data_bytes(path):
+    """Uncompressed payload size: JSONL file size, or Parquet row-group sizes."""
+    if not is_sharded(path):
+        return Path(path).stat().st_size
+    total = 0
+    for f in shard_files(path):
+        meta = pq.ParquetFile(f).metadata
+        total += sum(meta.row_group(i).total_byte_size for i in range(meta.num_row_groups))
+    return total
+
+def iter_tables(path, batch_size=ROW_GROUP_ROWS):
+    """Arrow tables (SCHEMA) of up to batch_size rows from either format, in row order."""
+    if is_sharded(path):
+        for batch in ShardReader(path).iter_batches(batch_size=batch_size):
+            yield pa.Table.from_batches([batch])
+        return
+    rows = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rows.append(ujson.loads(line))
+            if len(rows) >= batch_size:
+                yield to_table(rows)
+                rows = []
+    if rows:
+        yield to_table(rows)
+
+def map_shards(path, fn):
+    """
+    Rewrites every shard as fn(table, first_row) -> table (e.g. a filter),
+    keeping file boundaries. The directory is swapped in at the end.
+    """
+    path = Path(path)
+    temp_path = temp_dir(path)
+    shutil.rmtree(temp_path, ignore_errors=True)
+    temp_path.mkdir(parents=True)
+    start = 0
+    count = 0
+    for f in shard_files(path):
+        table = pq.read_table(f, memory_map=True)
+        out = fn(table, start)
+        write_shard(out, temp_path / f.name)
+        start += table.num_rows
+        count += out.num_rows
+    replace_dir(temp_path, path)
+    return count
+
+def load_dataset(path):
+    """
+    HF Dataset for training. Shards load straight from Parquet into the
+    memory-mapped Arrow cache; JSONL goes through the json builder.
+    """
+    import datasets
+    path = Path(path)
+    if is_sharded(path):
+        return datasets.Dataset.from_parquet([str(f) for f in shard_files(path)])
+    return datasets.load_dataset("json", data_files=str(path), split="train")
+
+# --- CONVERSION ---
+def convert(path, out=None):
+    """x.jsonl -> x.parquet/ shards. Broken lines are skipped (as add_ids does)."""
+    path = Path(path)
+    out = out or shard_dir(path)
+    rows = []
+    with ShardWriter(out) as writer, path.open("r", encoding="utf-8") as fin:
+        for line in tqdm(fin, desc=f"Converting {path.name}", unit="rows"):
+            try:
+                rows.append(ujson.loads(line))
+            except ValueError:
+                continue
+            if len(rows) >= ROW_GROUP_ROWS:
+                writer.write_rows(rows)
+                rows = []
+        if rows:
+            writer.write_rows(rows)
+    return writer.count
+
+def export_jsonl(path, out=None):
+    """x.parquet/ shards -> x.jsonl"""
+    path = Path(path)
+    out = Path(out or path.with_suffix(".jsonl"))
+    temp_path = out.with_suffix(".tmp")
+    count = 0
+    with temp_path.open("w", encoding="utf-8") as fout:
+        for row in tqdm(ShardReader(path).iter_rows(), desc=f"Exporting {path.name}", unit="rows"):
+            fout.write(ujson.dumps(row) + "\n")
+            count += 1
+    shutil.move(temp_path, out)
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stage files between JSONL and Parquet shards.")
+    parser.add_argument("paths", nargs="+", type=Path)
+    parser.add_argument("--to-jsonl", action="store_true", help="Export shard directories back to JSONL")
+    parser.add_argument("--remove", action="store_true", help="Delete the source after a successful conversion")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if args.to_jsonl:
+            count = export_jsonl(path)
+            target = path.with_suffix(".jsonl")
+        else:
+            count = convert(path)
+            target = shard_dir(path)
+        before = sum(f.stat().st_size for f in shard_files(path)) if is_sharded(path) else path.stat().st_size
+        after = sum(f.stat().st_size for f in shard_files(target)) if is_sharded(target) else target.stat().st_size
+        print(f"✅ {path} -> {target}: {count} rows, {before / 1e6:.1f}MB -> {after / 1e6:.1f}MB")
+        if args.remove:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
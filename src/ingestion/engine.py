@@ -0,0 +1,377 @@
+import argparse
+import hashlib
+import importlib
+import itertools
+import os
+import shutil
+import ujson
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+from tqdm import tqdm
+
+from src.common import metrics, shards
+
+# --- CONFIGURATION ---
+# Worker processes running filter + transform
+NUM_WORKERS = os.cpu_count() or 1
+
+# Rows per task handed to a worker (one output shard per task)
+BATCH_SIZE = 5_000
+
+# Tasks in flight per worker; bounds memory when streaming
+PREFETCH = 2
+
+# Merged batches between progress checkpoints (see run_ingestion(resume=True))
+CHECKPOINT_EVERY = 10
+
+# Bytes read per step when hashing the output
+HASH_BYTES = 8 * 1024 * 1024
+
+@dataclass(frozen=True)
+class SourceAdapter:
+    """
+    One ingestion source: where rows come from, which rows to keep and
+    how each kept row becomes a Universal Schema sample.
+    keep/transform must be module-level functions (they run in workers).
+    """
+    name: str
+    out: Path
+    load: Callable[[], Iterable[dict]]
+    keep: Callable[[dict], bool]
+    transform: Callable[[dict], dict]
+    # If set, rows get "id": f"{id_prefix}{n}" (n = output position) at merge time
+    id_prefix: Optional[str] = None
+    # Stop after this many written samples
+    limit: Optional[int] = None
+
+# Adapter name -> module exposing ADAPTER
+SOURCES = {
+    "numina": "src.ingestion.process_numina",
+    "tir": "src.ingestion.process_tir",
+    "nvidia": "src.ingestion.process_nvidia",
+}
+
+def get_adapter(name):
+    return importlib.import_module(SOURCES[name]).ADAPTER
+
+def load_local(path):
+    """
+    Offline fixture loader: .jsonl -> list of dicts, .arrow / .parquet
+    (file or shard directory) -> memory-mapped datasets.Dataset.
+    """
+    path = Path(path)
+    if path.suffix == ".jsonl":
+        with path.open("r", encoding="utf-8") as f:
+            return [ujson.loads(line) for line in f if line.strip()]
+    from datasets import Dataset
+    if path.suffix == ".arrow":
+        return Dataset.from_file(str(path))
+    if path.suffix == ".parquet":
+        return Dataset.from_parquet([str(f) for f in shards.shard_files(path)])
+    raise ValueError(f"Unsupported fixture format: {path}")
+
+def open_source(adapter, local_path=None):
+    return load_local(local_path) if local_path else adapter.load()
+
+def is_indexable(data):
+    # In-memory / Arrow-backed sources can be sliced by workers directly;
+    # streaming sources have to be batched by the parent.
+    return hasattr(data, "__len__") and hasattr(data, "__getitem__")
+
+def rows_between(data, start, end):
+    batch = data[start:end]
+    if isinstance(batch, list):
+        return batch
+    # datasets.Dataset slices are column-major
+    cols = list(batch)
+    return [dict(zip(cols, vals)) for vals in zip(*(batch[c] for c in cols))]
+
+# --- WORKERS ---
+_WORKER = {}
+
+def _init_worker(name, local_path, indexed):
+    _WORKER["adapter"] = get_adapter(name)
+    # Indexed sources are reopened once per worker (Arrow is memory-mapped)
+    _WORKER["data"] = open_source(_WORKER["adapter"], local_path) if indexed else None
+
+def _process_task(task, part_path):
+    """
+    Filters + transforms one batch into a shard file.
+    Returns the in-batch positions of the rows written.
+    """
+    adapter = _WORKER["adapter"]
+    kind, payload = task
+    rows = rows_between(_WORKER["data"], *payload) if kind == "range" else payload
+    kept = []
+    with metrics.timer("task"), part_path.open("w", encoding="utf-8") as f:
+        for pos, row in enumerate(rows):
+            if not adapter.keep(row):
+                continue
+            f.write(ujson.dumps(adapter.transform(row)) + "\n")
+            kept.append(pos)
+    metrics.count("rows_read", len(rows))
+    metrics.count("rows_kept", len(kept))
+    return kept
+
+def iter_tasks(data, batch_size, start=0, skip=0, state=None):
+    """
+    Yields (task, batch_start, batch_len, state_before): batch_start is the
+    upstream row position of the batch, state_before the streaming iterator
+    state just before its first row (None = only reachable from row 0).
+    Streaming sources first drop `skip` rows that were already consumed.
+    """
+    if is_indexable(data):
+        for lo in range(start, len(data), batch_size):
+            hi = min(lo + batch_size, len(data))
+            yield ("range", (lo, hi)), lo, hi - lo, None
+        return
+    # HF IterableDatasets can snapshot their position (datasets >= 2.18)
+    snapshot = getattr(data, "state_dict", None)
+    rows = iter(data)
+    if skip:
+        next(itertools.islice(rows, skip, skip), None)
+        state = snapshot() if snapshot else None
+    batch = []
+    pos = start
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield ("rows", batch), pos, len(batch), state
+            state = snapshot() if snapshot else None
+            pos += len(batch)
+            batch = []
+    if batch:
+        yield ("rows", batch), pos, len(batch), state
+
+def merge_shard(part_path, kept, fout, adapter, written, limit):
+    """
+    Appends a shard to the output, assigning positional IDs and honouring
+    the limit. Returns (written, rows of the batch consumed).
+    """
+    consumed = None
+    with part_path.open("r", encoding="utf-8") as fin:
+        for pos, line in zip(kept, fin):
+            if limit is not None and written >= limit:
+                # Stop right after the last row used, so an extend picks up here
+                consumed = pos
+                break
+            if adapter.id_prefix is not None:
+                # Splice "id" in as the first key, matching the old in-loop dict layout
+                line = '{"id":' + ujson.dumps(f"{adapter.id_prefix}{written}") + "," + line[1:]
+            fout.write(line)
+            written += 1
+    part_path.unlink()
+    return written, consumed
+
+# --- CHECKPOINTS ---
+# {"source", "consumed" (upstream rows), "written", "offset" (output bytes),
+#  "sha256" (of output bytes [0, offset)),
+#  "state" + "state_pos" (streaming iterator state and the row it points at),
+#  "limit", "complete"}
+
+class OutputHash:
+    """
+    Running sha256 of the output's first `size` bytes. Each checkpoint only
+    hashes what was appended since the previous one.
+    """
+
+    def __init__(self, path, size=0):
+        self.path = path
+        self.h = hashlib.sha256()
+        self.size = 0
+        self.advance(size)
+
+    def advance(self, size):
+        if size > self.size:
+            with self.path.open("rb") as f:
+                f.seek(self.size)
+                while self.size < size:
+                    chunk = f.read(min(HASH_BYTES, size - self.size))
+                    if not chunk:
+                        break
+                    self.h.update(chunk)
+                    self.size += len(chunk)
+        return self.h.hexdigest()
+
+def checkpoint_path(adapter):
+    return adapter.out.with_suffix(".ckpt.json")
+
+def save_checkpoint(adapter, fout, hasher, **ckpt):
+    # Output must be on disk before the checkpoint that points into it
+    fout.flush()
+    os.fsync(fout.fileno())
+    ckpt["offset"] = os.path.getsize(fout.name)
+    ckpt["sha256"] = hasher.advance(ckpt["offset"])
+    path = checkpoint_path(adapter)
+    temp_path = path.with_suffix(".tmp")
+    with temp_path.open("w") as f:
+        ujson.dump({"source": adapter.name, **ckpt}, f)
+    os.replace(temp_path, path)
+
+def load_checkpoint(adapter):
+    path = checkpoint_path(adapter)
+    if not path.exists():
+        return None
+    with path.open("r") as f:
+        ckpt = ujson.load(f)
+    if ckpt.get("source") != adapter.name:
+        raise ValueError(f"Checkpoint {path} belongs to '{ckpt.get('source')}', not '{adapter.name}'")
+    return ckpt
+
+def verify_output(adapter, ckpt, path):
+    """
+    Checks that `path` still starts with the bytes the checkpoint describes
+    (a finished output must match exactly). Returns its OutputHash.
+    """
+    size = path.stat().st_size if path.exists() else None
+    offset = ckpt["offset"]
+    hint = "It was probably rewritten in place (scrub / dedup / add_ids); re-ingest without --resume."
+    if size is None or size < offset or (ckpt["complete"] and size != offset):
+        found = "missing" if size is None else f"{size} bytes"
+        raise ValueError(f"Cannot resume {adapter.name}: {path} is {found}, its checkpoint expects {offset} bytes. {hint}")
+    hasher = OutputHash(path, offset)
+    if hasher.h.hexdigest() != ckpt.get("sha256"):
+        raise ValueError(f"Cannot resume {adapter.name}: the first {offset} bytes of {path} differ from its checkpoint. {hint}")
+    return hasher
+
+def run_ingestion(adapter, local_path=None, num_workers=NUM_WORKERS, batch_size=BATCH_SIZE,
+                  resume=False, limit=None, checkpoint_every=CHECKPOINT_EVERY, fmt="jsonl"):
+    """
+    Runs adapter over its source in a worker pool. Shards are merged in
+    source order, so the output is identical for any worker count.
+
+    Progress is checkpointed every `checkpoint_every` merged batches.
+    resume=True continues from the last checkpoint: an interrupted run is
+    truncated back to it, and a finished run is extended up to a higher
+    `limit` without re-reading the rows it already consumed. Either is
+    refused if the output no longer matches the checkpoint (size + sha256).
+
+    fmt="parquet" publishes the finished output as zstd Parquet shards
+    (<stem>.parquet/) instead of JSONL. The JSONL work file is what the
+    checkpoints point into, so only interrupted runs can be resumed then.
+    """
+    with metrics.stage(f"ingest_{adapter.name}", metrics.metrics_path(adapter.out)):
+        limit = limit if limit is not None else adapter.limit
+        temp_path = adapter.out.with_suffix(".tmp")
+        ckpt = load_checkpoint(adapter) if resume else None
+
+        consumed = 0
+        written = 0
+        state = None
+        state_pos = 0
+        hasher = OutputHash(temp_path)
+        if ckpt:
+            if ckpt["complete"] and (limit is None or ckpt["written"] >= limit or ckpt["limit"] is None):
+                print(f"{adapter.name}: already complete ({ckpt['written']} samples), nothing to do.")
+                return ckpt["written"]
+            if ckpt["complete"]:
+                if not adapter.out.exists():
+                    raise FileNotFoundError(f"Extending {adapter.name} needs its JSONL output {adapter.out} "
+                                            f"(runs published with --format parquet cannot be extended)")
+                hasher = verify_output(adapter, ckpt, adapter.out)
+                # Extend: reopen the finished output as the work-in-progress file
+                shutil.move(adapter.out, temp_path)
+                hasher.path = temp_path
+            else:
+                hasher = verify_output(adapter, ckpt, temp_path)
+            with temp_path.open("r+b") as f:
+                f.truncate(ckpt["offset"])
+            consumed, written = ckpt["consumed"], ckpt["written"]
+            state, state_pos = ckpt["state"], ckpt["state_pos"]
+            print(f"Resuming {adapter.name} at upstream row {consumed} ({written} samples written)...")
+
+        print(f"Loading {adapter.name}...")
+        data = open_source(adapter, local_path)
+        indexed = is_indexable(data)
+        # Streaming resume: jump to the saved iterator state, then re-read at most
+        # one batch; without a state, the consumed prefix is re-read and dropped.
+        if state is not None and hasattr(data, "load_state_dict"):
+            data.load_state_dict(state)
+        else:
+            state, state_pos = None, 0
+        target = f" (Target: {limit})" if limit else ""
+        print(f"Ingesting {adapter.name} with {num_workers} workers{target}...")
+
+        adapter.out.parent.mkdir(parents=True, exist_ok=True)
+        pending = deque()
+        skip = 0 if indexed else consumed - state_pos
+        tasks = iter_tasks(data, batch_size, start=consumed, skip=skip, state=state)
+        merged = 0
+
+        def merge_next():
+            nonlocal written, consumed, state, state_pos, merged
+            fut, part_path, batch_start, batch_len, batch_state = pending.popleft()
+            # wait: parent idle on workers; merge: parent busy appending
+            with metrics.timer("wait"):
+                kept = metrics.result(fut)
+            with metrics.timer("merge"):
+                written, used = merge_shard(part_path, kept, fout, adapter, written, limit)
+            consumed = batch_start + (batch_len if used is None else used)
+            if batch_state is not None:
+                state, state_pos = batch_state, batch_start
+            merged += 1
+            progress.update(1)
+            if checkpoint_every and merged % checkpoint_every == 0:
+                save_checkpoint(adapter, fout, hasher, consumed=consumed, written=written, state=state,
+                                state_pos=state_pos, limit=limit, complete=False)
+
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_worker,
+            initargs=(adapter.name, local_path, indexed),
+        ) as pool, temp_path.open("a" if ckpt else "w", encoding="utf-8") as fout:
+            progress = tqdm(unit="batches", desc=adapter.name)
+            for idx, (task, batch_start, batch_len, batch_state) in enumerate(tasks):
+                if limit is not None and written >= limit:
+                    break
+                part_path = adapter.out.with_suffix(f".part{idx}")
+                pending.append((metrics.submit(pool, _process_task, task, part_path), part_path,
+                                batch_start, batch_len, batch_state))
+                if len(pending) >= num_workers * PREFETCH:
+                    merge_next()
+
+            # Drain (or discard, once the limit is hit) whatever is still in flight
+            while pending:
+                if limit is not None and written >= limit:
+                    fut, part_path = pending.popleft()[:2]
+                    metrics.result(fut)
+                    part_path.unlink()
+                else:
+                    merge_next()
+            progress.close()
+            save_checkpoint(adapter, fout, hasher, consumed=consumed, written=written, state=state,
+                            state_pos=state_pos, limit=limit, complete=True)
+
+        # This run's share only: a resumed run starts at its checkpoint
+        metrics.count("rows_written", written - (ckpt["written"] if ckpt else 0))
+        metrics.count("bytes_written", temp_path.stat().st_size - (ckpt["offset"] if ckpt else 0))
+        if local_path:
+            metrics.count("bytes_read", metrics.disk_bytes(local_path))
+        shutil.move(temp_path, adapter.out)
+        if fmt == "parquet":
+            shards.convert(adapter.out)
+            adapter.out.unlink()
+            print(f"Successfully wrote {written} samples to {shards.shard_dir(adapter.out)}")
+            return written
+        print(f"Successfully wrote {written} samples to {adapter.out}")
+        return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run ingestion adapters in a worker pool.")
+    parser.add_argument("sources", nargs="+", choices=sorted(SOURCES))
+    parser.add_argument("--input", help="Local .jsonl/.arrow/.parquet fixture instead of the HF dataset")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the last checkpoint (with a higher --limit: extend a finished run)")
+    parser.add_argument("--limit", type=int, help="Override the adapter's sample target")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl",
+                        help="Output format (parquet: zstd shards in <stem>.parquet/)")
+    args = parser.parse_args()
+
+    for name in args.sources:
+        run_ingestion(get_adapter(name), args.input, args.workers, args.batch_size,
+                      resume=args.resume, limit=args.limit, fmt=args.format)
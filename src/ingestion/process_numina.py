@@ -1,50 +1,54 @@
-import ujson
 from datasets import load_dataset
-from tqdm import tqdm
 from pathlib import Path
 
+from src.common import metrics
+from src.ingestion.engine import SourceAdapter, run_ingestion
+
 OUT = Path("data/processed/logic_core.jsonl")
-OUT.parent.mkdir(parents=True, exist_ok=True)
 
-print("Loading NuminaMath-1.5...")
-ds = load_dataset("AI-MO/NuminaMath-1.5", split="train")
+def load():
+    return load_dataset("AI-MO/NuminaMath-1.5", split="train")
 
 def valid(row):
     # 1. Type Filter
     if row.get("question_type") != "math-word-problem":
+        metrics.count("rejected.question_type")
         return False
     
     # 2. Source Filter (No synthetic)
     src = row.get("source", "")
     if "synthetic_math" in src or "synthetic_amc" in src:
+        metrics.count("rejected.synthetic_source")
         return False
     
     # 3. Answer Filter
     ans = row.get("answer")
     if ans is None:
+        metrics.count("rejected.no_answer")
         return False
     try:
         # Check if it looks like a number (allows "100" or "100.0" but filters text)
-        float(ans) 
-    except:
+        float(ans)
+    except (TypeError, ValueError):
+        metrics.count("rejected.non_numeric_answer")
         return False
     return True
 
-with OUT.open("w") as f:
-    for row in tqdm(ds):
-        if not valid(row):
-            continue
+def to_sample(row):
+    return {
+        "source": "numina_math_1.5",
+        "problem": row["problem"],
+        "messages": [
+            {"role": "user", "content": row["problem"]},
+            {
+                "role": "assistant",
+                # Wrap solution in <think>
+                "content": f"<think>{row['solution']}</think>\n<answer>{row['answer']}</answer>"
+            }
+        ]
+    }
+
+ADAPTER = SourceAdapter(name="numina", out=OUT, load=load, keep=valid, transform=to_sample)
 
-        sample = {
-            "source": "numina_math_1.5",
-            "problem": row["problem"],
-            "messages": [
-                {"role": "user", "content": row["problem"]},
-                {
-                    "role": "assistant",
-                    # Wrap solution in <think>
-                    "content": f"<think>{row['solution']}</think>\n<answer>{row['answer']}</answer>"
-                }
-            ]
-        }
-        f.write(ujson.dumps(sample) + "\n")
\ No newline at end of file
+if __name__ == "__main__":
+    run_ingestion(ADAPTER)
@@ -1,69 +1,80 @@
-import ujson
 from datasets import load_dataset
-from tqdm import tqdm
 from pathlib import Path
 
+from src.common import metrics
+from src.ingestion.engine import SourceAdapter, run_ingestion
+
 # Config
 OUT_PATH = Path("data/processed/code_silver.jsonl")
-OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
 MAX_SAMPLES = 200_000 # Configurable
 
-def process_nvidia():
-    print(f"Streaming OpenMathInstruct-2 (Target: {MAX_SAMPLES})...")
-    
-    ds = load_dataset(
+# True: continue from the last checkpoint (code_silver.ckpt.json) instead of
+# restarting. If the previous run finished, raising MAX_SAMPLES extends it
+# without re-streaming the rows it already consumed.
+RESUME = False
+
+def load():
+    return load_dataset(
         "nvidia/OpenMathInstruct-2",
         split="train_5M",
         streaming=True
     )
 
-    written = 0
-    
-    with open(OUT_PATH, "w") as f:
-        for row in tqdm(ds):
-            # 1. Filter Source
-            src = row.get("problem_source", "unknown")
-            if src not in ["math", "augmented_math"]:
-                continue
-                
-            # 2. Filter Length
-            if len(row["problem"]) > 4000:
-                continue
+def valid(row):
+    # 1. Filter Source
+    src = row.get("problem_source", "unknown")
+    if src not in ["math", "augmented_math"]:
+        metrics.count("rejected.problem_source")
+        return False
+        
+    # 2. Filter Length
+    if len(row["problem"]) > 4000:
+        metrics.count("rejected.problem_length")
+        return False
 
-            # 3. Filter Integer Answer
-            try:
-                ans_str = row.get("expected_answer", "0")
-                if "." in ans_str:
-                    if not float(ans_str).is_integer():
-                        continue
-            except:
-                continue
+    # 3. Filter Integer Answer (only decimal-looking answers are checked)
+    try:
+        ans_str = row.get("expected_answer", "0")
+        if "." in ans_str:
+            if not float(ans_str).is_integer():
+                metrics.count("rejected.non_integer_answer")
+                return False
+    except (TypeError, ValueError):
+        metrics.count("rejected.decimal_answer")
+        return False
+    return True
 
-            # 4. Universal Schema (Wrap in <think>)
-            sample = {
-                "id": f"nvidia_om2_{written}",
-                "source": "nvidia_openmath_2",
-                "problem": row["problem"],
-                "messages": [
-                    {"role": "user", "content": row["problem"]},
-                    {
-                        "role": "assistant",
-                        "content": f"<think>{row['generated_solution']}</think>\n<answer>{row['expected_answer']}</answer>"
-                    }
-                ],
-                "meta": {
-                    "source_type": src,
-                    "is_code": True
-                }
+def to_sample(row):
+    # 4. Universal Schema (Wrap in <think>)
+    # "id" (nvidia_om2_{n}) is assigned by the engine in output order
+    return {
+        "source": "nvidia_openmath_2",
+        "problem": row["problem"],
+        "messages": [
+            {"role": "user", "content": row["problem"]},
+            {
+                "role": "assistant",
+                "content": f"<think>{row['generated_solution']}</think>\n<answer>{row['expected_answer']}</answer>"
             }
-            
-            f.write(ujson.dumps(sample) + "\n")
-            written += 1
-            
-            if written >= MAX_SAMPLES:
-                break
-    
-    print(f"Successfully wrote {written} samples to {OUT_PATH}")
+        ],
+        "meta": {
+            "source_type": row.get("problem_source", "unknown"),
+            "is_code": True
+        }
+    }
+
+ADAPTER = SourceAdapter(
+    name="nvidia",
+    out=OUT_PATH,
+    load=load,
+    keep=valid,
+    transform=to_sample,
+    id_prefix="nvidia_om2_",
+    limit=MAX_SAMPLES,
+)
+
+def process_nvidia(resume=RESUME):
+    run_ingestion(ADAPTER, resume=resume)
 
 if __name__ == "__main__":
-    process_nvidia()
\ No newline at end of file
+    process_nvidia()
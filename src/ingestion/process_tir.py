@@ -1,41 +1,48 @@
-import ujson
 from datasets import load_dataset
-from tqdm import tqdm
 from pathlib import Path
 
+from src.common import metrics
+from src.ingestion.engine import SourceAdapter, run_ingestion
+
 OUT = Path("data/processed/code_plat.jsonl")
-OUT.parent.mkdir(parents=True, exist_ok=True)
 
-print("Loading NuminaMath-TIR...")
-ds = load_dataset("AI-MO/NuminaMath-TIR", split="train")
+def load():
+    return load_dataset("AI-MO/NuminaMath-TIR", split="train")
 
 def has_valid_python(code):
     return "```python" in code
 
-with OUT.open("w") as f:
-    for row in tqdm(ds):
-        sol = row["solution"]
-        # Basic quality check
-        if not has_valid_python(sol):
-            continue
-
-        # --- SCHEMA FIX ---
-        # Wrap the code-integrated solution in <think> tags.
-        # The Numina TIR dataset usually ends with the final answer inside the text,
-        # but to be safe and uniform, we wrap the whole reasoning/coding block.
-        content_body = f"<think>{sol}</think>"
-        
-        # If the dataset has a separate 'answer' field (it usually does), append it.
-        # NuminaTIR rows usually have 'solution' and 'answer'.
-        if "answer" in row and row["answer"]:
-             content_body += f"\n<answer>{row['answer']}</answer>"
-
-        sample = {
-            "source": "numina_tir",
-            "problem": row["problem"],
-            "messages": [
-                {"role": "user", "content": row["problem"]},
-                {"role": "assistant", "content": content_body}
-            ]
-        }
-        f.write(ujson.dumps(sample) + "\n")
\ No newline at end of file
+def valid(row):
+    # Basic quality check
+    if not has_valid_python(row["solution"]):
+        metrics.count("rejected.no_python")
+        return False
+    return True
+
+def to_sample(row):
+    sol = row["solution"]
+
+    # --- SCHEMA FIX ---
+    # Wrap the code-integrated solution in <think> tags.
+    # The Numina TIR dataset usually ends with the final answer inside the text,
+    # but to be safe and uniform, we wrap the whole reasoning/coding block.
+    content_body = f"<think>{sol}</think>"
+    
+    # If the dataset has a separate 'answer' field (it usually does), append it.
+    # NuminaTIR rows usually have 'solution' and 'answer'.
+    if "answer" in row and row["answer"]:
+         content_body += f"\n<answer>{row['answer']}</answer>"
+
+    return {
+        "source": "numina_tir",
+        "problem": row["problem"],
+        "messages": [
+            {"role": "user", "content": row["problem"]},
+            {"role": "assistant", "content": content_body}
+        ]
+    }
+
+ADAPTER = SourceAdapter(name="tir", out=OUT, load=load, keep=valid, transform=to_sample)
+
+if __name__ == "__main__":
+    run_ingestion(ADAPTER)
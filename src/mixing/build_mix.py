@@ -1,8 +1,18 @@
-import random
+import argparse
+import shutil
+import time
+import zlib
 import ujson
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import Counter
 from pathlib import Path
 from tqdm import tqdm
 
+from src.common import fused, lengths, metrics, shards
+from src.mixing import profile_corpus
+
 FILES = {
     "logic_core": ("data/processed/logic_core.jsonl", 1.0),
     "code_plat": ("data/processed/code_plat.jsonl", 3.0),
@@ -10,19 +20,267 @@ FILES = {
     "recursive": ("data/processed/recursive.jsonl", 1.0),
 }
 
+# Sources may also be Parquet shard directories (x.parquet/ is used when present)
 OUT = Path("data/gold/aimo_system2_final.jsonl")
-OUT.parent.mkdir(parents=True, exist_ok=True)
 
-buffers = []
+# "jsonl" or "parquet" (zstd shards in aimo_system2_final.parquet/, same rows in the same order)
+FORMAT = "jsonl"
+
+# Same seed -> byte-identical output
+SEED = 42
+
+# Optional token budgets (name -> tokens) that replace a source's row weight.
+# Rows are drawn with replacement until the budget is hit (within one row),
+# using the cached per-row length index (src/common/lengths.py).
+TOKEN_BUDGETS = {}
+
+# External shuffle: rows are scattered into on-disk buckets of ~BUCKET_BYTES,
+# then each bucket is shuffled in RAM. Peak memory ~ one bucket.
+BUCKET_DIR = OUT.parent / ".mix_buckets"
+BUCKET_BYTES = 256 * 1024 * 1024
+
+def count_rows(path):
+    """
+    Non-blank lines (or Parquet footer rows): from data/profile.json when
+    profile_corpus saw the file as it is now, else counted without parsing.
+    """
+    n = profile_corpus.profiled_rows(path)
+    return shards.count_rows(path) if n is None else n
+
+def iter_rows(path):
+    """Yields raw non-blank lines (bytes, newline-terminated)."""
+    if shards.is_sharded(path):
+        with shards.ShardReader(path) as reader:
+            for row in reader.iter_rows():
+                yield (ujson.dumps(row) + "\n").encode("utf-8")
+        return
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            yield line if line.endswith(b"\n") else line + b"\n"
+
+def scatter_lines(path, n, copies, targets, buckets, desc):
+    """Writes copies[i] copies of line i to buckets targets[t : t + copies[i]]."""
+    t = 0
+    for line, c in tqdm(zip(iter_rows(path), copies), total=n, desc=desc):
+        for b in targets[t : t + c]:
+            buckets[b].write(line)
+        t += c
+
+def scatter_tables(path, n, copies, targets, buckets, desc):
+    """Columnar scatter_lines(): same rows to the same buckets, in the same order."""
+    t = 0
+    start = 0
+    progress = tqdm(total=n, desc=desc)
+    for table in shards.iter_tables(path):
+        reps = np.repeat(np.arange(table.num_rows), copies[start : start + table.num_rows])
+        dest = targets[t : t + len(reps)]
+        # Stable sort keeps (row, copy) order within each bucket
+        order = np.argsort(dest, kind="stable")
+        bounds = np.searchsorted(dest[order], np.arange(len(buckets) + 1))
+        for b in np.flatnonzero(np.diff(bounds)):
+            buckets[b].write_table(table.take(reps[order[bounds[b] : bounds[b + 1]]]))
+        start += table.num_rows
+        t += len(reps)
+        progress.update(table.num_rows)
+    progress.close()
+
+def gather_lines(bucket_paths, rng):
+    """Shuffles each JSONL bucket in RAM and appends them, in bucket order, to OUT (atomic swap)."""
+    temp_path = OUT.with_suffix(".tmp")
+    with temp_path.open("wb") as fout:
+        for p in tqdm(bucket_paths, desc="Shuffling buckets"):
+            with p.open("rb") as fin:
+                lines = fin.readlines()
+            for i in rng.permutation(len(lines)):
+                fout.write(lines[i])
+            p.unlink()
+    shutil.move(temp_path, OUT)
+
+def build_mix(seed=SEED, fmt=FORMAT, budgets=None):
+    with metrics.stage("build_mix", metrics.metrics_path(OUT)):
+        rng = np.random.default_rng(seed)
+        columnar = fmt == "parquet"
+        budgets = TOKEN_BUDGETS if budgets is None else budgets
+
+        # 1. Size the mix: k = int(n * weight) draws with replacement per source,
+        # or as many draws as its token budget takes
+        plan = []
+        expected_bytes = 0
+        for name, (path, weight) in FILES.items():
+            path = shards.find_source(path)
+            n = count_rows(path)
+            tokens = None
+            if name in budgets:
+                tokens = lengths.load_lengths(path)["tokens"]
+                tokens = tokens[tokens >= 0] # blank lines are not rows
+                if len(tokens) != n:
+                    raise ValueError(f"Length index of {path} has {len(tokens)} rows, expected {n}")
+                # Estimate only (bucket sizing); the draws decide the real count
+                k = max(1, int(budgets[name] / max(tokens.mean(), 1))) if n and budgets[name] > 0 else 0
+                print(f"  - {name}: {n} rows, budget {budgets[name]} tokens -> ~{k}")
+            else:
+                k = int(n * weight)
+                print(f"  - {name}: {n} rows x {weight} -> {k}")
+            plan.append((name, path, n, k, tokens))
+            if n:
+                expected_bytes += shards.data_bytes(path) * k / n
+
+        num_buckets = max(1, int(np.ceil(expected_bytes / BUCKET_BYTES)))
+        BUCKET_DIR.mkdir(parents=True, exist_ok=True)
+        if columnar:
+            # Buckets are uncompressed Arrow IPC files: memory-mapped on the way back
+            bucket_paths = [BUCKET_DIR / f"bucket_{b:05d}.arrow" for b in range(num_buckets)]
+            buckets = [pa.ipc.new_file(str(p), shards.SCHEMA) for p in bucket_paths]
+        else:
+            bucket_paths = [BUCKET_DIR / f"bucket_{b:05d}.jsonl" for b in range(num_buckets)]
+            buckets = [p.open("wb") for p in bucket_paths]
+
+        # 2. Scatter: per-row multiplicities (same distribution as random.choices),
+        # each copy routed to a random bucket. Rows stay raw bytes (or Arrow data).
+        total = 0
+        try:
+            for name, path, n, k, tokens in plan:
+                if k == 0:
+                    continue
+                if tokens is not None:
+                    draws = lengths.draw_to_budget(rng, tokens, budgets[name])
+                    k = len(draws)
+                    print(f"  - {name}: {k} rows, {int(tokens[draws].sum())} tokens (budget {budgets[name]})")
+                else:
+                    draws = rng.integers(0, n, size=k)
+                copies = np.bincount(draws, minlength=n)
+                targets = rng.integers(0, num_buckets, size=k)
+                scatter = scatter_tables if columnar else scatter_lines
+                with metrics.timer("scatter"):
+                    scatter(path, n, copies, targets, buckets, f"Scattering {name}")
+                metrics.count("bytes_read", metrics.disk_bytes(path))
+                metrics.count(f"rows.{name}", k)
+                total += k
+        finally:
+            for f in buckets:
+                f.close()
+
+        # 3. Gather: shuffle each bucket in RAM and append in bucket order
+        start = time.perf_counter()
+        OUT.parent.mkdir(parents=True, exist_ok=True)
+        if columnar:
+            out = shards.shard_dir(OUT)
+            with shards.ShardWriter(out) as writer:
+                for p in tqdm(bucket_paths, desc="Shuffling buckets"):
+                    with pa.memory_map(str(p)) as source:
+                        table = pa.ipc.open_file(source).read_all()
+                        writer.write_table(table.take(rng.permutation(table.num_rows)))
+                    p.unlink()
+        else:
+            out = OUT
+            gather_lines(bucket_paths, rng)
+        BUCKET_DIR.rmdir()
+        metrics.observe("gather", time.perf_counter() - start)
+        metrics.count("rows_written", total)
+        metrics.count("bytes_written", metrics.disk_bytes(out))
+
+        print(f"✅ Wrote {total} rows to {out} ({num_buckets} buckets)")
+
+# --- FUSED ---
+def part_lines(path, part_path):
+    """Encoded rows of a fused task's output part (JSONL part or Parquet shard)."""
+    if not shards.is_sharded(path):
+        with part_path.open("rb") as f:
+            return [line for line in f if line.strip()]
+    rows = shards.to_rows(pq.read_table(part_path, memory_map=True))
+    return [(ujson.dumps(row) + "\n").encode("utf-8") for row in rows]
+
+class MixStage(fused.Stage):
+    """
+    The mix sampled inside a fused pass. Goes last (after IdStage): it
+    samples the rows that are written. process() draws each row's copies
+    from Poisson(weight), the limit of int(n * weight) draws with
+    replacement, so n need not be known up front. Each copy gets a random
+    bucket. The draws are seeded by the rows' content IDs, so any worker
+    count gives the same mix. finish() scatters the committed lines into
+    the buckets and shuffles them into OUT. JSONL output and row weights
+    only: token budgets need the rewritten files' length index, so those
+    run build_mix() afterwards.
+    """
+    name = "mix"
+    columns = ("id",)
+
+    def __init__(self, seed=SEED):
+        self.seed = seed
+        self.sources = {shards.find_source(path): (name, weight) for name, (path, weight) in FILES.items()}
+        expected_bytes = sum(shards.data_bytes(p) * w for p, (_, w) in self.sources.items() if p.exists())
+        self.num_buckets = max(1, int(np.ceil(expected_bytes / BUCKET_BYTES)))
+        self.counts = Counter()
+
+    def begin(self, path):
+        self.weight = self.sources[path][1] if path in self.sources else 0
+        self.rows = 0
+        self.picks = []
+        self.targets = []
+
+    def process(self, block):
+        live = block.live()
+        if self.weight and live:
+            ids = "\n".join(block.rows[i]["id"] for i in live).encode("utf-8")
+            rng = np.random.default_rng([self.seed, zlib.crc32(ids), len(live)])
+            copies = rng.poisson(self.weight, len(live))
+            picks = np.repeat(np.arange(self.rows, self.rows + len(live)), copies)
+            self.picks.append(picks)
+            self.targets.append(rng.integers(0, self.num_buckets, len(picks)))
+        self.rows += len(live)
+
+    def summary(self):
+        if not self.picks:
+            return self.rows, np.zeros(0, np.int64), np.zeros(0, np.int64)
+        return self.rows, np.concatenate(self.picks), np.concatenate(self.targets)
+
+    def finish(self, results):
+        start = time.perf_counter()
+        counts = Counter()
+        BUCKET_DIR.mkdir(parents=True, exist_ok=True)
+        bucket_paths = [BUCKET_DIR / f"bucket_{b:05d}.jsonl" for b in range(self.num_buckets)]
+        buckets = [p.open("wb") for p in bucket_paths]
+        try:
+            for path, part_path, written, (rows, picks, targets) in results:
+                assert rows == written, f"{self.name} must be the last stage that drops rows"
+                if not len(picks):
+                    continue
+                lines = part_lines(path, part_path)
+                for i, b in zip(picks.tolist(), targets.tolist()):
+                    buckets[b].write(lines[i])
+                counts[self.sources[path][0]] += len(picks)
+        finally:
+            for f in buckets:
+                f.close()
+        metrics.observe("mix_scatter", time.perf_counter() - start)
 
-for name, (path, weight) in FILES.items():
-    with open(path) as f:
-        rows = [ujson.loads(l) for l in f]
-        k = int(len(rows) * weight)
-        buffers.extend(random.choices(rows, k=k))
+        start = time.perf_counter()
+        OUT.parent.mkdir(parents=True, exist_ok=True)
+        gather_lines(bucket_paths, np.random.default_rng(self.seed))
+        BUCKET_DIR.rmdir()
+        metrics.observe("mix_gather", time.perf_counter() - start)
+        for name, k in counts.items():
+            metrics.count(f"rows.{name}", k)
+        self.counts = counts
 
-random.shuffle(buffers)
+    def report(self):
+        for name in FILES:
+            print(f"  - {name}: {self.counts[name]} rows")
+        total = sum(self.counts.values())
+        print(f"✅ Wrote {total} rows to {OUT} ({self.num_buckets} buckets)")
+        return total
 
-with OUT.open("w") as f:
-    for r in tqdm(buffers):
-        f.write(ujson.dumps(r) + "\n")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the weighted, shuffled training mix.")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default=FORMAT)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--budget", action="append", default=[], metavar="NAME=TOKENS",
+                        help="Token budget for a source, e.g. code_plat=3e8 (repeatable; overrides its weight)")
+    args = parser.parse_args()
+    budgets = dict(TOKEN_BUDGETS)
+    for item in args.budget:
+        name, value = item.split("=", 1)
+        budgets[name] = int(float(value))
+    build_mix(args.seed, args.format, budgets)
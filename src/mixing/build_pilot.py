@@ -3,12 +3,18 @@ import random
 from pathlib import Path
 from tqdm import tqdm
 
+from src.common import lengths, metrics, shards
+from src.mixing import profile_corpus
+
 # --- CONFIG ---
 INPUT_DIR = Path("/teamspace/studios/this_studio/aimo_datafoundry/data/processed")
 OUTPUT_FILE = Path("/teamspace/studios/this_studio/aimo_datafoundry/data/gold/pilot_micro.jsonl")
-OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
 
-# Target: ~25k - 30k total
+# "jsonl" or "parquet" (zstd shards in pilot_micro.parquet/, read by train_pilot.py without JSON parsing)
+FORMAT = "jsonl"
+
+# Target: ~25k - 30k total (python -m src.mixing.profile_corpus gives the real
+# per-file numbers; build_micro() prints them next to each take)
 SAMPLING_PLAN = {
     # 70k total -> Take 20% (~14k). High quality code is our priority.
     "code_plat.jsonl": 0.20,      
@@ -20,31 +26,60 @@ SAMPLING_PLAN = {
     "code_silver.jsonl": 0.025,   
 }
 
+# Optional token budgets (filename -> tokens) that replace a file's percentage.
+# Uses the cached per-row length index (src/common/lengths.py), no re-tokenizing.
+TOKEN_PLAN = {}
+
 def build_micro():
-    print("🔬 Building Micro-Pilot Dataset (~30k)...")
-    final_data = []
+    with metrics.stage("build_pilot", metrics.metrics_path(OUTPUT_FILE)):
+        print("🔬 Building Micro-Pilot Dataset (~30k)...")
+        OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
+        final_data = []
     
-    for filename, percent in SAMPLING_PLAN.items():
-        filepath = INPUT_DIR / filename
-        if not filepath.exists():
-            print(f"⚠️ MISSING: {filename}")
-            continue
+        filenames = list(SAMPLING_PLAN) + [f for f in TOKEN_PLAN if f not in SAMPLING_PLAN]
+        for filename in filenames:
+            # x.parquet/ shards take precedence over x.jsonl
+            filepath = shards.find_source(INPUT_DIR / filename)
+            if not filepath.exists():
+                print(f"⚠️ MISSING: {filename}")
+                continue
             
-        with filepath.open("r") as f:
-            rows = [ujson.loads(line) for line in f]
-            
-        count = int(len(rows) * percent)
-        print(f"  - {filename}: {len(rows)} rows -> Taking {count}")
-        
-        sampled = random.sample(rows, count)
-        final_data.extend(sampled)
+            # Offset index / Parquet + mmap: only the sampled rows get decoded
+            with shards.open_reader(filepath) as reader:
+                if filename in TOKEN_PLAN:
+                    tokens = lengths.load_lengths(filepath)["tokens"]
+                    picks = lengths.sample_to_budget(tokens, TOKEN_PLAN[filename])
+                    print(f"  - {filename}: {len(reader)} rows -> Taking {len(picks)} "
+                          f"({int(tokens[picks].sum())} / {TOKEN_PLAN[filename]} tokens)")
+                    sampled = reader.rows(picks)
+                else:
+                    count = int(len(reader) * SAMPLING_PLAN[filename])
+                    print(f"  - {filename}: {len(reader)} rows -> Taking {count}")
+                
+                    sampled = reader.sample(count)
+            profile = profile_corpus.load_profile(filepath)
+            if profile is not None:
+                print("    " + profile_corpus.describe(filename, profile).replace("\n", "\n    "))
+            final_data.extend(sampled)
+            metrics.count(f"rows.{filename}", len(sampled))
 
-    random.shuffle(final_data)
+        random.shuffle(final_data)
     
-    print(f"💾 Saving {len(final_data)} samples to {OUTPUT_FILE}...")
-    with OUTPUT_FILE.open("w") as f:
-        for row in tqdm(final_data):
-            f.write(ujson.dumps(row) + "\n")
+        if FORMAT == "parquet":
+            out = shards.shard_dir(OUTPUT_FILE)
+            print(f"💾 Saving {len(final_data)} samples to {out}...")
+            with shards.ShardWriter(out) as writer:
+                writer.write_rows(final_data)
+            metrics.count("rows_written", len(final_data))
+            metrics.count("bytes_written", metrics.disk_bytes(out))
+            return
+
+        print(f"💾 Saving {len(final_data)} samples to {OUTPUT_FILE}...")
+        with OUTPUT_FILE.open("w") as f:
+            for row in tqdm(final_data):
+                f.write(ujson.dumps(row) + "\n")
+        metrics.count("rows_written", len(final_data))
+        metrics.count("bytes_written", metrics.disk_bytes(OUTPUT_FILE))
 
 if __name__ == "__main__":
     build_micro()
\ No newline at end of file
@@ -0,0 +1,309 @@
+import argparse
+import io
+import math
+import os
+import re
+import time
+import ujson
+import numpy as np
+import pyarrow.parquet as pq
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tqdm import tqdm
+
+from src.common import answers, fused, lengths, shards
+
+# --- CONFIGURATION ---
+DIRS = [Path("data/processed"), Path("data/gold")]
+OUT = Path("data/profile.json")
+
+NUM_WORKERS = os.cpu_count() or 1
+
+# JSONL byte range per worker task (Parquet: one task per shard)
+CHUNK_BYTES = 16 * 1024 * 1024
+
+# Length sketches: log-spaced buckets of ratio GAMMA, so any quantile is
+# within ~(GAMMA - 1) / 2 = 1% of the exact value
+GAMMA = 1.02
+BUCKETS = 1024
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+PROFILE_VERSION = 1
+
+THINK_RE = re.compile(r"<think>(.*?)</think>", re.S)
+
+# Answer types, tested in order on the normalized final answer
+ANSWER_TYPES = [
+    ("integer", re.compile(r"^[-+]?\d+$")),
+    ("decimal", re.compile(r"^[-+]?\d*\.\d+$")),
+    ("fraction", re.compile(r"^[-+]?(\d+/\d+|\\frac\{-?\d+\}\{-?\d+\})$")),
+    ("tuple", re.compile(r"^[(\[].*,.*[)\]]$")),
+    ("text", re.compile(r"^[A-Za-z][A-Za-z ,.'-]*$")),
+]
+
+# --- SKETCHES ---
+class Sketch:
+    """
+    Log-bucketed histogram of non-negative lengths. Merging two sketches is
+    adding their counts, so workers can summarize chunks independently.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(BUCKETS, dtype=np.int64)
+        self.n = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return
+        idx = np.ceil(np.log(np.maximum(values, 1)) / math.log(GAMMA)).astype(np.int64)
+        self.counts += np.bincount(np.minimum(idx, BUCKETS - 1), minlength=BUCKETS)
+        self.n += len(values)
+        self.sum += int(values.sum())
+        self.max = max(self.max, int(values.max()))
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.n += other.n
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.n:
+            return 0
+        i = int(np.searchsorted(np.cumsum(self.counts), q * self.n))
+        # Bucket i holds (GAMMA^(i-1), GAMMA^i]: report its midpoint
+        return min(round(2 * GAMMA ** i / (GAMMA + 1)), self.max)
+
+    def to_json(self):
+        nonzero = np.flatnonzero(self.counts)
+        out = {"count": self.n, "mean": round(self.sum / max(self.n, 1), 1), "max": self.max}
+        out.update({f"p{round(q * 100)}": self.quantile(q) for q in QUANTILES})
+        out["buckets"] = dict(zip(map(str, nonzero.tolist()), self.counts[nonzero].tolist()))
+        return out
+
+    @classmethod
+    def from_json(cls, data):
+        sketch = cls()
+        for i, c in data["buckets"].items():
+            sketch.counts[int(i)] = c
+        sketch.n, sketch.max = data["count"], data["max"]
+        sketch.sum = round(data["mean"] * data["count"])
+        return sketch
+
+# --- ROW STATS ---
+def answer_type(response):
+    """Kind of the final answer: last <answer> tag, else last \\boxed{}."""
+    tags = answers.ANSWER_TAG_RE.findall(response)
+    if tags:
+        ans = tags[-1]
+    elif "boxed" in response or "fbox" in response:
+        ans = answers.extract_answer(response)
+    else:
+        return "none"
+    ans = answers.normalize(ans)
+    if not ans:
+        return "empty"
+    for name, pattern in ANSWER_TYPES:
+        if pattern.match(ans):
+            return name
+    return "expression"
+
+class Profile:
+    """Mergeable aggregates of a set of Universal Schema rows."""
+    LENGTHS = ("problem_chars", "response_chars", "think_chars", "tokens")
+
+    def __init__(self):
+        self.rows = 0
+        self.unparseable = 0
+        self.sources = Counter()
+        self.source_types = Counter()
+        self.answer_types = Counter()
+        self.tags = Counter()
+        self.lengths = {name: Sketch() for name in self.LENGTHS}
+
+    def add_rows(self, rows):
+        problem, response, think = [], [], []
+        for row in rows:
+            self.rows += 1
+            self.sources[row.get("source") or "unknown"] += 1
+            meta = row.get("meta")
+            if isinstance(meta, dict) and meta.get("source_type"):
+                self.source_types[meta["source_type"]] += 1
+            if isinstance(row.get("problem"), str):
+                problem.append(len(row["problem"]))
+
+            msgs = row.get("messages") or []
+            reply = msgs[1] if len(msgs) > 1 and isinstance(msgs[1], dict) else {}
+            text = reply.get("content")
+            if not isinstance(text, str):
+                self.tags["no_response"] += 1
+                self.answer_types["none"] += 1
+                continue
+            response.append(len(text))
+            opened, closed = text.count("<think>"), text.count("</think>")
+            has_answer = "<answer>" in text and "</answer>" in text
+            self.tags["think"] += opened > 0
+            self.tags["answer"] += has_answer
+            self.tags["think_and_answer"] += opened > 0 and has_answer
+            self.tags["unbalanced_think"] += opened != closed
+            self.tags["multiple_think"] += opened > 1
+            think.append(sum(len(m) for m in THINK_RE.findall(text)) if opened else 0)
+            self.answer_types[answer_type(text)] += 1
+        for name, values in (("problem_chars", problem), ("response_chars", response), ("think_chars", think)):
+            self.lengths[name].add(values)
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.unparseable += other.unparseable
+        for name in ("sources", "source_types", "answer_types", "tags"):
+            getattr(self, name).update(getattr(other, name))
+        for name, sketch in other.lengths.items():
+            self.lengths[name].merge(sketch)
+
+    def to_json(self):
+        out = {"rows": self.rows, "unparseable": self.unparseable}
+        for name in ("sources", "source_types", "answer_types", "tags"):
+            out[name] = dict(getattr(self, name).most_common())
+        out["lengths"] = {name: sketch.to_json() for name, sketch in self.lengths.items() if sketch.n}
+        return out
+
+# --- WORKERS ---
+def profile_chunk(path, start, end):
+    """Worker: bytes [start, end) of a JSONL file."""
+    profile = Profile()
+    with path.open("rb") as fb:
+        fb.seek(start)
+        chunk = fb.read(end - start)
+    for lines in fused.iter_blocks(io.TextIOWrapper(io.BytesIO(chunk), encoding="utf-8")):
+        rows = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = ujson.loads(line)
+            except ValueError:
+                profile.unparseable += 1
+                continue
+            if isinstance(row, dict):
+                rows.append(row)
+            else:
+                profile.unparseable += 1
+        profile.add_rows(rows)
+    return profile
+
+def profile_shard(shard_path):
+    """Worker: one Parquet shard (the id column is never decoded)."""
+    profile = Profile()
+    pf = pq.ParquetFile(shard_path, memory_map=True)
+    columns = [c for c in ("source", "problem", "messages", "extra") if c in pf.schema_arrow.names]
+    for batch in pf.iter_batches(batch_size=fused.BLOCK_ROWS, columns=columns):
+        profile.add_rows(shards.to_rows(batch))
+    return profile
+
+def cached_tokens(path):
+    """Per-row token counts from a still-valid length sidecar (never builds one)."""
+    idx = lengths.index_path(path)
+    if not idx.exists():
+        return None
+    with np.load(idx) as cached:
+        meta = ujson.loads(str(cached["meta"]))
+        if meta["version"] != lengths.INDEX_VERSION or meta["stat"] != lengths.file_stat(path):
+            return None
+        tokens = cached["tokens"]
+    return tokens[tokens > 0]
+
+def find_sources(dirs):
+    """JSONL files and shard directories (a shard directory wins over x.jsonl)."""
+    found = []
+    for d in dirs:
+        sharded = sorted(p for p in d.glob("*.parquet") if p.is_dir())
+        stems = {p.stem for p in sharded}
+        found += [p for p in sorted(d.glob("*.jsonl")) if p.stem not in stems] + sharded
+    return found
+
+def jobs(path):
+    if shards.is_sharded(path):
+        return [(profile_shard, f) for f in shards.shard_files(path)]
+    return [(profile_chunk, path, start, end) for start, end in fused.split_shards(path, CHUNK_BYTES)]
+
+def profile_files(paths, num_workers=NUM_WORKERS):
+    """Profiles every source in a worker pool. Returns {path: Profile}."""
+    tasks = [(path, job) for path in paths for job in jobs(path)]
+    results = {path: Profile() for path in paths}
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = [(path, pool.submit(*job)) for path, job in tasks]
+        for path, future in tqdm(futures, desc="Profiling", unit="tasks"):
+            results[path].merge(future.result())
+    for path, profile in results.items():
+        tokens = cached_tokens(path)
+        if tokens is not None:
+            profile.lengths["tokens"].add(tokens)
+    return results
+
+def write_profile(results, out=OUT):
+    total = Profile()
+    files = {}
+    for path, profile in results.items():
+        total.merge(profile)
+        files[str(path)] = {"stat": lengths.file_stat(path), **profile.to_json()}
+    data = {"version": PROFILE_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "files": files, "total": total.to_json()}
+    out.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = out.with_suffix(".tmp")
+    with temp_path.open("w", encoding="utf-8") as f:
+        ujson.dump(data, f, indent=1)
+    os.replace(temp_path, out)
+    return data
+
+def load_profile(path, out=OUT):
+    """
+    Profile entry of one source (as written to OUT), or None when it was
+    never profiled or the file changed since.
+    """
+    if not out.exists():
+        return None
+    entry = ujson.loads(out.read_text()).get("files", {}).get(str(path))
+    if entry is None or entry["stat"] != lengths.file_stat(path):
+        return None
+    return entry
+
+def profiled_rows(path, out=OUT):
+    """
+    Non-blank lines (Parquet: rows) of a source per its still-valid profile
+    entry, the count build_mix draws from; None when it must be counted.
+    """
+    entry = load_profile(path, out)
+    return None if entry is None else entry["rows"] + entry["unparseable"]
+
+def describe(name, p):
+    tags = p["tags"]
+    rows = max(p["rows"], 1)
+    lines = [f"📊 {name}: {p['rows']:,} rows" + (f" ({p['unparseable']} unparseable)" if p["unparseable"] else "")]
+    lines.append("   sources: " + ", ".join(f"{k} {v:,}" for k, v in p["sources"].items()))
+    if p["source_types"]:
+        lines.append("   source_type: " + ", ".join(f"{k} {v:,}" for k, v in p["source_types"].items()))
+    for key, s in p["lengths"].items():
+        lines.append(f"   {key:<15} mean {s['mean']:>8,.0f}  p50 {s['p50']:>7,}  p90 {s['p90']:>7,}  p99 {s['p99']:>7,}  max {s['max']:>7,}")
+    lines.append("   answers: " + ", ".join(f"{k} {100 * v / rows:.1f}%" for k, v in p["answer_types"].items()))
+    lines.append("   tags: " + ", ".join(f"{k} {100 * v / rows:.1f}%" for k, v in tags.items()))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Row counts, length quantiles, answer types and tag presence per source.")
+    parser.add_argument("paths", nargs="*", type=Path, help=f"Sources (default: everything in {', '.join(map(str, DIRS))})")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--out", type=Path, default=OUT)
+    args = parser.parse_args()
+
+    paths = [shards.find_source(p) for p in args.paths] if args.paths else find_sources(DIRS)
+    start = time.perf_counter()
+    results = profile_files(paths, args.workers)
+    data = write_profile(results, args.out)
+    for path, entry in data["files"].items():
+        print(describe(Path(path).name, entry))
+    print(describe("total", data["total"]))
+    print(f"✅ Profiled {data['total']['rows']:,} rows in {time.perf_counter() - start:.1f}s -> {args.out}")
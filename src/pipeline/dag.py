@@ -0,0 +1,368 @@
+import argparse
+import ast
+import fnmatch
+import hashlib
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+import ujson
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+
+# --- CONFIGURATION ---
+# Per-step cache keys, versions and the tree state after the last run
+STATE_PATH = Path("data/.dag/state.json")
+LOG_DIR = Path("data/.dag/logs")
+
+# Steps running at once (the ingestions and synthesis are independent)
+JOBS = 4
+
+HASH_CHUNK = 1024 * 1024
+
+PROCESSED = ("data/processed/*.jsonl", "data/processed/*.parquet")
+
+@dataclass(frozen=True)
+class Step:
+    """
+    One pipeline script. Its cache key covers the source of `module` + `code`,
+    the `config` constants ("module:NAME", read from source), files read
+    that no step writes (e.g. the blocklist) and the versions of `deps`.
+    Paths are globs relative to the repo root; in-place steps list the
+    same files as inputs and outputs.
+    """
+    name: str
+    module: str
+    args: tuple = ()
+    deps: tuple = ()
+    inputs: tuple = ()
+    outputs: tuple = ()
+    config: tuple = ()
+    code: tuple = ()
+    # Appended when re-running after an interrupted attempt with the same key / after a change
+    resume_args: tuple = ()
+    fresh_args: tuple = ()
+
+def ingest(name, out, config=()):
+    return Step(
+        f"ingest_{name}", "src.ingestion.engine", args=(name,), outputs=(out,),
+        config=config, code=(f"src.ingestion.process_{name}", "src.common.answers"),
+        resume_args=("--resume",),
+    )
+
+# The README sequence as a graph. Synthesis reads NuminaMath itself, so it
+# only waits on its own code/config; everything after it shares data/processed.
+STEPS = [
+    ingest("numina", "data/processed/logic_core.jsonl"),
+    ingest("tir", "data/processed/code_plat.jsonl"),
+    ingest("nvidia", "data/processed/code_silver.jsonl", config=("src.ingestion.process_nvidia:MAX_SAMPLES",)),
+    Step(
+        "synthesis", "src.synthesis.generate_recursive",
+        outputs=("data/processed/recursive.jsonl",),
+        config=tuple(f"src.synthesis.generate_recursive:{name}" for name in (
+            "TARGET_COUNT", "SEED", "BACKEND", "TIER_1_SOURCES", "TIER_2_SOURCES", "TIER_3_SOURCES", "TARGET_TIER3",
+            "SCHEDULE",
+        )) + ("src.synthesis.schedule:BATCH_TOKENS", "src.synthesis.schedule:BUCKET_WINDOW"),
+        code=("src.synthesis.backends", "src.synthesis.schedule", "src.common.answers"),
+        fresh_args=("--fresh",),
+    ),
+    Step(
+        "scrub", "src.safety.scrub",
+        deps=("ingest_numina", "ingest_tir", "ingest_nvidia", "synthesis"),
+        inputs=PROCESSED + ("data/blocklist/aimo_ref.txt", "data/blocklist/keywords.txt", "data/blocklist/evals"),
+        outputs=PROCESSED,
+        config=("src.safety.scrub:THRESHOLD", "src.safety.scrub:NUM_PERM", "src.common.schema:REQUIRE_ANSWER")
+        + tuple(f"src.safety.ngrams:{name}" for name in ("NGRAM", "MIN_HITS", "FP_RATE", "EVAL_FIELDS")),
+        code=("src.common.fused", "src.common.schema", "src.safety.keywords", "src.safety.ngrams"),
+    ),
+    Step(
+        "dedup", "src.safety.dedup", deps=("scrub",),
+        inputs=PROCESSED, outputs=PROCESSED + ("data/reports/dedup_clusters.json",),
+        config=("src.safety.dedup:THRESHOLD", "src.safety.dedup:KEEP_PRIORITY"),
+        code=("src.safety.scrub",),
+    ),
+    Step(
+        "add_ids", "scripts.add_ids", deps=("dedup",),
+        inputs=PROCESSED, outputs=PROCESSED,
+        code=("src.common.ids", "src.common.fused"),
+    ),
+    Step(
+        "build_mix", "src.mixing.build_mix", deps=("add_ids",),
+        inputs=PROCESSED, outputs=("data/gold/aimo_system2_final.jsonl", "data/gold/aimo_system2_final.parquet"),
+        config=tuple(f"src.mixing.build_mix:{name}" for name in ("FILES", "SEED", "FORMAT", "TOKEN_BUDGETS")),
+        code=("src.common.lengths",),
+    ),
+]
+
+# --- FINGERPRINTS ---
+def source_path(module):
+    return Path(importlib.util.find_spec(module).origin)
+
+def read_constants(module, names):
+    """Module-level constants as normalized source text (the module isn't imported)."""
+    tree = ast.parse(source_path(module).read_text(encoding="utf-8"))
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id in names:
+                    values[target.id] = ast.unparse(node.value)
+    return values
+
+def resolve(patterns):
+    """Existing paths matching the globs (shard directories count as one path)."""
+    found = set()
+    for pattern in patterns:
+        if any(c in pattern for c in "*?["):
+            found.update(str(p) for p in Path().glob(pattern))
+        elif Path(pattern).exists():
+            found.add(pattern)
+    return sorted(found)
+
+def matches(path, patterns):
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+class Hasher:
+    """Content hashes of files / shard directories, re-read only when size or mtime changed."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def file(self, path):
+        st = path.stat()
+        hit = self.cache.get(str(path))
+        if hit and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+            return hit[2]
+        h = hashlib.blake2b(digest_size=16)
+        with path.open("rb") as f:
+            while chunk := f.read(HASH_CHUNK):
+                h.update(chunk)
+        self.cache[str(path)] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def __call__(self, path):
+        path = Path(path)
+        if not path.is_dir():
+            return self.file(path)
+        h = hashlib.blake2b(digest_size=16)
+        for f in sorted(p for p in path.rglob("*") if p.is_file()):
+            h.update(f"{f.relative_to(path)}\x00{self.file(f)}\x00".encode("utf8"))
+        return h.hexdigest()
+
+    def tree(self, patterns):
+        return {p: self(p) for p in resolve(patterns)}
+
+# --- STATE ---
+def load_state():
+    if STATE_PATH.exists():
+        return ujson.loads(STATE_PATH.read_text())
+    return {"steps": {}, "attempts": {}, "files": {}, "hashes": {}}
+
+def save_state(state):
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = STATE_PATH.with_suffix(".tmp")
+    temp_path.write_text(ujson.dumps(state, indent=1))
+    os.replace(temp_path, STATE_PATH)
+
+def written_by_steps(path):
+    return any(matches(path, step.outputs) for step in STEPS)
+
+def fingerprint(step, state, hasher, extra):
+    """(key, parts) of a step; parts are kept in the state to explain the next rebuild."""
+    args, inputs = extra.get(step.name, ((), ()))
+    parts = {
+        "command": [step.module, *step.args, *args],
+        "code": {m: hasher(source_path(m)) for m in (step.module, *step.code)},
+        "config": {},
+        # Files no step writes; files from other steps are covered by the dep versions
+        "inputs": {p: h for p, h in hasher.tree(step.inputs + inputs).items() if not written_by_steps(p)},
+        "deps": {d: state["steps"][d]["version"] for d in step.deps},
+    }
+    for spec in step.config:
+        module, name = spec.split(":")
+        parts["config"].update({f"{module}:{k}": v for k, v in read_constants(module, [name]).items()})
+    key = hashlib.sha256(ujson.dumps(parts, sort_keys=True).encode("utf8")).hexdigest()[:16]
+    return key, parts
+
+def explain(old, parts):
+    """Why a step's key changed, one short reason per differing part."""
+    if not old:
+        return ["never built"]
+    reasons = []
+    for name, value in parts["config"].items():
+        before = old["parts"]["config"].get(name)
+        if before != value:
+            reasons.append(f"{name.split(':')[1]}: {before} -> {value}")
+    for kind in ("code", "inputs", "deps"):
+        before = old["parts"][kind]
+        changed = sorted(k for k in set(before) | set(parts[kind]) if before.get(k) != parts[kind].get(k))
+        if changed:
+            reasons.append(f"{kind} changed: {', '.join(changed)}")
+    if old["parts"]["command"] != parts["command"]:
+        reasons.append(f"command: {' '.join(parts['command'])}")
+    return reasons
+
+def drifted(state, hasher):
+    """Paths the last run left behind that have changed (or appeared / vanished) since."""
+    patterns = [p for step in STEPS for p in step.inputs + step.outputs]
+    now = hasher.tree(patterns)
+    before = state["files"]
+    return {p for p in set(now) | set(before) if now.get(p) != before.get(p)}
+
+# --- RUNNER ---
+def select(targets):
+    """Targets plus everything they depend on, in STEPS order."""
+    by_name = {step.name: step for step in STEPS}
+    wanted = set()
+    stack = list(targets or by_name)
+    while stack:
+        name = stack.pop()
+        if name not in wanted:
+            wanted.add(name)
+            stack.extend(by_name[name].deps)
+    return [step for step in STEPS if step.name in wanted]
+
+def execute(step, args):
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    log_path = LOG_DIR / f"{step.name}.log"
+    start = time.perf_counter()
+    with log_path.open("w") as log:
+        code = subprocess.run([sys.executable, "-m", step.module, *args], stdout=log, stderr=subprocess.STDOUT).returncode
+    return code, time.perf_counter() - start, log_path
+
+def run(targets=None, jobs=JOBS, force=(), dry_run=False, extra=None):
+    """
+    Rebuilds the stale steps of `targets` (default: all) and their
+    dependencies, independent steps in parallel. A step is stale when its
+    key changed, an input changed outside the runner, or an output is
+    missing. A step that re-runs and leaves its outputs byte-identical keeps
+    its version, so its dependents stay cached. Returns the failed steps.
+    """
+    extra = extra or {}
+    state = load_state()
+    hasher = Hasher(state["hashes"])
+    steps = select(targets)
+    changed = drifted(state, hasher)
+    status = {}
+    running = {}
+    pending = list(steps)
+
+    print(f"🧭 {len(steps)} steps, {jobs} at a time{' (dry run)' if dry_run else ''}")
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for step in list(pending):
+                busy = {s.name for s in pending} | {s.name for s, *_ in running.values()}
+                if busy.intersection(step.deps):
+                    continue
+                pending.remove(step)
+                blocked = [d for d in step.deps if status.get(d) in ("failed", "blocked")]
+                if blocked:
+                    status[step.name] = "blocked"
+                    print(f"⛔ {step.name}: skipped, {', '.join(blocked)} failed")
+                    continue
+                upstream = [d for d in step.deps if status.get(d) == "stale"]
+                if upstream:
+                    # Dry run: the dep's new version is unknown until it runs
+                    status[step.name] = "stale"
+                    print(f"🔁 {step.name}: after {', '.join(upstream)}")
+                    continue
+
+                key, parts = fingerprint(step, state, hasher, extra)
+                old = state["steps"].get(step.name)
+                reasons = explain(old, parts) if not old or old["key"] != key else []
+                if old and old.get("failed"):
+                    reasons.append("last run failed")
+                if step.name in force:
+                    reasons.append("forced")
+                # Step-written files edited by hand rebuild their readers (final artifacts: their writer);
+                # external inputs are part of the key
+                touched = sorted(p for p in changed if written_by_steps(p) and (matches(p, step.inputs) or (
+                    matches(p, step.outputs) and not any(matches(p, s.inputs) for s in STEPS))))
+                if touched and old:
+                    reasons.append(f"changed outside the pipeline: {', '.join(touched)}")
+                # Alternative outputs (x.jsonl / x.parquet) count as missing only if none exists
+                literal = [p for p in step.outputs if not any(c in p for c in "*?[")]
+                if old and literal and not any(Path(p).exists() for p in literal):
+                    reasons.append(f"missing: {', '.join(literal)}")
+                if not reasons:
+                    status[step.name] = "fresh"
+                    print(f"✅ {step.name}: up to date")
+                    continue
+
+                print(f"🔁 {step.name}: {'; '.join(reasons)}")
+                if dry_run:
+                    status[step.name] = "stale"
+                    continue
+                args, _ = extra.get(step.name, ((), ()))
+                resumed = state["attempts"].get(step.name) == key
+                args = (*step.args, *args, *(step.resume_args if resumed else step.fresh_args if old else ()))
+                state["attempts"][step.name] = key
+                save_state(state)
+                before = hasher.tree(step.outputs)
+                running[pool.submit(execute, step, args)] = (step, key, parts, before)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step, key, parts, before = running.pop(future)
+                code, seconds, log_path = future.result()
+                if code != 0:
+                    status[step.name] = "failed"
+                    # Rebuilt on the next run (resuming if the key is unchanged)
+                    if step.name in state["steps"]:
+                        state["steps"][step.name]["failed"] = True
+                    save_state(state)
+                    print(f"❌ {step.name} failed (exit {code}) after {seconds:.1f}s, see {log_path}")
+                    continue
+                after = hasher.tree(step.outputs)
+                old = state["steps"].get(step.name)
+                # Early cutoff: byte-identical outputs keep the previous version
+                version = old["version"] if old and not old.get("failed") and after == before else key
+                state["steps"][step.name] = {"key": key, "version": version, "parts": parts, "seconds": round(seconds, 1)}
+                state["attempts"].pop(step.name, None)
+                state["files"].update(hasher.tree(step.inputs + step.outputs))
+                for p in list(state["files"]):
+                    if matches(p, step.inputs + step.outputs) and not Path(p).exists():
+                        del state["files"][p]
+                save_state(state)
+                status[step.name] = "ran"
+                note = " (outputs unchanged)" if version != key else ""
+                print(f"🏁 {step.name}: {seconds:.1f}s{note}")
+
+    failed = [name for name, s in status.items() if s == "failed"]
+    counts = {s: sum(v == s for v in status.values()) for s in ("ran", "stale", "fresh")}
+    done = f"{counts['stale']} would run" if dry_run else f"{counts['ran']} rebuilt"
+    print(f"\n🎉 {done}, {counts['fresh']} up to date" + (f", failed: {', '.join(failed)}" if failed else ""))
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline steps that are out of date.")
+    parser.add_argument("targets", nargs="*", help="Steps to bring up to date, with their dependencies (default: all)")
+    parser.add_argument("--jobs", type=int, default=JOBS)
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would run and why")
+    parser.add_argument("--force", action="append", default=[], metavar="STEP")
+    parser.add_argument("--input", action="append", default=[], metavar="STEP=PATH",
+                        help="Local fixture for an ingestion / synthesis step (hashed into its key)")
+    parser.add_argument("--arg", action="append", default=[], metavar="STEP=ARG",
+                        help="Extra command-line argument for a step, e.g. synthesis=--backend=stub")
+    args = parser.parse_args()
+    names = [step.name for step in STEPS]
+    unknown = sorted(set(args.targets + args.force) - set(names))
+    if unknown:
+        parser.error(f"unknown steps: {', '.join(unknown)} (choose from {', '.join(names)})")
+
+    extra = {}
+    for item in args.input:
+        name, path = item.split("=", 1)
+        step_args, inputs = extra.get(name, ((), ()))
+        extra[name] = ((*step_args, "--input", path), (*inputs, path))
+    for item in args.arg:
+        name, value = item.split("=", 1)
+        step_args, inputs = extra.get(name, ((), ()))
+        extra[name] = ((*step_args, value), inputs)
+
+    failed = run(args.targets, args.jobs, args.force, args.dry_run, extra)
+    sys.exit(1 if failed else 0)
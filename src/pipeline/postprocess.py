@@ -0,0 +1,63 @@
+import argparse
+import os
+from pathlib import Path
+
+from src.common import fused, ids, metrics, schema
+from src.mixing import build_mix
+from src.safety import scrub
+
+# --- CONFIGURATION ---
+DATA_DIR = Path("data/processed")
+
+NUM_WORKERS = os.cpu_count() or 1
+
+# Post-processing in one pass per row: every processed file is decoded
+# once and each row goes schema check -> scrub -> content ID -> mix draws as
+# a dict, then is encoded once (rows nothing changed are copied
+# byte-for-byte). The mix then scatters the committed lines without parsing
+# them. It has the same expected composition as build_mix, but not the same
+# draws. Parquet mixes and token budgets fall back to a build_mix pass
+# afterwards. Dedup stays its own step (see src/safety/dedup.py).
+
+def postprocess(num_workers=NUM_WORKERS, mix=True, seed=build_mix.SEED, fmt=build_mix.FORMAT, budgets=None):
+    files = sorted(DATA_DIR.glob("*.jsonl")) + sorted(p for p in DATA_DIR.glob("*.parquet") if p.is_dir())
+    with metrics.stage("postprocess", DATA_DIR / "postprocess.metrics.json"):
+        safety = scrub.load_stages()
+
+        schema_stage = schema.SchemaStage(schema.QUARANTINE_DIR)
+        id_stage = ids.IdStage()
+        stages = [schema_stage, *safety, id_stage]
+        fused_mix = mix and fmt == "jsonl" and not budgets
+        if fused_mix:
+            stages.append(build_mix.MixStage(seed))
+        print(f"\n🔗 Post-processing {len(files)} files in one pass ({', '.join(stage.name for stage in stages)}), {num_workers} workers")
+        results = fused.run(files, stages, num_workers, scrub.SHARD_BYTES)
+
+        total_removed = 0
+        for path, (written, summaries) in results.items():
+            total_removed += scrub.report(path, written, [pair for task in summaries for pair in task[1 : 1 + len(safety)]])
+        rejected = schema_stage.report()
+        print(f"🎉 Removed {total_removed} contaminated and {rejected} malformed rows; {id_stage.rows} IDs")
+        if id_stage.repeats:
+            print(f"⚠️ {id_stage.repeats} rows repeat earlier content (same problem + response); their IDs got a -k suffix")
+        if fused_mix:
+            print("\n🥣 Mix (sampled in the same pass):")
+            stages[-1].report()
+
+    if mix and not fused_mix:
+        build_mix.build_mix(seed, fmt, budgets)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Schema check, scrub, ID assignment and mix sampling in one pass.")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--no-mix", action="store_true", help="Stop after rewriting data/processed")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default=build_mix.FORMAT)
+    parser.add_argument("--seed", type=int, default=build_mix.SEED)
+    parser.add_argument("--budget", action="append", default=[], metavar="NAME=TOKENS",
+                        help="Token budget for a mix source (as in build_mix)")
+    args = parser.parse_args()
+    budgets = dict(build_mix.TOKEN_BUDGETS)
+    for item in args.budget:
+        name, value = item.split("=", 1)
+        budgets[name] = int(float(value))
+    postprocess(args.workers, not args.no_mix, args.seed, args.format, budgets)
@@ -0,0 +1,214 @@
+import ujson
+import shutil
+import time
+import numpy as np
+import pyarrow as pa
+from pathlib import Path
+from datasketch import MinHashLSH
+from tqdm import tqdm
+
+from src.common import metrics, shards
+from src.safety.scrub import NUM_PERM, ROW_BLOCK, batch_signatures, iter_blocks
+
+# --- CONFIGURATION ---
+# Directory containing the processed sources to deduplicate in place
+# (.jsonl files and .parquet shard directories)
+DATA_DIR = Path("data/processed")
+
+# Cluster report (kept representative + dropped members per cluster)
+REPORT_PATH = Path("data/reports/dedup_clusters.json")
+
+# Near-duplicate threshold on the 3-gram MinHash (same scale as scrub.THRESHOLD)
+THRESHOLD = 0.85
+
+# Keep-policy: when problems collide, the copy from the earliest source wins.
+# Files not listed here come last, in name order.
+KEEP_PRIORITY = [
+    "code_plat",    # TIR, highest quality (upsampled 3x by build_mix)
+    "recursive",    # GPU-generated traces, expensive to regenerate
+    "logic_core",
+    "code_silver",
+]
+
+def order_files(files):
+    rank = {stem: i for i, stem in enumerate(KEEP_PRIORITY)}
+    return sorted(files, key=lambda p: (rank.get(p.stem, len(rank)), p.name))
+
+class BandIndex:
+    """
+    Streaming banded LSH over the rows kept so far.
+    Memory is the kept signatures plus one int per band per kept row;
+    row text is never held.
+    """
+
+    def __init__(self, threshold=THRESHOLD, num_perm=NUM_PERM):
+        # Reuse datasketch's (b, r) choice for this threshold
+        lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.b, self.r = lsh.b, lsh.r
+        self.threshold = threshold
+        self.buckets = [{} for _ in range(self.b)]
+        self.sigs = None
+        self.size = 0
+        # Random odd multipliers fold each band into one 64-bit key
+        gen = np.random.RandomState(7)
+        self.mix = gen.randint(1, 1 << 62, size=(self.b, self.r), dtype=np.uint64) | np.uint64(1)
+
+    def band_keys(self, sigs):
+        """(n, NUM_PERM) signatures -> (n, b) band keys as Python ints."""
+        bands = sigs[:, : self.b * self.r].astype(np.uint64).reshape(len(sigs), self.b, self.r)
+        return (bands * self.mix).sum(axis=2).tolist()
+
+    def find(self, sig, keys):
+        """Returns the index of a kept row whose estimated Jaccard >= threshold, else None."""
+        seen = set()
+        for band, key in enumerate(keys):
+            hit = self.buckets[band].get(key)
+            if hit is None:
+                continue
+            for j in (hit if isinstance(hit, list) else (hit,)):
+                if j in seen:
+                    continue
+                seen.add(j)
+                # Verify the candidate (band keys only propose)
+                if np.count_nonzero(self.sigs[j] == sig) >= self.threshold * len(sig):
+                    return j
+        return None
+
+    def add(self, sig, keys):
+        if self.sigs is None:
+            self.sigs = np.empty((1024, len(sig)), dtype=sig.dtype)
+        elif self.size == len(self.sigs):
+            self.sigs = np.concatenate([self.sigs, np.empty_like(self.sigs)])
+        idx = self.size
+        self.sigs[idx] = sig
+        self.size += 1
+        for band, key in enumerate(keys):
+            hit = self.buckets[band].get(key)
+            if hit is None:
+                self.buckets[band][key] = idx
+            elif isinstance(hit, list):
+                hit.append(idx)
+            else:
+                self.buckets[band][key] = [hit, idx]
+        return idx
+
+def iter_problems(file_path):
+    """
+    Yields blocks of (row_no, id, problem) for rows with a problem text.
+    row_no is the JSONL line number, or the row index in a shard directory.
+    """
+    if shards.is_sharded(file_path):
+        row_no = 0
+        for batch in shards.ShardReader(file_path).iter_batches(columns=["id", "problem"], batch_size=ROW_BLOCK):
+            ids = batch.column("id").to_pylist()
+            problems = batch.column("problem").to_pylist()
+            yield [(row_no + i, ids[i], text) for i, text in enumerate(problems) if text]
+            row_no += batch.num_rows
+        return
+    line_no = 0
+    with file_path.open("r", encoding="utf-8") as fin:
+        for block in iter_blocks(fin):
+            rows = []
+            for offset, line in enumerate(block):
+                try:
+                    row = ujson.loads(line)
+                except ValueError:
+                    continue # Left for scrub / add_ids to handle
+                if row.get("problem"):
+                    rows.append((line_no + offset, row.get("id"), row["problem"]))
+            line_no += len(block)
+            yield rows
+
+def drop_rows(file_path, drops):
+    """Rewrites a source without the given line numbers / row indices."""
+    if shards.is_sharded(file_path):
+        def keep(table, start):
+            rows = np.arange(start, start + table.num_rows)
+            return table.filter(pa.array(~np.isin(rows, list(drops))))
+        shards.map_shards(file_path, keep)
+        return
+    # Atomic swap as in scrub.py
+    temp_path = file_path.with_suffix(".tmp")
+    with file_path.open("r", encoding="utf-8") as fin, \
+         temp_path.open("w", encoding="utf-8") as fout:
+        for ln, line in enumerate(fin):
+            if ln not in drops:
+                fout.write(line)
+    shutil.move(temp_path, file_path)
+
+def dedup_files():
+    with metrics.stage("dedup", DATA_DIR / "dedup.metrics.json"):
+        files = order_files([*DATA_DIR.glob("*.jsonl"), *(p for p in DATA_DIR.glob("*.parquet") if p.is_dir())])
+        print(f"🧬 Deduplicating {len(files)} files (priority: {[p.stem for p in files]})...")
+
+        index = BandIndex()
+        # kept row idx -> (file, line, id), plus cluster members by kept idx
+        # (line numbers refer to the files before this run rewrites them)
+        reps = []
+        clusters = {}
+        drop_lines = {}
+        stats = {}
+
+        # Pass 1: signatures only, streamed in priority order
+        for file_path in files:
+            drops = set()
+            removed = 0
+            kept = 0
+            metrics.count("bytes_read", metrics.disk_bytes(file_path))
+            for rows in tqdm(iter_problems(file_path), desc=f"Indexing {file_path.name}", unit="blocks"):
+                if not rows:
+                    continue
+
+                with metrics.timer("signatures"):
+                    sigs = batch_signatures([text for _, _, text in rows])
+                    keys = index.band_keys(sigs)
+                start = time.perf_counter()
+                for (ln, row_id, _), sig, row_keys in zip(rows, sigs, keys):
+                    match = index.find(sig, row_keys)
+                    if match is None:
+                        index.add(sig, row_keys)
+                        reps.append((file_path.stem, ln, row_id))
+                        kept += 1
+                    else:
+                        clusters.setdefault(match, []).append((file_path.stem, ln, row_id))
+                        drops.add(ln)
+                        removed += 1
+                metrics.observe("lookup", time.perf_counter() - start)
+
+            drop_lines[file_path] = drops
+            stats[file_path.stem] = {"kept": kept, "removed": removed}
+            metrics.count("rows_kept", kept)
+            metrics.count("rows_removed", removed)
+            print(f"  -> {file_path.name}: Removed: {removed} | Kept: {kept}")
+
+        # Pass 2: rewrite each file without its duplicates
+        for file_path in files:
+            if drop_lines[file_path]:
+                with metrics.timer("rewrite"):
+                    drop_rows(file_path, drop_lines[file_path])
+                metrics.count("bytes_written", metrics.disk_bytes(file_path))
+
+        # Cluster report
+        report = {
+            "threshold": THRESHOLD,
+            "num_perm": NUM_PERM,
+            "keep_priority": [p.stem for p in files],
+            "sources": stats,
+            "clusters": [
+                {
+                    "keep": dict(zip(("source", "line", "id"), reps[rep])),
+                    "dropped": [dict(zip(("source", "line", "id"), m)) for m in members],
+                }
+                for rep, members in sorted(clusters.items())
+            ],
+        }
+        REPORT_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with REPORT_PATH.open("w") as f:
+            ujson.dump(report, f, indent=2)
+
+        metrics.count("clusters", len(clusters))
+        total = sum(s["removed"] for s in stats.values())
+        print(f"\n🎉 Dedup Complete. {total} near-duplicates in {len(clusters)} clusters. Report: {REPORT_PATH}")
+
+if __name__ == "__main__":
+    dedup_files()
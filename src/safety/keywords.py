@@ -0,0 +1,127 @@
+import argparse
+import itertools
+import re
+from collections import deque
+from pathlib import Path
+
+# --- CONFIGURATION ---
+# One pattern per line; blank lines and "#" comments are ignored, and
+# "{a,b}" expands like the shell: "{AIME,AIMO} {2024,2025}" -> 4 patterns
+PATTERNS_PATH = Path("data/blocklist/keywords.txt")
+
+# Used when PATTERNS_PATH does not exist (the original hard-coded safety belt)
+DEFAULT_PATTERNS = ["AIME 2024", "AIME 2025", "AIMO 2024", "AIMO 2025"]
+
+# True: case-folded match ("aime 2024" hits "AIME 2024"). Whitespace never
+# matters: text and patterns are compared as word / punctuation tokens.
+NORMALIZE = True
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+BRACES_RE = re.compile(r"\{([^{}]*)\}")
+
+def expand(pattern):
+    """Shell-style brace expansion: "{AIME,AIMO} 2024" -> ["AIME 2024", "AIMO 2024"]"""
+    parts = BRACES_RE.split(pattern)
+    # Odd parts are brace contents
+    choices = [[p] if i % 2 == 0 else p.split(",") for i, p in enumerate(parts)]
+    return ["".join(combo).strip() for combo in itertools.product(*choices)]
+
+def read_patterns(path=PATTERNS_PATH):
+    if not path.exists():
+        return list(DEFAULT_PATTERNS)
+    patterns = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                patterns.extend(expand(line))
+    return patterns
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over word / punctuation tokens: every pattern is
+    found in one left-to-right pass over the text, however many there are.
+    Patterns only match on token boundaries ("AIME 2024" not in "AIME 20245").
+    """
+
+    def __init__(self, patterns, normalize=NORMALIZE):
+        self.normalize = normalize
+        self.patterns = []
+        # Trie: goto[state] = {token: state}; out[state] = index of the pattern ending there
+        self.goto = [{}]
+        self.out = [None]
+        for pattern in patterns:
+            tokens = self.tokens(pattern)
+            if not tokens:
+                continue
+            state = 0
+            for token in tokens:
+                nxt = self.goto[state].get(token)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][token] = nxt
+                    self.goto.append({})
+                    self.out.append(None)
+                state = nxt
+            if self.out[state] is None:
+                self.out[state] = len(self.patterns)
+                self.patterns.append(pattern)
+        self.vocab = {token for edges in self.goto for token in edges}
+
+        # Failure links (BFS); out[] inherits the match of the longest proper suffix
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and token not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(token, 0)
+                if self.out[nxt] is None:
+                    self.out[nxt] = self.out[self.fail[nxt]]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def tokens(self, text):
+        return TOKEN_RE.findall(text.lower() if self.normalize else text)
+
+    def search(self, text):
+        """The first pattern (by end position) found in text, or None."""
+        goto, fail, out, vocab = self.goto, self.fail, self.out, self.vocab
+        tokens = self.tokens(text)
+        # Most rows share no token with any pattern: one C-level set check
+        if vocab.isdisjoint(tokens):
+            return None
+        state = 0
+        for token in tokens:
+            if token not in vocab:
+                state = 0
+                continue
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            if out[state] is not None:
+                return self.patterns[out[state]]
+        return None
+
+def load_keywords(path=PATTERNS_PATH, normalize=NORMALIZE):
+    return KeywordMatcher(read_patterns(path), normalize)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check texts against the scrub keyword patterns.")
+    parser.add_argument("texts", nargs="*", help="Texts to check (default: print the patterns)")
+    parser.add_argument("--patterns", type=Path, default=PATTERNS_PATH)
+    parser.add_argument("--exact-case", action="store_true")
+    args = parser.parse_args()
+
+    matcher = load_keywords(args.patterns, not args.exact_case)
+    print(f"🔑 {len(matcher)} patterns ({'default' if not args.patterns.exists() else args.patterns})")
+    if not args.texts:
+        for pattern in matcher.patterns:
+            print(f"  {pattern}")
+    for text in args.texts:
+        hit = matcher.search(text)
+        print(f"  {'[HIT] ' + repr(hit) if hit else 'clean'}: {text[:80]}")
@@ -0,0 +1,300 @@
+import argparse
+import hashlib
+import itertools
+import math
+import os
+import unicodedata
+import zlib
+import ujson
+import numpy as np
+import pyarrow.parquet as pq
+from pathlib import Path
+
+from src.common import fused, metrics
+
+# --- CONFIGURATION ---
+# Eval corpora: .txt (one item per line), .jsonl / .parquet (EVAL_FIELDS
+# + message contents). Directories are read recursively.
+EVAL_SOURCES = [Path("data/blocklist/aimo_ref.txt"), Path("data/blocklist/evals")]
+EVAL_FIELDS = ("problem", "question", "solution")
+
+# Exact overlap unit: n consecutive lowercased word tokens (runs of letters,
+# digits, combining marks and "_"; any other character, e.g. ’ ≤ −, separates)
+NGRAM = 13
+
+# A text is contaminated when it shares >= MIN_HITS n-grams with the evals,
+# i.e. a copied span of >= NGRAM + MIN_HITS - 1 tokens
+MIN_HITS = 2
+
+# Bloom filter false-positive rate per n-gram (sizes the filter: ~29 bits per n-gram at 1e-6)
+FP_RATE = 1e-6
+
+# Memory-mapped filter cache (keyed by eval content, NGRAM, FP_RATE)
+CACHE_DIR = Path("data/blocklist/.cache")
+CACHE_VERSION = 3
+
+# Per-process token hash memo: cleared when it reaches this many tokens
+# (numbers / identifiers make the token set unbounded; ~100 bytes per entry)
+TOKEN_CACHE_SIZE = 500_000
+
+# bytes.translate table for ASCII text: every byte that separates tokens becomes a space
+SEPARATORS = bytes(b if chr(b).isalnum() or b == ord("_") else ord(" ") for b in range(256))
+# Odd 64-bit multiplier of the polynomial n-gram hash
+PRIME = np.uint64(0x100000001B3)
+
+# --- HASHING ---
+class UnicodeSeparators(dict):
+    """str.translate table for non-ASCII text, filled per code point on first use."""
+
+    def __missing__(self, cp):
+        c = chr(cp)
+        word = c.isalnum() or c == "_" or unicodedata.category(c).startswith("M")
+        self[cp] = cp if word else " "
+        return self[cp]
+
+_UNICODE_SEPARATORS = UnicodeSeparators()
+
+def tokenize(text):
+    """Lowercased word tokens as UTF-8 bytes (translate + split: no regex, no per-token calls)."""
+    text = text.lower()
+    if text.isascii():
+        return text.encode("ascii").translate(SEPARATORS).split()
+    return text.translate(_UNICODE_SEPARATORS).encode("utf8").split()
+
+class TokenHashes(dict):
+    """
+    Stable 64-bit token hashes (crc32 | adler32), memoized per process:
+    lookups stay in C. Bounded: starts over at TOKEN_CACHE_SIZE tokens.
+    """
+
+    def __missing__(self, token):
+        if len(self) >= TOKEN_CACHE_SIZE:
+            self.clear()
+        h = self[token] = zlib.crc32(token) | (zlib.adler32(token) << 32)
+        return h
+
+_TOKEN_HASHES = TokenHashes()
+
+def _mix(h):
+    # splitmix64 finalizer: spreads the polynomial hash over all 64 bits
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+def ngram_hashes(texts, n=NGRAM):
+    """
+    64-bit hashes of every n-gram of every text, computed for the whole
+    batch at once. Returns (hashes, owner) with owner[i] = index of the
+    text n-gram i came from. Texts shorter than n tokens contribute nothing.
+    """
+    token_lists = [tokenize(text) if text else [] for text in texts]
+    lengths = np.array([len(t) for t in token_lists], dtype=np.int64)
+    tokens = np.fromiter(
+        map(_TOKEN_HASHES.__getitem__, itertools.chain.from_iterable(token_lists)), dtype=np.uint64, count=int(lengths.sum())
+    )
+    count = len(tokens) - n + 1
+    if count <= 0:
+        return np.zeros(0, np.uint64), np.zeros(0, np.int64)
+
+    # Polynomial hash of each window: sum(t[i + j] * P^(n-1-j)), wrapping mod 2^64
+    with np.errstate(over="ignore"):
+        h = np.zeros(count, dtype=np.uint64)
+        for j in range(n):
+            h = h * PRIME + tokens[j : j + count]
+        h = _mix(h)
+
+    # Drop windows that straddle two texts
+    owner = np.repeat(np.arange(len(texts)), lengths)
+    valid = owner[:count] == owner[n - 1 :]
+    return h[valid], owner[:count][valid]
+
+# --- BLOOM FILTER ---
+class BloomFilter:
+    """
+    Bit array of m bits probed at k positions per 64-bit hash (double hashing).
+    `bits` may be a read-only np.memmap: lookups touch k bytes per n-gram.
+    """
+
+    def __init__(self, bits, m, k):
+        self.bits = bits
+        self.m = np.uint64(m)
+        self.k = k
+
+    @classmethod
+    def sized(cls, n, fp_rate=FP_RATE):
+        m = max(64, math.ceil(-n * math.log(fp_rate) / math.log(2) ** 2))
+        k = max(1, round(m / max(n, 1) * math.log(2)))
+        return cls(np.zeros((m + 7) // 8, dtype=np.uint8), m, k)
+
+    def _positions(self, hashes):
+        with np.errstate(over="ignore"):
+            step = _mix(hashes ^ np.uint64(0x9E3779B97F4A7C15)) | np.uint64(1)
+            for i in range(self.k):
+                yield (hashes + np.uint64(i) * step) % self.m
+
+    def add(self, hashes):
+        for idx in self._positions(hashes):
+            byte = (idx >> np.uint64(3)).astype(np.int64)
+            mask = np.left_shift(1, (idx & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+            # OR together the masks landing in the same byte, then set them in one go
+            order = np.argsort(byte, kind="stable")
+            byte, mask = byte[order], mask[order]
+            starts = np.flatnonzero(np.r_[True, byte[1:] != byte[:-1]])
+            self.bits[byte[starts]] |= np.bitwise_or.reduceat(mask, starts)
+
+    def contains(self, hashes):
+        found = np.ones(len(hashes), dtype=bool)
+        for idx in self._positions(hashes):
+            byte = (idx >> np.uint64(3)).astype(np.int64)
+            found &= ((self.bits[byte] >> (idx & np.uint64(7)).astype(np.uint8)) & 1).astype(bool)
+        return found
+
+# --- EVAL CORPUS ---
+def eval_files():
+    files = []
+    for source in EVAL_SOURCES:
+        if source.is_dir():
+            files.extend(sorted(p for p in source.rglob("*") if p.suffix in (".txt", ".jsonl", ".parquet")))
+        elif source.exists():
+            files.append(source)
+    return files
+
+def row_texts(row, fields=EVAL_FIELDS):
+    """Strings worth checking in a row: the given fields + every message content."""
+    texts = [row[f] for f in fields if isinstance(row.get(f), str)]
+    for msg in row.get("messages") or []:
+        if isinstance(msg, dict) and isinstance(msg.get("content"), str):
+            texts.append(msg["content"])
+    # The user turn usually repeats the problem
+    return list(dict.fromkeys(texts))
+
+def iter_eval_texts(path):
+    if path.suffix == ".txt":
+        with path.open("r", encoding="utf-8") as f:
+            yield from (line.strip() for line in f if line.strip())
+    elif path.suffix == ".jsonl":
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield from row_texts(ujson.loads(line))
+    else:
+        table = pq.read_table(path)
+        for row in table.select([c for c in table.column_names if c in EVAL_FIELDS + ("messages",)]).to_pylist():
+            yield from row_texts(row)
+
+def filter_key(files):
+    h = hashlib.sha256()
+    for path in files:
+        h.update(f"{path}\x00".encode("utf8"))
+        h.update(path.read_bytes())
+    h.update(f"|{NGRAM}|{FP_RATE}|v{CACHE_VERSION}".encode("utf8"))
+    return h.hexdigest()[:16]
+
+def build_filter(files, batch=1024):
+    """Hashes every eval n-gram (deduplicated) into a filter sized for FP_RATE."""
+    chunks = []
+    for path in files:
+        texts = []
+        for text in iter_eval_texts(path):
+            texts.append(text)
+            if len(texts) >= batch:
+                chunks.append(np.unique(ngram_hashes(texts)[0]))
+                texts = []
+        chunks.append(np.unique(ngram_hashes(texts)[0]))
+    hashes = np.unique(np.concatenate(chunks)) if chunks else np.zeros(0, np.uint64)
+    bloom = BloomFilter.sized(len(hashes))
+    bloom.add(hashes)
+    return bloom, len(hashes)
+
+def load_filter():
+    """
+    Path of the eval-corpus filter (.npy, meant to be memory-mapped), built and
+    cached when the eval files, NGRAM or FP_RATE changed. None when there is
+    no eval corpus or it has no n-grams.
+    """
+    files = eval_files()
+    if not files:
+        return None
+    key = filter_key(files)
+    path = CACHE_DIR / f"evals.{key}.bloom.npy"
+    meta_path = path.with_suffix(".json")
+    if not path.exists():
+        print(f"🌸 Building n-gram filter from {len(files)} eval files...")
+        bloom, count = build_filter(files)
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for stale in CACHE_DIR.glob("evals.*.bloom.*"):
+            stale.unlink()
+        meta_path.write_text(ujson.dumps({"m": int(bloom.m), "k": bloom.k, "ngrams": count, "files": [str(f) for f in files]}))
+        temp_path = path.with_suffix(".tmp.npy")
+        np.save(temp_path, bloom.bits)
+        os.replace(temp_path, path)
+    meta = ujson.loads(meta_path.read_text())
+    if not meta["ngrams"]:
+        return None
+    print(f"🌸 N-gram filter: {meta['ngrams']:,} eval {NGRAM}-grams, {path.stat().st_size / 1e6:.1f}MB, k={meta['k']}")
+    return path
+
+def open_filter(path):
+    meta = ujson.loads(path.with_suffix(".json").read_text())
+    return BloomFilter(np.load(path, mmap_mode="r"), meta["m"], meta["k"])
+
+# --- FUSED STAGE ---
+class EvalOverlapStage(fused.Stage):
+    """
+    Drops rows whose problem or any message shares >= MIN_HITS NGRAM-grams
+    with the eval corpus. Workers memory-map the filter (only the path is pickled).
+    """
+    name = "eval_overlap"
+    columns = ("id", "problem", "messages")
+
+    def __init__(self, path):
+        self.path = path
+        self.bloom = None
+
+    def __getstate__(self):
+        return {"path": self.path, "bloom": None}
+
+    def setup(self):
+        self.bloom = open_filter(self.path)
+
+    def begin(self, path):
+        self.removed = 0
+        self.hits = []
+
+    def process(self, block):
+        live = block.live()
+        texts = []
+        owners = []
+        for i in live:
+            for text in row_texts(block.rows[i], ("problem",)):
+                texts.append(text)
+                owners.append(i)
+        hashes, owner = ngram_hashes(texts)
+        hits = np.bincount(owner[self.bloom.contains(hashes)], minlength=len(texts))
+        metrics.count("ngrams_checked", len(hashes))
+
+        flagged = {}
+        for t in np.flatnonzero(hits >= MIN_HITS).tolist():
+            flagged.setdefault(owners[t], int(hits[t]))
+        for i, count in flagged.items():
+            block.drop(i)
+            self.removed += 1
+            self.hits.append(f"  [HIT] Removed ID {block.rows[i].get('id')} ({count} shared {NGRAM}-grams with the evals)")
+        metrics.count("hits_ngram", len(flagged))
+
+    def summary(self):
+        return self.removed, self.hits
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the eval n-gram filter / check texts against it.")
+    parser.add_argument("texts", nargs="*", help="Texts to check")
+    args = parser.parse_args()
+
+    path = load_filter()
+    if path is None:
+        print(f"No eval n-grams under {', '.join(map(str, EVAL_SOURCES))}")
+    else:
+        bloom = open_filter(path)
+        for text in args.texts:
+            hashes, _ = ngram_hashes([text])
+            print(f"  {int(bloom.contains(hashes).sum())}/{len(hashes)} {NGRAM}-grams in the evals: {text[:80]}")
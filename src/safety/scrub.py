@@ -1,9 +1,19 @@
-import ujson
+import gc
+import hashlib
 import os
-import shutil
+import pickle
+import time
 from pathlib import Path
+import numpy as np
+import datasketch
 from datasketch import MinHash, MinHashLSH
-from tqdm import tqdm
+from datasketch.hashfunc import sha1_hash32, sha1_hash64
+
+from src.common import fused, metrics, schema
+from src.safety import ngrams
+from src.safety.keywords import load_keywords
+# Re-exported: dedup.py and older callers import these from here
+from src.common.fused import iter_blocks, merge_parts, split_shards
 
 # --- CONFIGURATION ---
 # Path to the text file containing the 10 banned problems
@@ -19,12 +29,27 @@ THRESHOLD = 0.85
 # Num Permutations for MinHash (128 is standard tradeoff for speed/accuracy)
 NUM_PERM = 128
 
-def get_minhash(text):
+# Serialized LSH index cache (keyed by blocklist hash, THRESHOLD, NUM_PERM)
+CACHE_DIR = Path("data/blocklist/.cache")
+CACHE_VERSION = 1
+
+# Worker processes for sharded scrubbing (1 = everything in-process)
+NUM_WORKERS = os.cpu_count() or 1
+
+# Target size of each byte-range shard handed to a worker
+SHARD_BYTES = 64 * 1024 * 1024
+
+# Batch signature engine: max shingles permuted in one NumPy block
+# (memory ~ SIG_BLOCK_SHINGLES * NUM_PERM * 8 bytes)
+SIG_BLOCK_SHINGLES = 32_768
+
+# Rows parsed and signed together (dedup.py; scrub blocks are fused.BLOCK_ROWS)
+ROW_BLOCK = fused.BLOCK_ROWS
+
+def get_shingles(text):
     """
-    Converts text into a MinHash signature using 3-gram shingling.
-    This makes matching robust to small edits or formatting changes.
+    Splits text into the 3-word shingles (as utf8 bytes) used for MinHash.
     """
-    m = MinHash(num_perm=NUM_PERM)
     # Normalize: lowercase and simple split
     tokens = text.lower().split()
     
@@ -32,106 +57,296 @@ def get_minhash(text):
     # e.g., "alice and bob" -> "alice and bob"
     if len(tokens) < 3:
         # Fallback for very short lines
-        m.update(" ".join(tokens).encode("utf8"))
-    else:
-        for i in range(len(tokens) - 2):
-            shingle = " ".join(tokens[i:i+3])
-            m.update(shingle.encode("utf8"))
+        return [" ".join(tokens).encode("utf8")]
+    return [" ".join(tokens[i:i+3]).encode("utf8") for i in range(len(tokens) - 2)]
+
+def get_minhash(text):
+    """
+    Converts text into a MinHash signature using 3-gram shingling.
+    This makes matching robust to small edits or formatting changes.
+    """
+    m = MinHash(num_perm=NUM_PERM)
+    for shingle in get_shingles(text):
+        m.update(shingle)
     return m
 
-def load_blocklist():
+# --- BATCH SIGNATURES ---
+# Same math as MinHash.update(), but every shingle of a block of rows is
+# permuted in one array op and reduced per row with np.minimum.reduceat.
+# Permutations, hash function and scheme come from a template MinHash, so
+# signatures are bit-identical to get_minhash() and the LSH thresholds hold.
+_TEMPLATE = None
+
+def _get_template():
+    global _TEMPLATE
+    if _TEMPLATE is None or len(_TEMPLATE) != NUM_PERM:
+        _TEMPLATE = MinHash(num_perm=NUM_PERM)
+    return _TEMPLATE
+
+def _fmix(hv, width):
+    # MurmurHash3 finalizer, applied by datasketch >= 2.0 before affine permutations
+    if width == 32:
+        s1, m1, s2, m2, s3 = np.uint32(16), np.uint32(0x85EBCA6B), np.uint32(13), np.uint32(0xC2B2AE35), np.uint32(16)
+    else:
+        s1, m1, s2, m2, s3 = np.uint64(33), np.uint64(0xFF51AFD7ED558CCD), np.uint64(33), np.uint64(0xC4CEB9FE1A85EC53), np.uint64(33)
+    hv = hv ^ (hv >> s1)
+    hv = hv * m1
+    hv = hv ^ (hv >> s2)
+    hv = hv * m2
+    return hv ^ (hv >> s3)
+
+def _hash_shingles(shingles, hashfunc):
+    """Hashes shingles to an integer array, skipping struct.unpack for the SHA1 defaults."""
+    if hashfunc is sha1_hash32:
+        return np.frombuffer(b"".join(hashlib.sha1(sh).digest()[:4] for sh in shingles), dtype="<u4")
+    if hashfunc is sha1_hash64:
+        return np.frombuffer(b"".join(hashlib.sha1(sh).digest()[:8] for sh in shingles), dtype="<u8")
+    return [hashfunc(sh) for sh in shingles]
+
+def _permute(hvs, template):
+    """Applies all NUM_PERM permutations to a column of shingle hashes."""
+    a, b = template.permutations
+    scheme = getattr(template, "scheme", "legacy") # pre-2.0 datasketch is legacy-only
+    if scheme == "legacy":
+        hv = np.array(hvs, dtype=np.uint64).reshape(-1, 1)
+        return np.bitwise_and((hv * a + b) % np.uint64((1 << 61) - 1), np.uint64((1 << 32) - 1))
+    width = 32 if scheme == "affine32" else 64
+    hv = np.array(hvs, dtype=np.uint32 if width == 32 else np.uint64).reshape(-1, 1)
+    return _fmix(hv, width) * a + b
+
+def batch_signatures(texts):
     """
-    Loads the blocklist and builds the LSH Index.
-    Treats EVERY non-empty line as a banned signature.
+    Returns a (len(texts), NUM_PERM) array of MinHash values,
+    row i bit-identical to get_minhash(texts[i]).hashvalues.
     """
-    print(f"🔒 Loading Blocklist from {BLOCKLIST_PATH}...")
-    
-    if not BLOCKLIST_PATH.exists():
-        raise FileNotFoundError(f"CRITICAL: Blocklist not found at {BLOCKLIST_PATH}. Please create it!")
+    template = _get_template()
+    hashfunc = template.hashfunc
+    sigs = np.empty((len(texts), NUM_PERM), dtype=template.hashvalues.dtype)
+
+    start = 0
+    while start < len(texts):
+        # Gather rows until the block holds SIG_BLOCK_SHINGLES shingles
+        shingles = []
+        offsets = []
+        end = start
+        while end < len(texts) and (not offsets or len(shingles) < SIG_BLOCK_SHINGLES):
+            offsets.append(len(shingles))
+            shingles.extend(get_shingles(texts[end]))
+            end += 1
 
+        # Every row has >= 1 shingle, so each reduceat segment is non-empty
+        phv = _permute(_hash_shingles(shingles, hashfunc), template)
+        sigs[start:end] = np.minimum.reduceat(phv, offsets, axis=0)
+        start = end
+    return sigs
+
+def batch_minhashes(texts):
+    """
+    Vectorized replacement for [get_minhash(t) for t in texts].
+    """
+    template = _get_template()
+    kwargs = {"permutations": template.permutations}
+    if hasattr(template, "scheme"):
+        kwargs["scheme"] = template.scheme
+    return [
+        MinHash(num_perm=NUM_PERM, hashvalues=sig, **kwargs)
+        for sig in batch_signatures(texts)
+    ]
+
+def blocklist_cache_key():
+    """
+    Fingerprint of everything the LSH index depends on: blocklist bytes,
+    THRESHOLD, NUM_PERM, the datasketch version (signature scheme) and
+    the cache format version.
+    """
+    h = hashlib.sha256()
+    h.update(BLOCKLIST_PATH.read_bytes())
+    h.update(f"|{THRESHOLD}|{NUM_PERM}|{datasketch.__version__}|v{CACHE_VERSION}".encode("utf8"))
+    return h.hexdigest()[:16]
+
+def build_blocklist_index():
+    """
+    Builds the LSH Index from the blocklist.
+    Treats EVERY non-empty line as a banned signature.
+    """
     lsh = MinHashLSH(threshold=THRESHOLD, num_perm=NUM_PERM)
     
     with BLOCKLIST_PATH.open("r", encoding="utf-8") as f:
         # Read lines, strip whitespace, remove empty lines
         lines = [line.strip() for line in f if line.strip()]
     
-    count = 0
-    for i, line in enumerate(lines):
-        # Skip lines that are too short to be unique (e.g., "Problem 1")
-        if len(line.split()) < 4:
-            continue
-            
-        m = get_minhash(line)
-        # Use line index as key
-        lsh.insert(f"ref_{i}", m)
-        count += 1
+    # Skip lines that are too short to be unique (e.g., "Problem 1")
+    # Use line index as key
+    keyed = [(f"ref_{i}", line) for i, line in enumerate(lines) if len(line.split()) >= 4]
+    minhashes = batch_minhashes([line for _, line in keyed])
+
+    with lsh.insertion_session() as session:
+        for (key, _), m in zip(keyed, minhashes):
+            session.insert(key, m)
         
+    return lsh, len(keyed)
+
+def load_blocklist():
+    """
+    Loads the blocklist LSH Index, from the on-disk cache when the blocklist,
+    THRESHOLD and NUM_PERM are unchanged, otherwise rebuilding (and re-caching) it.
+    """
+    print(f"🔒 Loading Blocklist from {BLOCKLIST_PATH}...")
+    
+    if not BLOCKLIST_PATH.exists():
+        raise FileNotFoundError(f"CRITICAL: Blocklist not found at {BLOCKLIST_PATH}. Please create it!")
+
+    cache_path = CACHE_DIR / f"{BLOCKLIST_PATH.stem}.{blocklist_cache_key()}.lsh.pkl"
+    if cache_path.exists():
+        # The index is ~b * N small sets; GC passes during unpickling dominate load time
+        gc.disable()
+        try:
+            with cache_path.open("rb") as f:
+                lsh, count = pickle.load(f)
+        finally:
+            gc.enable()
+        print(f"✅ Loaded {count} cached signatures ({cache_path.name}).")
+        return lsh
+
+    lsh, count = build_blocklist_index()
+
+    # Drop indexes for older blocklist versions, then write atomically
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for stale in CACHE_DIR.glob(f"{BLOCKLIST_PATH.stem}.*.lsh.pkl"):
+        stale.unlink()
+    temp_path = cache_path.with_suffix(".tmp")
+    with temp_path.open("wb") as f:
+        pickle.dump((lsh, count), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, cache_path)
+
     print(f"✅ Indexed {count} unique signatures from the blocklist.")
     return lsh
 
-def scrub_files():
-    # 1. Build the Safety Net
-    lsh = load_blocklist()
-    
-    total_removed = 0
-    files = list(DATA_DIR.glob("*.jsonl"))
-    
-    print(f"\n🧹 Starting Scrub on {len(files)} files...")
+def check_problems(problems, ids, lsh, matcher):
+    """
+    Runs the safety checks (LSH index, then the KeywordMatcher) on a block
+    of decoded 'problem' texts (row IDs for the hit log).
+    Returns one (verdict, hit_msg) per problem, where verdict is "keep", "skip"
+    (empty problem, dropped silently) or "hit" (contaminated, counted as removed).
+    """
+    results = [("skip", None)] * len(problems)
+    # We check the 'problem' text against the blocklist
+    rows = [(idx, prob_text) for idx, prob_text in enumerate(problems) if prob_text]
+    metrics.count("rows_skipped", len(problems) - len(rows))
 
-    for file_path in files:
-        print(f"Processing {file_path.name}...")
-        
-        # We write to a temp file to avoid corrupting data on crash
-        temp_path = file_path.with_suffix(".tmp")
-        removed_in_file = 0
-        kept_in_file = 0
-        
-        with file_path.open("r", encoding="utf-8") as fin, \
-             temp_path.open("w", encoding="utf-8") as fout:
-            
-            for line in tqdm(fin, desc=f"Scanning {file_path.name}", unit="rows"):
-                try:
-                    row = ujson.loads(line)
-                except ValueError:
-                    continue # Skip broken JSON lines
-                
-                # Check 1: Content Similarity
-                # We check the 'problem' text against the blocklist
-                prob_text = row.get("problem", "")
-                if not prob_text:
-                    continue
-                    
-                m = get_minhash(prob_text)
-                
-                # Query LSH
-                matches = lsh.query(m)
-                
-                if len(matches) > 0:
-                    removed_in_file += 1
-                    # Optional: Log the hit
-                    print(f"  [HIT] Removed ID {row.get('id')} (Matches: {matches})")
-                    continue
-                
-                # Check 2: Hard Keyword Check (Safety Belt)
-                # Sometimes LSH misses if the overlap is small but specific.
-                # Banning specific recent years is a good heuristic.
-                keywords = ["AIME 2024", "AIME 2025", "AIMO 2024", "AIMO 2025"]
-                if any(k in prob_text for k in keywords):
-                     removed_in_file += 1
-                     continue
-
-                # If safe, write to temp file
-                fout.write(line)
-                kept_in_file += 1
-
-        # Safety Atomic Swap
-        # Only replace the original file if the write finished successfully
-        shutil.move(temp_path, file_path)
-        
-        print(f"  -> Removed: {removed_in_file} | Kept: {kept_in_file}")
-        total_removed += removed_in_file
+    # Check 1: Content Similarity (signatures for the whole block at once)
+    with metrics.timer("minhash"):
+        minhashes = batch_minhashes([prob_text for _, prob_text in rows])
+
+    start = time.perf_counter()
+    for (idx, prob_text), m in zip(rows, minhashes):
+        # Query LSH (sorted so the hit log is stable across processes)
+        matches = sorted(lsh.query(m))
+
+        if len(matches) > 0:
+            # Optional: Log the hit
+            results[idx] = ("hit", f"  [HIT] Removed ID {ids[idx]} (Matches: {matches})")
+            metrics.count("hits_lsh")
+            continue
+
+        # Check 2: Hard Keyword Check (Safety Belt)
+        # Sometimes LSH misses if the overlap is small but specific.
+        # Contest names x years, URLs etc. (keywords.py), all in one pass over the text.
+        keyword = matcher.search(prob_text)
+        if keyword:
+            results[idx] = ("hit", f"  [HIT] Removed ID {ids[idx]} (Keyword: {keyword!r})")
+            metrics.count("hits_keyword")
+            continue
+
+        results[idx] = ("keep", None)
+    metrics.observe("lookup", time.perf_counter() - start) # LSH query + keyword check
+    metrics.count("rows_checked", len(rows))
+    return results
+
+# --- FUSED STAGE ---
+# The scan itself runs through src/common/fused.py: byte-range shards of
+# each JSONL file (Parquet: one task per shard file) go to worker processes
+# that receive the stage, and with it the blocklist index, once.
+
+class ScrubStage(fused.Stage):
+    """Drops rows whose problem matches the blocklist (LSH or keyword) or is empty."""
+    name = "scrub"
+    columns = ("id", "problem")
+
+    def __init__(self, lsh, matcher):
+        self.lsh = lsh
+        self.matcher = matcher
+
+    def begin(self, path):
+        self.removed = 0
+        self.hits = []
+
+    def process(self, block):
+        live = block.live()
+        rows = [block.rows[i] for i in live]
+        problems = [row.get("problem", "") for row in rows]
+        verdicts = check_problems(problems, [row.get("id") for row in rows], self.lsh, self.matcher)
+        for i, (verdict, hit) in zip(live, verdicts):
+            if hit:
+                self.hits.append(hit)
+            if verdict == "hit":
+                self.removed += 1
+            if verdict != "keep":
+                block.drop(i)
+
+    def summary(self):
+        return self.removed, self.hits
+
+def report(path, written, summaries):
+    """Prints the hits of one file's (removed, hits) stage summaries (in order); returns rows removed."""
+    removed_in_file = 0
+    for removed, hits in summaries:
+        for hit in hits:
+            print(hit)
+        removed_in_file += removed
+    print(f"  -> {path.name}: Removed: {removed_in_file} | Kept: {written}")
+    metrics.count("rows_removed", removed_in_file)
+    metrics.count("rows_kept", written)
+    return removed_in_file
+
+def load_stages():
+    """
+    The safety net as fused stages: blocklist LSH + keywords on the problem,
+    then n-gram overlap of the whole conversation with the eval corpus (if any).
+    """
+    with metrics.timer("load_blocklist"):
+        lsh = load_blocklist()
+        matcher = load_keywords()
+        eval_filter = ngrams.load_filter()
+    print(f"🔑 {len(matcher)} keyword patterns")
+    stages = [ScrubStage(lsh, matcher)]
+    if eval_filter:
+        stages.append(ngrams.EvalOverlapStage(eval_filter))
+    return stages
+
+def scrub_files(num_workers=NUM_WORKERS):
+    with metrics.stage("scrub", DATA_DIR / "scrub.metrics.json"):
+        # 1. Build the Safety Net (malformed rows go to quarantine first)
+        schema_stage = schema.SchemaStage(schema.QUARANTINE_DIR)
+        stages = [schema_stage, *load_stages()]
+
+        files = sorted(DATA_DIR.glob("*.jsonl"))
+        # Parquet shard directories (src/common/shards.py): one task per shard file
+        sharded = sorted(p for p in DATA_DIR.glob("*.parquet") if p.is_dir())
+
+        print(f"\n🧹 Starting Scrub on {len(files) + len(sharded)} files...")
+        if num_workers > 1:
+            print(f"⚡ Parallel mode: {num_workers} workers, {SHARD_BYTES // (1024 * 1024)}MB shards")
+
+        # 2. Scan; each file is only swapped in (atomically) once every file scanned cleanly
+        results = fused.run(files + sharded, stages, num_workers, SHARD_BYTES, desc="Scanning")
+        total_removed = sum(
+            report(path, written, [pair for task in summaries for pair in task[1:]])
+            for path, (written, summaries) in results.items()
+        )
+        schema_stage.report()
 
-    print(f"\n🎉 Scrub Complete. Total Contaminated Samples Removed: {total_removed}")
+        print(f"\n🎉 Scrub Complete. Total Contaminated Samples Removed: {total_removed}")
 
 if __name__ == "__main__":
-    scrub_files()
\ No newline at end of file
+    scrub_files()
@@ -0,0 +1,102 @@
+import abc
+import hashlib
+import random
+import time
+
+# Rough chars per token of English / LaTeX math text (for backends without a tokenizer)
+CHARS_PER_TOKEN = 3.5
+
+class GenerationBackend(abc.ABC):
+    """
+    Turns a list of prompts into one completion string per prompt.
+    generate_recursive.py only talks to this interface.
+    """
+    max_tokens = 1024
+
+    @abc.abstractmethod
+    def generate(self, prompts):
+        """One completion string per prompt, in order."""
+
+    def count_tokens(self, prompts):
+        """Estimated prompt lengths in tokens (used to schedule batches)."""
+        return [max(1, round(len(p) / CHARS_PER_TOKEN)) for p in prompts]
+
+class VLLMBackend(GenerationBackend):
+    """Standard vLLM setup used for the real synthesis run."""
+
+    def __init__(self, model="Qwen/Qwen2.5-Math-7B-Instruct", max_tokens=1024):
+        from vllm import LLM, SamplingParams
+
+        print("Initializing vLLM...")
+        self.max_tokens = max_tokens
+        self.llm = LLM(
+            model=model,
+            tensor_parallel_size=1,
+            gpu_memory_utilization=0.90,
+            max_model_len=4096,
+            trust_remote_code=True
+        )
+        self.params = SamplingParams(temperature=1.0, top_p=0.95, max_tokens=max_tokens)
+
+    def generate(self, prompts):
+        outputs = self.llm.generate(prompts, self.params)
+        return [out.outputs[0].text for out in outputs]
+
+    def count_tokens(self, prompts):
+        tokenizer = self.llm.get_tokenizer()
+        return [len(ids) for ids in tokenizer(prompts, add_special_tokens=False)["input_ids"]]
+
+class StubBackend(GenerationBackend):
+    """
+    Deterministic CPU stand-in: each completion is a pseudo-random function
+    of its prompt, so reruns and resumes reproduce the same text.
+    Optionally sleeps to model generation cost for offline benchmarks:
+    seconds_per_token * all prompt + completion tokens, plus
+    seconds_per_step * the decode steps of the batch. Requests run in waves
+    that fit in kv_tokens of KV cache (None = one wave), and each wave lasts
+    as long as its longest sequence.
+    """
+
+    WORDS = ["so", "we", "get", "then", "let", "x", "=", "+", "2", "3", "7", "thus", "the", "answer", "is"]
+
+    def __init__(self, max_tokens=1024, seconds_per_token=0.0, seconds_per_call=0.0, seconds_per_step=0.0,
+                 kv_tokens=None):
+        self.max_tokens = max_tokens
+        self.kv_tokens = kv_tokens
+        self.seconds_per_token = seconds_per_token
+        self.seconds_per_call = seconds_per_call
+        self.seconds_per_step = seconds_per_step
+
+    def complete(self, prompt):
+        seed = int.from_bytes(hashlib.sha1(prompt.encode("utf8")).digest()[:8], "little")
+        rng = random.Random(seed)
+        n = rng.randint(16, self.max_tokens)
+        return " ".join(rng.choice(self.WORDS) for _ in range(n))
+
+    def steps(self, lengths):
+        """Decode steps of a batch of sequence lengths (prompt + completion)."""
+        steps = used = longest = 0
+        for n in lengths:
+            if self.kv_tokens and used and used + n > self.kv_tokens:
+                steps += longest
+                used = longest = 0
+            used += n
+            longest = max(longest, n)
+        return steps + longest
+
+    def generate(self, prompts):
+        texts = [self.complete(p) for p in prompts]
+        lengths = [p + len(t.split()) for p, t in zip(self.count_tokens(prompts), texts)]
+        cost = self.seconds_per_call + self.seconds_per_token * sum(lengths)
+        cost += self.seconds_per_step * self.steps(lengths)
+        if cost:
+            time.sleep(cost)
+        return texts
+
+BACKENDS = {
+    "vllm": VLLMBackend,
+    "stub": StubBackend,
+}
+
+def get_backend(name, **kwargs):
+    return BACKENDS[name](**kwargs)
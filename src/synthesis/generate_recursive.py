@@ -1,21 +1,42 @@
+import argparse
+import ast
+import hashlib
+import os
+import queue
+import threading
+import time
 import ujson
-from datasets import load_dataset
-from vllm import LLM, SamplingParams
-from tqdm import tqdm
 from pathlib import Path
 import sys
 import random
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.common import answers, metrics
+from src.ingestion.engine import OutputHash
+from src.synthesis import schedule
+from src.synthesis.backends import BACKENDS, get_backend
 
 # --- CONFIG ---
 OUT = Path("data/processed/recursive.jsonl")
-OUT.parent.mkdir(parents=True, exist_ok=True)
+# Progress ledger: one JSON line per committed batch (candidate keys + OUT size and sha256)
+LEDGER = Path("data/processed/recursive.ledger")
 TARGET_COUNT = 50_000
-BATCH_SIZE = 2000 
-random.seed(42) # Replicability
+# "tokens": length-bucketed batches under schedule.BATCH_TOKENS (at most
+# BATCH_SIZE rows each); "fixed": consecutive BATCH_SIZE slices
+SCHEDULE = "tokens"
+BATCH_SIZE = 2000
+SEED = 42 # Replicability
+BACKEND = "vllm"
 
-# --- DATA LOADING ---
-print("Loading NuminaMath 1.5...")
-ds = load_dataset("AI-MO/NuminaMath-1.5", split="train")
+# Overlap generation of batch N+1 with post-processing / writing of batch N
+PIPELINE = True
+# Generated batches allowed to wait for post-processing (bounds memory)
+PIPELINE_DEPTH = 1
+
+# Processes checking generated answers against gold (1 = in-process)
+VERIFY_WORKERS = min(8, os.cpu_count() or 1)
 
 # 1. Define Source Tiers
 # Gold: The absolute best/hardest problems. We want ALL of these.
@@ -36,102 +57,354 @@ TIER_3_SOURCES = {
     "olympiads"       # ~117k
 }
 
-print("Filtering and Balancing Candidates...")
+# We have ~20k from Tiers 1&2. We need ~30k more to reach a safe buffer of 50-60k.
+TARGET_TIER3 = 40_000
+
+# --- DATA LOADING ---
+def load_rows(local_path=None):
+    if local_path:
+        from src.ingestion.engine import load_local
+        return load_local(local_path)
+    from datasets import load_dataset
+    print("Loading NuminaMath 1.5...")
+    return load_dataset("AI-MO/NuminaMath-1.5", split="train")
+
+def select_columns(ds, names):
+    """Returns the named columns as a pyarrow Table without materializing rows."""
+    if isinstance(ds, list): # local .jsonl fixture
+        return pa.table({n: [row.get(n) for row in ds] for n in names})
+    return ds.select_columns(names).with_format("arrow")[:]
+
+def rows_at(ds, idx):
+    """Materializes the rows at the given dataset indices, in that order."""
+    if isinstance(ds, list):
+        return [ds[i] for i in idx]
+    cols = ds[np.asarray(idx).tolist()] # datasets: list indexing is column-major
+    return [dict(zip(cols, vals)) for vals in zip(*cols.values())]
+
+class Candidates:
+    """
+    The selected candidates in generation order: an index array into the
+    source dataset. Rows are only materialized when a batch needs them.
+    """
+
+    def __init__(self, ds, order):
+        self.ds = ds
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
 
-candidates = []
-tier3_candidates = []
+    def take(self, positions):
+        return rows_at(self.ds, self.order[positions])
 
-for row in tqdm(ds):
+    def keys(self, chunk=10_000):
+        """candidate_key() of every candidate, reading only problem/answer."""
+        src = self.ds if isinstance(self.ds, list) else self.ds.select_columns(["problem", "answer"])
+        keys = []
+        for i in range(0, len(self.order), chunk):
+            keys.extend(candidate_key(row) for row in rows_at(src, self.order[i : i + chunk]))
+        return keys
+
+    def problems(self, positions, chunk=10_000):
+        """Yields the problem texts at `positions`, chunk by chunk."""
+        src = self.ds if isinstance(self.ds, list) else self.ds.select_columns(["problem"])
+        for i in range(0, len(positions), chunk):
+            yield [row["problem"] for row in rows_at(src, self.order[positions[i : i + chunk]])]
+
+def select_candidates(ds):
+    print("Filtering and Balancing Candidates...")
+    random.seed(SEED)
+
+    # Vectorized filters over the Arrow columns (nulls count as "no match")
+    cols = select_columns(ds, ["question_type", "source"])
     # Basic Filter: Must be a word problem
-    if row.get("question_type") != "math-word-problem":
-        continue
-        
-    src = row.get("source")
-    
-    if src in TIER_1_SOURCES or src in TIER_2_SOURCES:
-        candidates.append(row)
-    elif src in TIER_3_SOURCES:
-        tier3_candidates.append(row)
-
-# 2. Downsample Tier 3 (Olympiads)
-# We have ~20k from Tiers 1&2. We need ~30k more to reach a safe buffer of 50-60k.
-target_tier3 = 40_000
-if len(tier3_candidates) > target_tier3:
-    print(f"Downsampling 'olympiads' from {len(tier3_candidates)} to {target_tier3}...")
-    tier3_candidates = random.sample(tier3_candidates, target_tier3)
-
-# 3. Combine and Shuffle
-candidates.extend(tier3_candidates)
-random.shuffle(candidates) # CRITICAL: Mix them so we generate variety in the first 4 hours
-
-print(f"Final Candidate Count: {len(candidates)}")
-print(f"  - Tier 1&2 (High Priority): ~20,000")
-print(f"  - Tier 3 (Olympiads): {len(tier3_candidates)}")
-
-if len(candidates) == 0:
-    print("CRITICAL ERROR: No candidates found.")
-    sys.exit(1)
-
-# --- MODEL INFERENCE (Standard vLLM setup) ---
-print("Initializing vLLM...")
-llm = LLM(
-    model="Qwen/Qwen2.5-Math-7B-Instruct",
-    tensor_parallel_size=1,
-    gpu_memory_utilization=0.90, 
-    max_model_len=4096,
-    trust_remote_code=True
-)
-
-params = SamplingParams(temperature=1.0, top_p=0.95, max_tokens=1024)
+    is_word_problem = pc.equal(cols["question_type"], "math-word-problem")
+
+    def tier_mask(sources):
+        in_tier = pc.is_in(cols["source"], value_set=pa.array(sorted(sources), pa.string()))
+        mask = pc.fill_null(pc.and_(is_word_problem, in_tier), False)
+        return np.flatnonzero(mask.to_numpy(zero_copy_only=False))
+
+    candidate_idx = tier_mask(TIER_1_SOURCES | TIER_2_SOURCES)
+    tier3_idx = tier_mask(TIER_3_SOURCES)
+
+    # 2. Downsample Tier 3 (Olympiads)
+    # random.sample / random.shuffle only look at the population size, so
+    # running them on positions draws exactly what the row lists used to.
+    if len(tier3_idx) > TARGET_TIER3:
+        print(f"Downsampling 'olympiads' from {len(tier3_idx)} to {TARGET_TIER3}...")
+        tier3_idx = tier3_idx[random.sample(range(len(tier3_idx)), TARGET_TIER3)]
+
+    # 3. Combine and Shuffle
+    order = np.concatenate([candidate_idx, tier3_idx])
+    perm = list(range(len(order)))
+    random.shuffle(perm) # CRITICAL: Mix them so we generate variety in the first 4 hours
+    order = order[perm]
+
+    print(f"Final Candidate Count: {len(order)}")
+    print(f"  - Tier 1&2 (High Priority): {len(candidate_idx)}")
+    print(f"  - Tier 3 (Olympiads): {len(tier3_idx)}")
+    return Candidates(ds, order)
+
+def candidate_key(row):
+    """Stable identity of a candidate across restarts (problem + reference answer)."""
+    h = hashlib.sha1(f"{row['problem']}\x00{row['answer']}".encode("utf8"))
+    return h.hexdigest()[:16]
+
+# --- PROGRESS LEDGER ---
+def load_ledger():
+    """
+    Replays the ledger. Returns (done_keys, written, OutputHash of OUT). OUT is
+    truncated to the size recorded by the last committed batch, dropping any
+    half-written batch, but only if its committed part is still byte-identical
+    (scrub / dedup rewrite it in place: resuming on top of that is refused).
+    """
+    done = set()
+    written = 0
+    out_bytes = 0
+    out_hash = None
+    valid_bytes = 0
+    if LEDGER.exists():
+        with LEDGER.open("rb") as f:
+            for line in f:
+                try:
+                    entry = ujson.loads(line)
+                except ValueError:
+                    break # torn final entry from a crash
+                done.update(entry["keys"])
+                written = entry["written"]
+                out_bytes = entry["out_bytes"]
+                out_hash = entry.get("sha256")
+                valid_bytes += len(line)
+        with LEDGER.open("r+b") as f:
+            f.truncate(valid_bytes)
+
+    size = OUT.stat().st_size if OUT.exists() else 0
+    hint = f"{OUT} was changed outside this script (scrub / dedup rewrite it in place); rerun with --fresh."
+    if size < out_bytes:
+        raise ValueError(f"Cannot resume: {OUT} has {size} bytes, the ledger committed {out_bytes}. {hint}")
+    hasher = OutputHash(OUT, out_bytes)
+    if out_hash is not None and hasher.h.hexdigest() != out_hash:
+        raise ValueError(f"Cannot resume: the first {out_bytes} bytes of {OUT} differ from the ledger. {hint}")
+    if size > out_bytes:
+        with OUT.open("r+b") as f:
+            f.truncate(out_bytes)
+    return done, written, hasher
+
+def commit_batch(lines, keys, written, hasher):
+    """
+    Appends a batch to OUT, then records it in the ledger. The ledger entry
+    is the commit point: a crash before it is rolled back by load_ledger().
+    """
+    with OUT.open("a") as f:
+        start = f.tell()
+        for line in lines:
+            f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    size = OUT.stat().st_size
+    entry = {"keys": keys, "written": written, "out_bytes": size, "sha256": hasher.advance(size)}
+    metrics.count("bytes_written", entry["out_bytes"] - start)
+    with LEDGER.open("a") as f:
+        f.write(ujson.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def build_sample(row, wrong_sol):
+    """Returns the Recursive Sample for a generation already judged wrong."""
+    # Construct Recursive Sample
+    full_content = (
+        f"<think>{wrong_sol}</think>\n"
+        f"<wait>\n"
+        f"<critique>Wait, I made a mistake. Let me re-calculate.</critique>\n"
+        f"<think>{row['solution']}</think>\n"
+        f"<answer>{row['answer']}</answer>"
+    )
+
+    return {
+        "source": "recursive_correction",
+        "problem": row["problem"],
+        "messages": [
+            {"role": "user", "content": row["problem"]},
+            {"role": "assistant", "content": full_content}
+        ]
+    }
 
 # --- BATCH GENERATION ---
-written = 0
-
-for i in range(0, len(candidates), BATCH_SIZE):
-    if written >= TARGET_COUNT:
-        break
-        
-    batch = candidates[i : i + BATCH_SIZE]
-    prompts = [row["problem"] for row in batch]
-    
-    print(f"Generating batch {i} - {i+len(batch)}...")
-    outputs = llm.generate(prompts, params)
-    
-    new_samples = []
-    
-    for row, output in zip(batch, outputs):
-        wrong_sol = output.outputs[0].text.strip()
-        correct_ans = str(row["answer"]).strip()
-        
-        # Robust check: Answer shouldn't be at the end of the wrong solution
-        if correct_ans in wrong_sol[-200:]: 
-            continue 
-
-        # Construct Recursive Sample
-        full_content = (
-            f"<think>{wrong_sol}</think>\n"
-            f"<wait>\n"
-            f"<critique>Wait, I made a mistake. Let me re-calculate.</critique>\n"
-            f"<think>{row['solution']}</think>\n"
-            f"<answer>{row['answer']}</answer>"
+def iter_generated(backend, batches, pipeline=PIPELINE):
+    """
+    Yields (batch, texts) for each batch. With pipeline=True a background
+    thread keeps generating the next PIPELINE_DEPTH batches while the caller
+    post-processes and commits the current one.
+    Per-batch generation latency goes to the "generate" timer.
+    """
+    def run(batch):
+        with metrics.timer("generate"):
+            return backend.generate([row["problem"] for row in batch])
+
+    if not pipeline:
+        for batch in batches:
+            yield batch, run(batch)
+        return
+
+    results = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for batch in batches:
+                if stop.is_set():
+                    return
+                results.put((batch, run(batch)))
+            results.put(None)
+        except BaseException as e:
+            results.put(e)
+
+    thread = threading.Thread(target=producer, name="generator", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Early exit (target reached / error): unblock and retire the producer.
+        # Batches it already generated are simply not committed.
+        stop.set()
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def report_timings(wall):
+    timings = metrics.current()
+    print("Stage timings:")
+    for stage in ("generate", "postprocess", "commit"):
+        print(f"  - {stage:<11} {timings.total(stage):8.1f}s")
+    print(f"  - wall        {wall:8.1f}s")
+    # Share of wall time the generator (GPU) was busy
+    print(f"  Generator utilization: {100 * timings.total('generate') / max(wall, 1e-9):.1f}%")
+
+def plan_batches(backend, candidates, todo, scheduler=SCHEDULE):
+    """Batches of positions into `todo`, in generation order."""
+    with metrics.timer("schedule"):
+        tokens = np.array(
+            [n for problems in candidates.problems(todo) for n in backend.count_tokens(problems)], dtype=np.int64
         )
+        if scheduler == "tokens":
+            plan = schedule.token_batches(tokens, backend.max_tokens, max_rows=BATCH_SIZE, seed=SEED)
+        else:
+            plan = schedule.fixed_batches(len(todo), BATCH_SIZE)
+    if len(plan):
+        waste = schedule.padding_waste(plan, tokens, backend.max_tokens)
+        print(f"Scheduled {len(todo)} candidates (~{tokens.sum():,} prompt tokens) into {len(plan)} batches, "
+              f"avg {len(todo) / len(plan):.0f} rows, padding waste {100 * waste:.1f}%")
+        metrics.count("batches", len(plan))
+        metrics.count("prompt_tokens", int(tokens.sum()))
+    return plan
+
+def generate(backend, candidates, fresh=False, pipeline=PIPELINE, scheduler=SCHEDULE):
+    with metrics.stage("synthesis", metrics.metrics_path(OUT)):
+        OUT.parent.mkdir(parents=True, exist_ok=True)
+        if fresh:
+            for path in (OUT, LEDGER):
+                if path.exists():
+                    path.unlink()
+
+        done, written, hasher = load_ledger()
+        if done:
+            print(f"Resuming: {len(done)} candidates already processed, {written} samples saved.")
+        if written >= TARGET_COUNT:
+            print(f"Target already reached ({written}/{TARGET_COUNT} samples), nothing to do.")
+            return written
+        todo = np.array([i for i, key in enumerate(candidates.keys()) if key not in done], dtype=np.int64)
+        plan = plan_batches(backend, candidates, todo, scheduler)
+        progress = {"written": written}
+
+        def batches():
+            for positions in plan:
+                # Full batches only; an overshooting last batch is trimmed at commit
+                if progress["written"] >= TARGET_COUNT:
+                    return
+                yield candidates.take(todo[positions])
+
+        print(f"Generating {len(todo)} candidates in {len(plan)} batches (schedule={scheduler}, pipeline={pipeline})...")
+        metrics.count("candidates_skipped", len(candidates) - len(todo))
+        wall_start = time.perf_counter()
+        verifier = answers.make_pool(VERIFY_WORKERS) if VERIFY_WORKERS > 1 else None
+        try:
+            for batch, texts in iter_generated(backend, batches(), pipeline):
+                if written >= TARGET_COUNT:
+                    break
+                start = time.perf_counter()
+                wrong_sols = [text.strip() for text in texts]
+                # Keep only generations whose final answer is NOT equivalent to the gold one
+                correct = answers.verify_batch(
+                    [(sol, str(row["answer"])) for row, sol in zip(batch, wrong_sols)], pool=verifier
+                )
+                wrong = [i for i, ok in enumerate(correct) if not ok]
+                if len(wrong) > TARGET_COUNT - written:
+                    # Batch generated ahead (pipeline) overshoots: commit only the candidates
+                    # up to the one that reaches the target, the rest stay undone
+                    cut = wrong[TARGET_COUNT - written - 1] + 1
+                    batch, wrong_sols, correct = batch[:cut], wrong_sols[:cut], correct[:cut]
+                new_samples = [
+                    ujson.dumps(build_sample(row, sol))
+                    for row, sol, ok in zip(batch, wrong_sols, correct)
+                    if not ok
+                ]
+                metrics.observe("postprocess", time.perf_counter() - start)
+                metrics.count("candidates", len(batch))
+                metrics.count("answers_correct", sum(correct))
+                metrics.count("samples_written", len(new_samples))
+
+                with metrics.timer("commit"):
+                    written += len(new_samples)
+                    commit_batch(new_samples, [candidate_key(row) for row in batch], written, hasher)
+                progress["written"] = written
+                print(f"Progress: {written}/{TARGET_COUNT} samples saved.")
+
+                if written >= TARGET_COUNT:
+                    break
+        finally:
+            if verifier is not None:
+                verifier.shutdown()
+        report_timings(time.perf_counter() - wall_start)
+        print("Done.")
+        return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Recursive error-correction synthesis.")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=BACKEND)
+    parser.add_argument("--input", help="Local NuminaMath-style .jsonl/.arrow fixture instead of the HF dataset")
+    parser.add_argument("--fresh", action="store_true", help="Discard OUT and the ledger and start over")
+    parser.add_argument("--no-pipeline", action="store_true", help="Run generate / post-process / write strictly in sequence")
+    parser.add_argument("--schedule", choices=["tokens", "fixed"], default=SCHEDULE,
+                        help="Length-bucketed token-budget batches, or fixed BATCH_SIZE slices")
+    parser.add_argument("--backend-arg", action="append", default=[], metavar="NAME=VALUE",
+                        help="Backend keyword argument, e.g. seconds_per_step=1e-4 for the stub")
+    args = parser.parse_args()
+
+    candidates = select_candidates(load_rows(args.input))
+    if len(candidates) == 0:
+        print("CRITICAL ERROR: No candidates found.")
+        sys.exit(1)
+
+    # --- MODEL INFERENCE ---
+    backend_args = {}
+    for item in args.backend_arg:
+        name, value = item.split("=", 1)
+        try:
+            backend_args[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            backend_args[name] = value
+    backend = get_backend(args.backend, **backend_args)
+    generate(backend, candidates, fresh=args.fresh, pipeline=not args.no_pipeline, scheduler=args.schedule)
 
-        sample = {
-            "source": "recursive_correction",
-            "problem": row["problem"],
-            "messages": [
-                {"role": "user", "content": row["problem"]},
-                {"role": "assistant", "content": full_content}
-            ]
-        }
-        new_samples.append(ujson.dumps(sample))
-    
-    if new_samples:
-        with OUT.open("a") as f:
-            for line in new_samples:
-                f.write(line + "\n")
-            
-    written += len(new_samples)
-    print(f"Progress: {written}/{TARGET_COUNT} samples saved.")
-
-print("Done.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import argparse
+import bisect
+import hashlib
+import inspect
+import os
+import shutil
+import ujson
+import datasets
+import numpy as np
+import pyarrow as pa
+from pathlib import Path
+
+from src.common import shards
+
+# --- CONFIGURATION ---
+# Default input: the gold mix (x.parquet/ shards are used when present)
+DATASET_PATH = "data/gold/aimo_system2_final.jsonl"
+TOKENIZER = "Qwen/Qwen2.5-Math-7B-Instruct"
+MAX_SEQ_LENGTH = 4096
+
+# Tokenized / packed datasets, one directory per cache key
+CACHE_DIR = Path("data/tokenized")
+
+# Tokenizer processes (datasets.map num_proc)
+NUM_PROC = os.cpu_count() or 1
+MAP_BATCH_SIZE = 1000
+
+def format_prompt(example):
+    """
+    Standardizes the prompt format for Qwen 2.5.
+    Converts Universal Schema -> ChatML format.
+    """
+    msgs = example["messages"]
+    # Qwen Chat Template: <|im_start|>role\ncontent<|im_end|>\n
+    prompt = f"<|im_start|>user\n{msgs[0]['content']}<|im_end|>\n"
+    prompt += f"<|im_start|>assistant\n{msgs[1]['content']}<|im_end|>\n"
+    return {"text": prompt}
+
+# --- CACHE KEY ---
+def tokenizer_fingerprint(tokenizer):
+    """Name + full serialized vocab/merges, so a retrained tokenizer never hits a stale cache."""
+    h = hashlib.sha256(str(tokenizer.name_or_path).encode("utf8"))
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        h.update(backend.to_str().encode("utf8"))
+    else:
+        h.update(ujson.dumps(sorted(tokenizer.get_vocab().items())).encode("utf8"))
+    return h.hexdigest()
+
+def cache_key(path, tokenizer, max_len, pack):
+    """sha256 over the input files, tokenizer, chat template and packing settings."""
+    files = shards.shard_files(path) if shards.is_sharded(path) else [Path(path)]
+    payload = {
+        "files": [(f.name, f.stat().st_size, f.stat().st_mtime_ns) for f in files],
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        # Editing format_prompt changes the key
+        "template": hashlib.sha256(inspect.getsource(format_prompt).encode("utf8")).hexdigest(),
+        "max_len": max_len,
+        "pack": pack,
+    }
+    return hashlib.sha256(ujson.dumps(payload, sort_keys=True).encode("utf8")).hexdigest()[:16]
+
+# --- TOKENIZATION ---
+def tokenize(dataset, tokenizer, max_len=MAX_SEQ_LENGTH, num_proc=NUM_PROC):
+    """ChatML-formats and tokenizes every row in parallel; keeps only input_ids."""
+    def encode(batch):
+        texts = [format_prompt({"messages": msgs})["text"] for msgs in batch["messages"]]
+        return {"input_ids": tokenizer(texts, truncation=True, max_length=max_len)["input_ids"]}
+
+    return dataset.map(
+        encode,
+        batched=True,
+        batch_size=MAP_BATCH_SIZE,
+        num_proc=num_proc if num_proc > 1 else None,
+        remove_columns=dataset.column_names,
+        desc="Tokenizing",
+    )
+
+# --- PACKING ---
+def token_arrays(tokenized):
+    """(offsets, flat token ids) of the input_ids column; sample i is values[offsets[i]:offsets[i+1]]."""
+    ids = tokenized.data.column("input_ids")
+    # 64-bit offsets: int32 ones overflow once a dataset passes 2^31 tokens
+    if not pa.types.is_large_list(ids.type):
+        ids = ids.cast(pa.large_list(ids.type.value_type))
+    ids = ids.combine_chunks() if ids.num_chunks else pa.array([], ids.type)
+    offsets = ids.offsets.to_numpy().astype(np.int64)
+    values = ids.flatten().to_numpy()
+    return offsets - offsets[0], values
+
+def pack_bins(lengths, max_len=MAX_SEQ_LENGTH):
+    """
+    Best-fit decreasing: groups sample indices into bins of at most max_len
+    tokens. Deterministic; every sample lands in exactly one bin.
+    """
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    bins = []
+    # Remaining space of the open bins, kept sorted (caps[i] belongs to cap_bins[i])
+    caps = []
+    cap_bins = []
+    for i in order.tolist():
+        n = int(lengths[i])
+        j = bisect.bisect_left(caps, n) # tightest open bin that still fits
+        if j < len(caps):
+            space = caps.pop(j) - n
+            b = cap_bins.pop(j)
+            bins[b].append(i)
+        else:
+            space = max_len - n
+            b = len(bins)
+            bins.append([i])
+        if space > 0:
+            k = bisect.bisect_left(caps, space)
+            caps.insert(k, space)
+            cap_bins.insert(k, b)
+    # Samples keep their dataset order inside a bin
+    return [sorted(b) for b in bins]
+
+def pack(tokenized, max_len=MAX_SEQ_LENGTH):
+    """
+    Packs a tokenized dataset into rows of <= max_len tokens:
+      input_ids    - the samples of a bin, back to back
+      position_ids - restart at 0 for every sample (marks the attention
+                     boundaries for padding-free / varlen attention)
+      labels       - input_ids, with -100 on each sample's first token so
+                     no sample is trained to predict its neighbour
+    """
+    offsets, values = token_arrays(tokenized)
+    lengths = np.diff(offsets)
+
+    bins = pack_bins(lengths, max_len)
+    order = np.fromiter((i for b in bins for i in b), dtype=np.int64, count=len(lengths))
+    seg_lens = lengths[order]
+    seg_starts = np.concatenate([[0], np.cumsum(seg_lens)[:-1]]).astype(np.int64)
+
+    # Gather every sample's tokens in bin order, fully vectorized
+    within = np.arange(seg_lens.sum()) - np.repeat(seg_starts, seg_lens)
+    packed_ids = values[np.repeat(offsets[order], seg_lens) + within]
+    labels = packed_ids.astype(np.int64)
+    labels[seg_starts[seg_lens > 0]] = -100
+
+    bin_sizes = np.array([len(b) for b in bins], dtype=np.int64)
+    bin_tokens = np.array([lengths[b].sum() for b in bins], dtype=np.int64)
+    bin_offsets = pa.array(np.concatenate([[0], np.cumsum(bin_tokens)]).astype(np.int64))
+
+    table = pa.table({
+        "input_ids": pa.LargeListArray.from_arrays(bin_offsets, pa.array(packed_ids)),
+        "labels": pa.LargeListArray.from_arrays(bin_offsets, pa.array(labels)),
+        "position_ids": pa.LargeListArray.from_arrays(bin_offsets, pa.array(within.astype(np.int64))),
+        "num_samples": pa.array(bin_sizes),
+    })
+    return datasets.Dataset(table)
+
+def collate_packed(features, pad_id=0):
+    """
+    Stacks packed rows into [batch, longest row] tensors. Samples are only
+    isolated by their position_ids restarts, which needs the varlen
+    flash-attention path (train_pilot checks it is active). Padding is a
+    segment of its own (positions from 0, labels -100), so no sample
+    attends to it or is trained on it.
+    """
+    import torch
+    width = max(len(f["input_ids"]) for f in features)
+    batch = {key: torch.full((len(features), width), fill, dtype=torch.long)
+             for key, fill in (("input_ids", pad_id), ("labels", -100))}
+    batch["position_ids"] = torch.arange(width).repeat(len(features), 1)
+    for i, f in enumerate(features):
+        n = len(f["input_ids"])
+        for key in ("input_ids", "labels", "position_ids"):
+            batch[key][i, :n] = torch.tensor(f[key], dtype=torch.long)
+        batch["position_ids"][i, n:] -= n
+    return batch
+
+# --- DRIVER ---
+def build(path, tokenizer, max_len=MAX_SEQ_LENGTH, pack_samples=True, num_proc=NUM_PROC):
+    """
+    Returns the ready-to-train dataset for path, building it on a cache miss.
+    Cached under CACHE_DIR/<stem>-<key> (memory-mapped on load).
+    """
+    path = shards.find_source(path)
+    key = cache_key(path, tokenizer, max_len, pack_samples)
+    out = CACHE_DIR / f"{Path(path).name.split('.')[0]}-{key}"
+    if out.exists():
+        print(f"♻️  Using pre-tokenized {out}")
+        return datasets.load_from_disk(str(out))
+
+    print(f"🔤 Pre-tokenizing {path} (max_len={max_len}, pack={pack_samples})...")
+    tokenized = tokenize(shards.load_dataset(path), tokenizer, max_len, num_proc)
+    result = pack(tokenized, max_len) if pack_samples else tokenized
+    report(tokenized, result, max_len, pack_samples)
+
+    temp_path = out.with_name(out.name + ".tmp")
+    shutil.rmtree(temp_path, ignore_errors=True)
+    result.save_to_disk(str(temp_path))
+    # Old keys for the same input are dead weight
+    for stale in CACHE_DIR.glob(f"{out.name.rsplit('-', 1)[0]}-*"):
+        if stale != temp_path:
+            shutil.rmtree(stale)
+    temp_path.rename(out)
+    return datasets.load_from_disk(str(out))
+
+def report(tokenized, result, max_len, pack_samples):
+    lengths = np.diff(token_arrays(tokenized)[0])
+    real = int(lengths.sum())
+    print(f"  - {len(lengths)} samples, {real} tokens (mean {real / max(len(lengths), 1):.0f}, max {lengths.max(initial=0)})")
+    if pack_samples:
+        slots = len(result) * max_len
+        print(f"  - packed into {len(result)} rows of {max_len}: {100 * real / max(slots, 1):.1f}% real tokens")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokenize + pack a Universal Schema dataset for training.")
+    parser.add_argument("--input", default=DATASET_PATH)
+    parser.add_argument("--tokenizer", default=TOKENIZER)
+    parser.add_argument("--max-len", type=int, default=MAX_SEQ_LENGTH)
+    parser.add_argument("--no-pack", action="store_true", help="Tokenize only (one sample per row)")
+    parser.add_argument("--num-proc", type=int, default=NUM_PROC)
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+    build(args.input, tokenizer, args.max_len, not args.no_pack, args.num_proc)
@@ -1,26 +1,26 @@
+import functools
 from unsloth import FastLanguageModel
 from trl import SFTTrainer
 from transformers import TrainingArguments
-from datasets import load_dataset
 import torch
-import os
+
+from src.common import shards
+from src.training import pretokenize
+from src.training.pretokenize import format_prompt
 
 # --- CONFIGURATION ---
 # Point to the micro dataset we just designed
+# (pilot_micro.parquet/ next to it is used instead when build_pilot wrote shards)
 DATASET_PATH = "/teamspace/studios/this_studio/aimo_datafoundry/data/gold/pilot_micro.jsonl" 
 OUTPUT_DIR = "checkpoints/aimo_pilot_micro"
 MAX_SEQ_LENGTH = 4096 # Sufficient for pilot; full run uses 8192
 
-def format_prompt(example):
-    """
-    Standardizes the prompt format for Qwen 2.5.
-    Converts Universal Schema -> ChatML format.
-    """
-    msgs = example["messages"]
-    # Qwen Chat Template: <|im_start|>role\ncontent<|im_end|>\n
-    prompt = f"<|im_start|>user\n{msgs[0]['content']}<|im_end|>\n"
-    prompt += f"<|im_start|>assistant\n{msgs[1]['content']}<|im_end|>\n"
-    return {"text": prompt}
+# Train on the pre-tokenized, packed dataset from pretokenize.py (cached on disk):
+# no per-launch tokenization and little padding; sample boundaries travel as
+# position_ids. Under Unsloth's patched attention only the flash-attention
+# varlen path is known to honour them (otherwise packed samples may attend to
+# each other), so PACK requires flash-attn.
+PACK = True
 
 def train():
     print(f"🚀 Initializing Pilot Run on {torch.cuda.get_device_name(0)}...")
@@ -31,7 +31,13 @@ def train():
         max_seq_length = MAX_SEQ_LENGTH,
         dtype = None, # Auto-detect (BF16 on H100)
         load_in_4bit = False, # Train in 16-bit for max accuracy on H100
+        **({"attn_implementation": "flash_attention_2"} if PACK else {}),
     )
+    if PACK and model.config._attn_implementation != "flash_attention_2":
+        raise RuntimeError(
+            f"❌ Packed training needs flash_attention_2 (got {model.config._attn_implementation}): "
+            "install flash-attn or set PACK = False."
+        )
 
     # 2. Add LoRA Adapters
     model = FastLanguageModel.get_peft_model(
@@ -47,14 +53,27 @@ def train():
     )
 
     # 3. Load & Format Data
-    if not os.path.exists(DATASET_PATH):
+    dataset_path = shards.find_source(DATASET_PATH)
+    if not dataset_path.exists():
         raise FileNotFoundError(f"❌ Dataset not found at {DATASET_PATH}. Run build_micro.py first!")
         
-    print(f"📚 Loading Dataset: {DATASET_PATH}...")
-    dataset = load_dataset("json", data_files=DATASET_PATH, split="train")
-    print(f"   -> Loaded {len(dataset)} samples.")
-    
-    dataset = dataset.map(format_prompt)
+    if PACK:
+        dataset = pretokenize.build(dataset_path, tokenizer, MAX_SEQ_LENGTH)
+        print(f"   -> Loaded {sum(dataset['num_samples'])} samples in {len(dataset)} packed rows.")
+        data_kwargs = dict(
+            data_collator = functools.partial(pretokenize.collate_packed, pad_id=tokenizer.pad_token_id),
+            dataset_kwargs = {"skip_prepare_dataset": True},
+        )
+    else:
+        print(f"📚 Loading Dataset: {dataset_path}...")
+        # Parquet shards load straight into Arrow; JSONL is parsed by the json builder
+        dataset = shards.load_dataset(dataset_path)
+        print(f"   -> Loaded {len(dataset)} samples.")
+        dataset = dataset.map(format_prompt)
+        data_kwargs = dict(
+            dataset_text_field = "text",
+            dataset_num_proc = 8,
+        )
 
     # 4. Training Arguments (Tuned for H100 Speed)
     print("🔥 Starting Training...")
@@ -62,11 +81,10 @@ def train():
         model = model,
         tokenizer = tokenizer,
         train_dataset = dataset,
-        dataset_text_field = "text",
         max_seq_length = MAX_SEQ_LENGTH,
-        dataset_num_proc = 8,
+        **data_kwargs,
         args = TrainingArguments(
-            per_device_train_batch_size = 8,  # H100 80GB can handle 8-16 easily with 4k context
+            per_device_train_batch_size = 8,  # H100 80GB can handle 8-16 easily with 4k context (packed: 8 full rows)
             gradient_accumulation_steps = 2,  # Effective Batch Size = 16
             warmup_steps = 50,
             num_train_epochs = 1,             # 1 Epoch is perfect for a pilot
@@ -80,6 +98,7 @@ def train():
             lr_scheduler_type = "cosine",
             seed = 3407,
             save_strategy = "no",             # Skip intermediate checkpoints to save disk/time
+            remove_unused_columns = not PACK, # keep position_ids for the packed collator
         ),
     )
 